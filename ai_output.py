@@ -0,0 +1,131 @@
+"""
+Structured model output: response schemas and a tolerant parser.
+
+Requests ask for strict JSON-schema output, so well-formed replies always
+have the expected shape. Replies can still arrive cut short (finish_reason
+"length", a dropped connection), wrapped in code fences, or from a model
+that ignores the schema. parse() then repairs the JSON instead of failing:
+an unterminated string is closed, incomplete trailing members are dropped,
+and open arrays/objects are closed. A truncated explanation is kept as is,
+and quiz items are kept only when complete (pack_quiz drops the rest).
+
+Outcomes: "ok" (parsed as sent), "repaired" (recovered from broken JSON),
+"failed" (no usable text).
+"""
+import json
+import re
+
+EXPLANATION_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "explanation",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "explanation": {"type": "string"},
+                "quiz": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "question": {"type": "string"},
+                            "options": {"type": "array", "items": {"type": "string"}},
+                            "correct": {"type": "integer"},
+                        },
+                        "required": ["question", "options", "correct"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["explanation", "quiz"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+FOLLOWUP_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "followup",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "answer": {"type": "string"},
+                "memo": {"type": "string"},
+            },
+            "required": ["answer", "memo"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+
+def _scan(text):
+    """Returns (open containers, inside a string?, cut points) for a JSON prefix."""
+    stack, in_string, escaped, cuts = [], False, False, []
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            cuts.append(i + 1)
+        elif ch == ",":
+            cuts.append(i)
+    return stack, in_string, escaped, cuts
+
+
+def _close(prefix):
+    stack, in_string, escaped, _ = _scan(prefix)
+    if escaped:
+        prefix = prefix[:-1]
+    return prefix + ('"' if in_string else "") + "".join(reversed(stack))
+
+
+def repair_json(text):
+    """Best-effort parse of truncated or wrapped JSON. Returns a dict or None."""
+    text = _FENCE.sub("", text or "")
+    start = text.find("{")
+    if start < 0:
+        return None
+    text = text[start:]
+    _, _, _, cuts = _scan(text)
+    # The whole text first (keeps a cut-off explanation), then back off one member at a time
+    for end in [len(text), *reversed(cuts)]:
+        try:
+            value = json.loads(_close(text[:end].rstrip().rstrip(",:")))
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def parse(content, required):
+    """
+    Parses a model reply that must carry the non-empty string field `required`.
+    Returns (data or None, outcome).
+    """
+    try:
+        data = json.loads(content)
+        if isinstance(data, dict) and isinstance(data.get(required), str) and data[required].strip():
+            return data, "ok"
+    except (TypeError, ValueError):
+        pass
+    data = repair_json(content)
+    if data and isinstance(data.get(required), str) and data[required].strip():
+        return data, "repaired"
+    return None, "failed"
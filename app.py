@@ -1,16 +1,45 @@
 import os
 import json
 import re
+import secrets
+import zlib
+import threading
+import time
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import (
+    Flask, render_template, request, jsonify, redirect, url_for, flash, session,
+    make_response, Response, stream_with_context, g, has_request_context
+)
+from sqlalchemy.exc import IntegrityError
 from flask_sqlalchemy import SQLAlchemy
+import numpy as np
 from resala_api import send_otp
+from db_engine import engine_options, configure_engine
+from db_router import RoutingSession, ReplicaRouter, replica_reads
+from session_store import ServerSessionInterface, MemorySessionBackend, create_backend
+from http_cache import Compressor, conditional_response
+from assets import AssetBundler, render_markdown
+from query_profiler import QueryProfiler
+from metrics import (
+    init_metrics, count_queries, counter_totals, ai_phase, record_token_usage, timed_otp,
+    AI_REQUESTS, AI_OUTPUT_PARSE, OTP_DURATION, LOGIN_ATTEMPTS, SEMANTIC_CACHE_LOOKUPS,
+    SEMANTIC_CACHE_SIMILARITY, TENANT_AI_THROTTLED
+)
+from semantic_cache import SemanticIndex, create_embedder, normalize_query, number_signature
+from leaderboard import GLOBAL_BOARD, board_name, create_leaderboard
+from bulk_ops import stream_csv, stream_jsonl, parse_user_csv, password_hasher
+from conversation import ContextWindow, estimate_tokens
+from passwords import PasswordHasher, PasswordCheckBusy
+from upstream import UpstreamHealth
+from readiness import Warmup, Readiness
+import ai_output
+from tenants import DEFAULT_TENANT, TenantBusy, TenantConfig, TenantRegistry, clean_settings
 from flask_login import (
     LoginManager, UserMixin, login_user,
     login_required, logout_user, current_user
 )
-from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
+import openai
 from openai import OpenAI
 
 # ---------------- LOAD ENV ----------------
@@ -27,7 +56,13 @@ if database_url.startswith("postgres://"):
 
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(database_url)
+db = SQLAlchemy(app, session_options={"class_": RoutingSession})
+with app.app_context():
+    configure_engine(db.engine)
+
+# Optional REPLICA_DATABASE_URL for @replica_reads views (see db_router.py)
+replica = ReplicaRouter(app)
 
 # ---------------- AUTO MIGRATION ----------------
 def run_auto_migration():
@@ -45,8 +80,18 @@ def run_auto_migration():
                         'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS points INTEGER DEFAULT 0;',
                         'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS study_hours FLOAT DEFAULT 0.0;',
                         'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS is_verified BOOLEAN DEFAULT FALSE;',
+                        "ALTER TABLE \"user\" ADD COLUMN IF NOT EXISTS tenant VARCHAR(50) NOT NULL DEFAULT 'default';",
+                        # query_embedding is created by create_all() on first start, after this runs
+                        "DO $$ BEGIN IF to_regclass('query_embedding') IS NOT NULL THEN "
+                        "ALTER TABLE query_embedding ADD COLUMN IF NOT EXISTS tenant VARCHAR(50) NOT NULL DEFAULT 'default'; "
+                        "END IF; END $$;",
+                        'CREATE INDEX IF NOT EXISTS ix_user_tenant_study_year ON "user" (tenant, study_year);',
                         'ALTER TABLE explanation ADD COLUMN IF NOT EXISTS subject VARCHAR(100);',
-                        'ALTER TABLE explanation ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;'
+                        'ALTER TABLE explanation ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;',
+                        'ALTER TABLE explanation ADD COLUMN IF NOT EXISTS quiz TEXT;',
+                        'ALTER TABLE explanation ADD COLUMN IF NOT EXISTS content_html TEXT;',
+                        'CREATE INDEX IF NOT EXISTS ix_explanation_created_at ON explanation (created_at);',
+                        'CREATE INDEX IF NOT EXISTS ix_explanation_user_id ON explanation (user_id);'
                     ]
                     for q in queries:
                         try:
@@ -55,6 +100,8 @@ def run_auto_migration():
                             conn.commit()
                             print(f">>> OK: {q[:40]}...")
                         except Exception as q_ex:
+                            # A failed statement aborts the transaction; roll back so the rest still run
+                            conn.rollback()
                             print(f">>> SKIP/FAIL: {q[:40]}... Error: {q_ex}")
                     
                     try:
@@ -80,6 +127,7 @@ def run_auto_migration():
                         ('points', 'INTEGER DEFAULT 0'),
                         ('study_hours', 'FLOAT DEFAULT 0.0'),
                         ('is_verified', 'BOOLEAN DEFAULT FALSE'),
+                        ('tenant', "VARCHAR(50) NOT NULL DEFAULT 'default'"),
                     ]
                     for col_name, col_type in columns_to_add:
                         try:
@@ -103,14 +151,60 @@ def run_auto_migration():
                         if 'created_at' not in existing_cols:
                             conn.execute(text('ALTER TABLE explanation ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;'))
                             conn.commit()
+                        if 'quiz' not in existing_cols:
+                            conn.execute(text('ALTER TABLE explanation ADD COLUMN quiz TEXT;'))
+                            conn.commit()
+                        if 'content_html' not in existing_cols:
+                            conn.execute(text('ALTER TABLE explanation ADD COLUMN content_html TEXT;'))
+                            conn.commit()
+                        if existing_cols:
+                            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_explanation_created_at ON explanation (created_at);'))
+                            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_explanation_user_id ON explanation (user_id);'))
+                            conn.commit()
                     except:
                         pass
+
+                    # Tenant columns (see TENANTS)
+                    try:
+                        cursor = conn.execute(text("PRAGMA table_info('query_embedding')"))
+                        existing_cols = [row[1] for row in cursor.fetchall()]
+                        if existing_cols and 'tenant' not in existing_cols:
+                            conn.execute(text("ALTER TABLE query_embedding ADD COLUMN tenant VARCHAR(50) NOT NULL DEFAULT 'default';"))
+                            conn.commit()
+                        cursor = conn.execute(text("PRAGMA table_info('user')"))
+                        if 'tenant' in [row[1] for row in cursor.fetchall()]:
+                            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_user_tenant_study_year ON "user" (tenant, study_year);'))
+                            conn.commit()
+                    except Exception as t_ex:
+                        print(f">>> SKIP: tenant columns check failed: {t_ex}")
         print(">>> Startup Migration Check Completed Successfully")
     except Exception as e:
         print(f">>> CRITICAL: Startup Migration Failed: {e}")
 
 run_auto_migration()
 
+# ---------------- METRICS ----------------
+# Request timings, per-request query counts and AI/OTP timings, served at /metrics
+with app.app_context():
+    init_metrics(app, db.engine)
+    if replica.engine is not None:
+        count_queries(replica.engine)
+
+# ---------------- QUERY PROFILER ----------------
+# Sampled per-request query counts, N+1 warnings and slow-query EXPLAIN plans
+with app.app_context():
+    query_profiler = QueryProfiler(app, db.engine)
+    if replica.engine is not None:
+        query_profiler.watch(replica.engine)
+
+# ---------------- COMPRESSION ----------------
+compressor = Compressor(app, min_size=int(os.getenv("COMPRESS_MIN_SIZE", "1024")))
+INDEX_MAX_AGE = int(os.getenv("INDEX_MAX_AGE", "3600"))
+
+# ---------------- ASSETS ----------------
+# Page JS/CSS bundles from static/src, fingerprinted and served with immutable caching
+assets = AssetBundler(app)
+
 # ---------------- LOGIN ----------------
 login_manager = LoginManager(app)
 login_manager.login_view = 'signup'
@@ -118,11 +212,19 @@ login_manager.login_view = 'signup'
 # ---------------- OPENAI ----------------
 openai_api_key = os.getenv("OPENAI_API_KEY")
 if openai_api_key:
-    client = OpenAI(api_key=openai_api_key)
+    # Bounded waits: the SDK default (10 minutes, 2 retries) ties up a worker per request in an outage
+    client = OpenAI(
+        api_key=openai_api_key,
+        timeout=float(os.getenv("OPENAI_TIMEOUT", "60")),
+        max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+    )
 else:
     client = None
     print("Warning: OPENAI_API_KEY not found. AI features will be disabled.")
 
+# Strict JSON-schema replies; set to 0 for providers that only support json_object
+AI_STRUCTURED_OUTPUTS = os.getenv("AI_STRUCTURED_OUTPUTS", "1") == "1"
+
 # ---------------- ADMIN ----------------
 def _get_admin_phones():
     raw = os.getenv("ADMIN_PHONES", "")
@@ -138,8 +240,29 @@ def _get_admin_phones():
         phones.add(admin2)
     return phones
 
+# Resolved once per worker; changing admin phones needs a restart
+ADMIN_PHONES = frozenset(_get_admin_phones())
+
+def is_admin_phone(phone, tenant_slug):
+    """ADMIN_PHONES administer every school; a tenant's admin_phones only their own."""
+    return phone in ADMIN_PHONES or phone in tenants.get(tenant_slug).admin_phones
+
 def is_admin_user(user):
-    return bool(user and user.is_authenticated and user.phone in _get_admin_phones())
+    if not (user and user.is_authenticated):
+        return False
+    cached_flag = getattr(user, "is_admin", None)
+    if cached_flag is not None:
+        return cached_flag
+    return is_admin_phone(user.phone, user.tenant)
+
+def is_platform_admin(user):
+    """Deployment-wide pages (usage across schools, tenants, AI status) are for ADMIN_PHONES only."""
+    return bool(user and user.is_authenticated) and user.phone in ADMIN_PHONES
+
+# ---------------- PASSWORDS ----------------
+# Hash cost comes from PASSWORD_HASH_METHOD; logins upgrade older hashes and
+# verification runs on a bounded pool (see passwords.py)
+passwords = PasswordHasher()
 
 # ---------------- CURRICULUM ----------------
 CURRICULUM = {
@@ -308,7 +431,13 @@ REFERENCE_FILES = {
     }
 }
 
+_references_cache = {}
+
 def build_references_map(study_year):
+    # Static per study year; built once per worker (primed by warm_up())
+    cached = _references_cache.get(study_year)
+    if cached is not None:
+        return cached
     folder = STUDY_YEAR_REFERENCE_FOLDER.get(study_year)
     if not folder:
         return {}
@@ -323,6 +452,7 @@ def build_references_map(study_year):
                 "url": url_for("static", filename=f"References/{folder}/{item['file']}")
             })
         references_map[subject] = refs
+    _references_cache[study_year] = references_map
     return references_map
 
 # ---------------- MODELS ----------------
@@ -337,20 +467,140 @@ class User(UserMixin, db.Model):
     study_hours = db.Column(db.Float, default=0.0)
     is_verified = db.Column(db.Boolean, default=False)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    tenant = db.Column(db.String(50), nullable=False, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+
+    __table_args__ = (db.Index('ix_user_tenant_study_year', 'tenant', 'study_year'),)
 
     @property
     def is_in_trial(self):
-        # 2 months = roughly 60 days
-        expiry_date = self.joined_at + timedelta(days=60)
-        return datetime.utcnow() < expiry_date
+        return user_in_trial(self.joined_at, tenants.get(self.tenant).trial_days)
+
+def user_in_trial(joined_at, days=60):
+    # Default trial: 2 months = roughly 60 days
+    expiry_date = joined_at + timedelta(days=days)
+    return datetime.utcnow() < expiry_date
 
 class Explanation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255))
     content = db.Column(db.Text)
     subject = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    quiz = db.Column(db.Text)  # packed quiz, see pack_quiz()
+    content_html = db.Column(db.Text)  # sanitized HTML rendered from content at save time
+
+class QuizAttempt(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True, nullable=False)
+    explanation_id = db.Column(db.Integer, db.ForeignKey('explanation.id'), index=True, nullable=False)
+    subject = db.Column(db.String(100))
+    score = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+class ExplanationTurn(db.Model):
+    # One follow-up question and its answer on an explanation (see FOLLOW-UPS)
+    id = db.Column(db.Integer, primary_key=True)
+    explanation_id = db.Column(db.Integer, index=True, nullable=False)
+    user_id = db.Column(db.Integer, index=True, nullable=False)
+    question = db.Column(db.String(500), nullable=False)
+    answer = db.Column(db.Text)
+    answer_html = db.Column(db.Text)
+    memo = db.Column(db.Text)  # model's running summary of the conversation up to this turn
+    tokens = db.Column(db.Integer, default=0)  # question + answer, for the context budget
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class SubjectMastery(db.Model):
+    # Running totals per (user, subject), bumped on every graded attempt
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    subject = db.Column(db.String(100), nullable=False)
+    attempts = db.Column(db.Integer, default=0)
+    correct = db.Column(db.Integer, default=0)
+    answered = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'subject', name='uq_mastery_user_subject'),)
+
+    @property
+    def percent(self):
+        if not self.answered:
+            return 0
+        return round(100 * self.correct / self.answered)
+
+class ArchivedExplanation(db.Model):
+    # Cold copy of an explanation older than ARCHIVE_AFTER_MONTHS (see RETENTION)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # id of the original row
+    user_id = db.Column(db.Integer, index=True)
+    title = db.Column(db.String(255))
+    subject = db.Column(db.String(100))
+    preview = db.Column(db.String(300))
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    payload = db.Column(db.LargeBinary)  # zlib-compressed JSON: content, content_html, quiz, attempts
+
+    archived = True
+
+class UserDeletion(db.Model):
+    # Users removed by an admin whose rows are still being deleted in chunks
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class QueryEmbedding(db.Model):
+    # Embedded AI room query behind a generated explanation (see SEMANTIC CACHE)
+    id = db.Column(db.Integer, primary_key=True)
+    explanation_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, index=True)
+    tenant = db.Column(db.String(50), nullable=False, default=DEFAULT_TENANT, server_default=DEFAULT_TENANT)
+    study_year = db.Column(db.String(50), nullable=False, default="")
+    subject = db.Column(db.String(100), nullable=False, default="")
+    # Column stays "query"; the attribute must not shadow Model.query
+    query_text = db.Column("query", db.String(500))
+    embedder = db.Column(db.String(50), nullable=False, index=True)
+    vector = db.Column(db.LargeBinary, nullable=False)  # float16, L2-normalized
+
+class AppSetting(db.Model):
+    # Small JSON settings editable from the admin pages
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class UsageRollup(db.Model):
+    # AI usage pre-aggregated per hour/day, study year and subject (see ANALYTICS)
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(5), nullable=False)  # "hour" or "day"
+    bucket = db.Column(db.DateTime, nullable=False)
+    study_year = db.Column(db.String(50), nullable=False, default="")
+    subject = db.Column(db.String(100), nullable=False, default="")
+    requests = db.Column(db.Integer, default=0)
+    credits = db.Column(db.Integer, default=0)
+    prompt_tokens = db.Column(db.Integer, default=0)
+    completion_tokens = db.Column(db.Integer, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket', 'study_year', 'subject', name='uq_rollup_bucket'),
+    )
+
+class RollupActiveUser(db.Model):
+    # One row per user active in a bucket; counting rows gives distinct active users
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(5), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    study_year = db.Column(db.String(50), nullable=False, default="")
+
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket', 'user_id', name='uq_rollup_active_user'),
+    )
+
+class Tenant(db.Model):
+    # A school served by this deployment (see TENANTS); config is JSON
+    slug = db.Column(db.String(50), primary_key=True)
+    name = db.Column(db.String(100))
+    hosts = db.Column(db.Text)  # comma-separated host names
+    config = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Lesson(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -401,20 +651,235 @@ with app.app_context():
                 full_name=name,
                 phone=phone,
                 study_year=None,
-                password=generate_password_hash(password),
+                password=passwords.hash(password),
                 is_verified=True
             )
             db.session.add(admin_user)
     if seen_phones:
         db.session.commit()
 
+# ---------------- SESSIONS ----------------
+# Session data is kept server-side; the cookie only carries an opaque id.
+# SESSION_BACKEND: db (default), sqlite, redis, memory, or cookie (Flask's signed cookie)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "db").strip().lower()
+OTP_TTL_SECONDS = int(os.getenv("OTP_TTL_SECONDS", "300"))
+OTP_MAX_SENDS = int(os.getenv("OTP_MAX_SENDS", "3"))
+OTP_SEND_WINDOW = int(os.getenv("OTP_SEND_WINDOW", "600"))
+
+if SESSION_BACKEND == "cookie":
+    session_backend = MemorySessionBackend()
+else:
+    with app.app_context():
+        session_backend = create_backend(
+            SESSION_BACKEND,
+            engine=db.engine,
+            url=os.getenv("SESSION_STORE_URL")
+        )
+    app.session_interface = ServerSessionInterface(session_backend)
+
+def log_in(user):
+    """login_user on a new session id; cookie sessions have no id to plant, so they skip that."""
+    if isinstance(app.session_interface, ServerSessionInterface):
+        app.session_interface.regenerate(session)
+    login_user(user)
+
+def send_otp_limited(phone):
+    """
+    Sends an OTP unless the phone already hit OTP_MAX_SENDS within OTP_SEND_WINDOW.
+    Returns (pin, expires_at); pin is None when sending failed or was throttled.
+    """
+    sends = session_backend.incr(f"otp:{phone.strip()}", OTP_SEND_WINDOW)
+    if sends > OTP_MAX_SENDS:
+        OTP_DURATION.labels("throttled").observe(0)
+        return None, None
+    pin = timed_otp(send_otp, phone)
+    return pin, time.time() + OTP_TTL_SECONDS
+
+def otp_matches(entered, expected, expires_at):
+    if not expected or not expires_at or time.time() > expires_at:
+        return False
+    return entered == str(expected)
+
+LOGIN_MAX_ATTEMPTS = int(os.getenv("LOGIN_MAX_ATTEMPTS", "10"))
+LOGIN_WINDOW = int(os.getenv("LOGIN_WINDOW", "600"))
+
+def check_login(phone, password):
+    """
+    Returns (user, None) for valid credentials, else (None, error message).
+    Attempts are counted per phone before any hashing, so a throttled phone
+    costs no CPU; a successful login clears the count, so only failures add
+    up. A correct password on an outdated hash is rehashed.
+    """
+    if session_backend.incr(f"login:{phone}", LOGIN_WINDOW) > LOGIN_MAX_ATTEMPTS:
+        LOGIN_ATTEMPTS.labels("throttled").inc()
+        return None, "محاولات دخول كثيرة، استنى شوية وعاود"
+
+    user = User.query.filter_by(phone=phone).first()
+    if user is not None and user.tenant != current_tenant().slug and phone not in ADMIN_PHONES:
+        # Accounts sign in on their own school's host only
+        user = None
+    try:
+        valid = user is not None and passwords.verify(user.password, password)
+    except PasswordCheckBusy:
+        LOGIN_ATTEMPTS.labels("busy").inc()
+        return None, "الضغط عالي توا، جرب بعد لحظات"
+    if not valid:
+        LOGIN_ATTEMPTS.labels("failed").inc()
+        return None, "بيانات الدخول غير صحيحة"
+
+    if passwords.needs_rehash(user.password):
+        user.password = passwords.hash(password)
+        db.session.commit()
+    session_backend.reset(f"login:{phone}")
+    LOGIN_ATTEMPTS.labels("ok").inc()
+    return user, None
+
+# ---------------- TENANTS ----------------
+# Schools sharing this deployment, matched by request host (see tenants.py).
+# The default tenant is the built-in CURRICULUM and credit settings; Tenant
+# rows override them per school. Users, leaderboards, the semantic cache and
+# OpenAI quotas are all partitioned by tenant.
+TENANT_RELOAD_SECONDS = float(os.getenv("TENANT_RELOAD_SECONDS", "300"))
+
+default_tenant = TenantConfig(
+    DEFAULT_TENANT,
+    os.getenv("DEFAULT_TENANT_NAME", "افهمها وفهمني"),
+    curriculum=CURRICULUM,
+    default_credits=User.__table__.c.ai_credits.default.arg,
+    trial_days=60,
+    ai_concurrency=int(os.getenv("TENANT_AI_CONCURRENCY", "8")),
+    ai_rate_per_minute=int(os.getenv("TENANT_AI_RATE_PER_MINUTE", "0"))
+)
+
+def load_tenants(base):
+    return [
+        TenantConfig.from_settings(
+            row.slug, row.name, (row.hosts or "").split(","), json.loads(row.config or "{}"), base
+        )
+        for row in Tenant.query.all()
+    ]
+
+tenants = TenantRegistry(default_tenant, load_tenants, session_backend.incr, TENANT_RELOAD_SECONDS)
+with app.app_context():
+    tenants.reload()
+
+def current_tenant():
+    """The tenant of the request's host (resolved once per request); the default tenant outside requests."""
+    if not has_request_context():
+        return tenants.get(DEFAULT_TENANT)
+    if "tenant" not in g:
+        g.tenant = tenants.resolve(request.host)
+    return g.tenant
+
+def all_admin_phones():
+    phones = set(ADMIN_PHONES)
+    for tenant in tenants.all():
+        phones |= tenant.admin_phones
+    return phones
+
+def tenant_busy_response(tenant, busy):
+    """429 for an AI request over its school's quota; nothing is charged."""
+    TENANT_AI_THROTTLED.labels(tenant.slug, busy.reason).inc()
+    AI_REQUESTS.labels("throttled").inc()
+    response = jsonify({"error": "الضغط عالي على الخدمة توا، جرب بعد شوية"})
+    response.headers["Retry-After"] = str(busy.retry_after)
+    return response, 429
+
+@app.route('/admin/tenants', methods=['GET', 'POST'])
+@login_required
+def admin_tenants():
+    if not is_platform_admin(current_user):
+        return jsonify({"error": "غير مصرح لك بالدخول"}), 403
+
+    if request.method == 'POST':
+        payload = request.json or {}
+        slug = str(payload.get("slug") or "").strip().lower()
+        if not re.fullmatch(r"[a-z0-9-]{1,50}", slug):
+            return jsonify({"error": "المعرّف لازم يكون حروف إنجليزية صغيرة وأرقام و - فقط"}), 400
+        hosts = payload.get("hosts") or []
+        if not isinstance(hosts, list) or not all(isinstance(h, str) for h in hosts):
+            return jsonify({"error": "النطاقات لازم تكون قائمة"}), 400
+        try:
+            settings = clean_settings(payload.get("config") or {})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        row = db.session.get(Tenant, slug) or Tenant(slug=slug)
+        row.name = str(payload.get("name") or row.name or slug)[:100]
+        row.hosts = ",".join(h.strip().lower() for h in hosts if h.strip())
+        row.config = json.dumps(settings, ensure_ascii=False)
+        db.session.add(row)
+        db.session.commit()
+        # Other workers pick the change up within TENANT_RELOAD_SECONDS
+        tenants.reload()
+        invalidate_all_users()
+        print(f">>> Tenant {slug} saved by {current_user.phone}")
+
+    return jsonify({"tenants": [t.to_dict() for t in tenants.all()]})
+
+# ---------------- USER CACHE ----------------
+# Per-worker cache of lean user identities so authenticated requests skip the
+# user lookup. Entries are dropped locally on credit/profile changes; other
+# workers catch up within USER_CACHE_TTL seconds. Writes must go through
+# current_user_row(), never through the cached identity.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_MAX = int(os.getenv("USER_CACHE_MAX", "10000"))
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+class CachedUser(UserMixin):
+    FIELDS = ("id", "full_name", "phone", "study_year", "ai_credits",
+              "points", "study_hours", "is_verified", "joined_at", "tenant")
+
+    def __init__(self, user):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(user, field))
+        self.is_admin = is_admin_phone(user.phone, user.tenant)
+
+    @property
+    def is_in_trial(self):
+        return user_in_trial(self.joined_at, tenants.get(self.tenant).trial_days)
+
+def cache_user(user):
+    identity = CachedUser(user)
+    with _user_cache_lock:
+        if len(_user_cache) >= USER_CACHE_MAX:
+            _user_cache.clear()
+        _user_cache[user.id] = (identity, time.monotonic() + USER_CACHE_TTL)
+    return identity
+
+def invalidate_user(user_id):
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+def invalidate_all_users():
+    with _user_cache_lock:
+        _user_cache.clear()
+
+def current_user_row():
+    """The logged-in user as a live, session-bound User row (for writes and fresh credit checks)."""
+    return db.session.get(User, current_user.id)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    user_id = int(user_id)
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+    if cached and cached[1] > time.monotonic():
+        identity = cached[0]
+    else:
+        user = db.session.get(User, user_id)
+        if not user or user.phone.startswith(DELETED_PHONE_PREFIX):
+            return None
+        identity = cache_user(user)
+    # A session is only valid on its own school's host
+    if identity.tenant != current_tenant().slug and identity.phone not in ADMIN_PHONES:
+        return None
+    return identity
 
 @app.context_processor
 def inject_admin_flag():
-    return {"is_admin": is_admin_user(current_user)}
+    return {"is_admin": is_admin_user(current_user), "tenant": current_tenant()}
 
 @app.before_request
 def check_verification():
@@ -425,18 +890,25 @@ def check_verification():
         if request.endpoint not in excluded_routes and not current_user.is_verified:
             # Trigger OTP send if not already in session
             if 'pending_pin' not in session:
-                pin = send_otp(current_user.phone)
+                pin, expires_at = send_otp_limited(current_user.phone)
                 if pin:
                     session['pending_verify_user_id'] = current_user.id
                     session['pending_phone'] = current_user.phone
                     session['pending_pin'] = pin
+                    session['pending_pin_expires'] = expires_at
             
             return render_template('signup.html', verify_otp=True, login_verify=True)
 
 # ---------------- ROUTES ----------------
+_index_html = None
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    # The landing page is the same for everyone, render it once per worker
+    global _index_html
+    if _index_html is None:
+        _index_html = render_template('index.html')
+    return conditional_response(make_response(_index_html), request, private=False, max_age=INDEX_MAX_AGE)
 
 @app.route('/signup', methods=['GET', 'POST'])
 def signup():
@@ -446,9 +918,12 @@ def signup():
         if User.query.filter_by(phone=phone).first():
             flash("الرقم مسجل مسبقاً")
             return redirect(url_for('signup'))
+        if request.form['study_year'] not in current_tenant().curriculum:
+            flash("اختر سنة دراسية صحيحة")
+            return redirect(url_for('signup'))
 
         # Send OTP
-        pin = send_otp(phone)
+        pin, expires_at = send_otp_limited(phone)
         if not pin:
             flash("فشل إرسال رمز التحقق، تأكد من الرقم الصادر")
             return redirect(url_for('signup'))
@@ -458,8 +933,10 @@ def signup():
             'full_name': request.form['full_name'],
             'phone': phone,
             'study_year': request.form['study_year'],
-            'password': generate_password_hash(request.form['password']),
-            'pin': pin
+            'password': passwords.hash(request.form['password']),
+            'tenant': current_tenant().slug,
+            'pin': pin,
+            'pin_expires': expires_at
         }
         
         return render_template('signup.html', verify_otp=True)
@@ -475,9 +952,12 @@ def verify_otp():
 
     otp_entered = request.form.get('otp', '').strip()
     
-    if otp_entered == str(pending_user['pin']):
+    if otp_matches(otp_entered, pending_user.get('pin'), pending_user.get('pin_expires')):
+        tenant = tenants.get(pending_user.get('tenant'))
         # Create user
         user = User(
+            tenant=tenant.slug,
+            ai_credits=tenant.default_credits,
             full_name=pending_user['full_name'],
             phone=pending_user['phone'],
             study_year=pending_user['study_year'],
@@ -487,11 +967,12 @@ def verify_otp():
         )
         db.session.add(user)
         db.session.commit()
+        record_points(user)
         
         # Clear session
         session.pop('pending_user', None)
         
-        login_user(user)
+        log_in(user)
         flash("تهانينا! تم تفعيل حسابك وإضافة 50 نقطة هدية لرصيدك 🎉")
         return redirect(url_for('dashboard'))
     else:
@@ -501,14 +982,14 @@ def verify_otp():
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        phone = request.form['phone']
+        phone = request.form['phone'].strip()
         password = request.form['password']
-        user = User.query.filter_by(phone=phone).first()
+        user, error = check_login(phone, password)
 
-        if user and check_password_hash(user.password, password):
+        if user:
             if not user.is_verified:
                 # Need to verify
-                pin = send_otp(phone)
+                pin, expires_at = send_otp_limited(phone)
                 if not pin:
                     flash("فشل إرسال رمز التحقق")
                     return redirect(url_for('signup'))
@@ -516,12 +997,13 @@ def login():
                 session['pending_verify_user_id'] = user.id
                 session['pending_phone'] = user.phone
                 session['pending_pin'] = pin
+                session['pending_pin_expires'] = expires_at
                 return render_template('signup.html', verify_otp=True, login_verify=True)
             
-            login_user(user)
+            log_in(user)
             return redirect(url_for('dashboard'))
 
-        flash("بيانات الدخول غير صحيحة")
+        flash(error)
         return redirect(url_for('signup'))
     return redirect(url_for('signup'))
 
@@ -534,19 +1016,22 @@ def verify_login_otp():
     if not user_id or not expected_pin:
         return redirect(url_for('signup'))
 
-    if entered_otp == str(expected_pin):
+    if otp_matches(entered_otp, expected_pin, session.get('pending_pin_expires')):
         user = User.query.get(user_id)
         if user:
             if not user.is_verified:
                 user.points += 50
                 user.is_verified = True
                 db.session.commit()
+                invalidate_user(user.id)
+                record_points(user)
                 flash("تم إثبات ملكية الرقم وإضافة 50 نقطة هدية لرصيدك 🎉")
             
-            login_user(user)
+            log_in(user)
             session.pop('pending_verify_user_id', None)
             session.pop('pending_phone', None)
             session.pop('pending_pin', None)
+            session.pop('pending_pin_expires', None)
             return redirect(url_for('dashboard'))
     
     flash("رمز التحقق غير صحيح")
@@ -557,12 +1042,12 @@ def admin_login():
     if request.method == 'POST':
         phone = request.form.get('phone', '').strip()
         password = request.form.get('password', '')
-        user = User.query.filter_by(phone=phone).first()
-        if user and check_password_hash(user.password, password) and is_admin_user(user):
-            login_user(user)
+        user, error = check_login(phone, password)
+        if user and is_admin_user(user):
+            log_in(user)
             return redirect(url_for('admin_dashboard'))
 
-        flash("بيانات الإدارة غير صحيحة")
+        flash(error or "بيانات الإدارة غير صحيحة")
         return redirect(url_for('admin_login'))
 
     return render_template('admin_login.html')
@@ -570,62 +1055,327 @@ def admin_login():
 # ---------------- DASHBOARD ----------------
 @app.route('/dashboard')
 @login_required
+@replica_reads
 def dashboard():
     subjects = []
+    mastery = {
+        m.subject: m
+        for m in SubjectMastery.query.filter_by(user_id=current_user.id).all()
+    }
+    # One grouped query instead of a count per subject
+    counts = dict(
+        db.session.query(Explanation.subject, db.func.count(Explanation.id))
+        .filter(Explanation.user_id == current_user.id)
+        .group_by(Explanation.subject)
+        .all()
+    )
+    for subject, n in (
+        db.session.query(ArchivedExplanation.subject, db.func.count(ArchivedExplanation.id))
+        .filter(ArchivedExplanation.user_id == current_user.id)
+        .group_by(ArchivedExplanation.subject)
+        .all()
+    ):
+        counts[subject] = counts.get(subject, 0) + n
 
-    for s in CURRICULUM.get(current_user.study_year, []):
+    for s in tenants.get(current_user.tenant).subjects(current_user.study_year):
         subjects.append({
             "name": s,
             "icon": SUBJECT_ICONS.get(s, "📘"),
-            "count": Explanation.query.filter_by(
-                user_id=current_user.id,
-                subject=s
-            ).count()
+            "count": counts.get(s, 0),
+            "mastery": mastery[s].percent if s in mastery else None
         })
 
     stats = {
-        "explanations": Explanation.query.filter_by(user_id=current_user.id).count(),
+        "explanations": sum(counts.values()),
         "points": current_user.points,
-        "study_hours": round(current_user.study_hours, 1)
+        "study_hours": round(current_user.study_hours, 1),
+        "rank": my_rank(current_user.id, current_user.tenant, current_user.study_year)
     }
 
-    return render_template(
+    response = make_response(render_template(
         'dashboard.html',
         subjects=subjects,
         stats=stats
+    ))
+    return conditional_response(response, request)
+
+# ---------------- ANALYTICS ----------------
+# Usage is rolled up into UsageRollup/RollupActiveUser as each AI request is saved,
+# so admin pages and exports never aggregate the raw explanation table.
+AI_REQUEST_COST = 5
+ROLLUP_GRANULARITIES = ("hour", "day")
+ROLLUP_GROUPS = {"study_year": UsageRollup.study_year, "subject": UsageRollup.subject}
+ROLLUP_MAX_DAYS = 366
+
+def rollup_buckets(at):
+    hour = at.replace(minute=0, second=0, microsecond=0)
+    return {"hour": hour, "day": hour.replace(hour=0)}
+
+def _increment_rollup(keys, values):
+    """UPDATE col = col + n on the rollup row, inserting it on first use."""
+    table = UsageRollup.__table__
+    where = db.and_(*(table.c[k] == v for k, v in keys.items()))
+    increments = {k: table.c[k] + v for k, v in values.items()}
+    for _ in range(2):
+        try:
+            with db.engine.begin() as conn:
+                if not conn.execute(table.update().where(where).values(increments)).rowcount:
+                    conn.execute(table.insert().values(**keys, **values))
+            return
+        except IntegrityError:
+            # Another worker inserted the row first; the retry updates it
+            continue
+
+def _mark_active(keys, study_year):
+    table = RollupActiveUser.__table__
+    where = db.and_(*(table.c[k] == v for k, v in keys.items()))
+    try:
+        with db.engine.begin() as conn:
+            if conn.execute(db.select(table.c.id).where(where)).first() is None:
+                conn.execute(table.insert().values(**keys, study_year=study_year))
+    except IntegrityError:
+        pass
+
+def record_usage(user_id, study_year, subject, credits, usage=None, at=None):
+    """Adds one AI request to the hourly and daily rollups. Never fails the request."""
+    values = {
+        "requests": 1,
+        "credits": credits,
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+    try:
+        for granularity, bucket in rollup_buckets(at or datetime.utcnow()).items():
+            _increment_rollup(
+                {"granularity": granularity, "bucket": bucket,
+                 "study_year": study_year or "", "subject": subject or ""},
+                values
+            )
+            _mark_active({"granularity": granularity, "bucket": bucket, "user_id": user_id}, study_year or "")
+    except Exception as e:
+        print(f">>> Rollup update failed: {e}")
+
+def backfill_rollups():
+    """Builds the rollups from existing explanations once, while the rollup table is empty."""
+    if db.session.query(UsageRollup.id).first() is not None:
+        return
+    rows = (
+        db.session.query(Explanation.created_at, Explanation.subject, Explanation.user_id, User.study_year)
+        .outerjoin(User, Explanation.user_id == User.id)
+        .filter(Explanation.created_at.isnot(None))
+        .yield_per(5000)
+    )
+    requests = {}
+    active = {}
+    for created_at, subject, user_id, study_year in rows:
+        for granularity, bucket in rollup_buckets(created_at).items():
+            key = (granularity, bucket, study_year or "", subject or "")
+            requests[key] = requests.get(key, 0) + 1
+            if user_id is not None:
+                active.setdefault((granularity, bucket, user_id), study_year or "")
+    if not requests:
+        return
+
+    # Token counts were not stored before rollups existed
+    db.session.execute(db.insert(UsageRollup), [
+        {"granularity": g, "bucket": b, "study_year": y, "subject": s,
+         "requests": n, "credits": n * AI_REQUEST_COST, "prompt_tokens": 0, "completion_tokens": 0}
+        for (g, b, y, s), n in requests.items()
+    ])
+    db.session.execute(db.insert(RollupActiveUser), [
+        {"granularity": g, "bucket": b, "user_id": u, "study_year": y}
+        for (g, b, u), y in active.items()
+    ])
+    try:
+        db.session.commit()
+        print(f">>> Backfilled usage rollups: {len(requests)} rows")
+    except IntegrityError:
+        # Another worker backfilled first
+        db.session.rollback()
+
+with app.app_context():
+    try:
+        backfill_rollups()
+    except Exception as e:
+        db.session.rollback()
+        print(f">>> Rollup backfill failed: {e}")
+
+def usage_rows(granularity, since, group=None):
+    """Rollup totals per bucket (and per study_year/subject when grouped), oldest first."""
+    group_col = ROLLUP_GROUPS.get(group)
+    group_expr = group_col if group_col is not None else db.literal("")
+    totals = (
+        db.session.query(
+            UsageRollup.bucket,
+            group_expr,
+            db.func.sum(UsageRollup.requests),
+            db.func.sum(UsageRollup.credits),
+            db.func.sum(UsageRollup.prompt_tokens),
+            db.func.sum(UsageRollup.completion_tokens)
+        )
+        .filter(UsageRollup.granularity == granularity, UsageRollup.bucket >= since)
+        .group_by(UsageRollup.bucket, *([group_col] if group_col is not None else []))
+        .order_by(UsageRollup.bucket)
+        .all()
+    )
+
+    # Distinct users are only known overall and per study year
+    active = {}
+    if group in (None, "study_year"):
+        active_group = RollupActiveUser.study_year if group else db.literal("")
+        active = {
+            (bucket, key): n
+            for bucket, key, n in db.session.query(
+                RollupActiveUser.bucket, active_group, db.func.count(RollupActiveUser.id)
+            )
+            .filter(RollupActiveUser.granularity == granularity, RollupActiveUser.bucket >= since)
+            .group_by(RollupActiveUser.bucket, *([RollupActiveUser.study_year] if group else []))
+            .all()
+        }
+
+    return [
+        {
+            "bucket": bucket,
+            "group": key,
+            "requests": int(requests or 0),
+            "credits": int(credits or 0),
+            "prompt_tokens": int(prompt_tokens or 0),
+            "completion_tokens": int(completion_tokens or 0),
+            "active_users": active.get((bucket, key)) if group != "subject" else None,
+        }
+        for bucket, key, requests, credits, prompt_tokens, completion_tokens in totals
+    ]
+
+def usage_totals(since, group):
+    """Daily rollups summed per study_year/subject since a date, busiest first."""
+    rows = usage_rows("day", since, group=group)
+    totals = {}
+    for row in rows:
+        t = totals.setdefault(row["group"], {"group": row["group"], "requests": 0, "credits": 0, "tokens": 0})
+        t["requests"] += row["requests"]
+        t["credits"] += row["credits"]
+        t["tokens"] += row["prompt_tokens"] + row["completion_tokens"]
+    if group == "study_year":
+        distinct = dict(
+            db.session.query(RollupActiveUser.study_year, db.func.count(db.distinct(RollupActiveUser.user_id)))
+            .filter(RollupActiveUser.granularity == "day", RollupActiveUser.bucket >= since)
+            .group_by(RollupActiveUser.study_year)
+            .all()
+        )
+        for key, t in totals.items():
+            t["active_users"] = distinct.get(key, 0)
+    return sorted(totals.values(), key=lambda t: t["requests"], reverse=True)
+
+def analytics_args():
+    granularity = request.args.get("granularity", "day")
+    if granularity not in ROLLUP_GRANULARITIES:
+        granularity = "day"
+    days = min(max(request.args.get("days", 30, type=int) or 30, 1), ROLLUP_MAX_DAYS)
+    group = request.args.get("group")
+    if group not in ROLLUP_GROUPS:
+        group = None
+    since = rollup_buckets(datetime.utcnow())["day"] - timedelta(days=days - 1)
+    return granularity, since, group
+
+@app.route('/admin/analytics')
+@login_required
+@replica_reads
+def admin_analytics():
+    if not is_platform_admin(current_user):
+        return jsonify({"error": "غير مصرح لك بالدخول"}), 403
+    granularity, since, group = analytics_args()
+    rows = usage_rows(granularity, since, group)
+    for row in rows:
+        row["bucket"] = row["bucket"].strftime('%Y-%m-%d %H:%M')
+    return jsonify({"granularity": granularity, "group": group, "rows": rows})
+
+def export_response(columns, rows, filename, fmt):
+    """Streams rows (tuples in `columns` order) as CSV or JSON Lines."""
+    if fmt == "jsonl":
+        body, mimetype = stream_jsonl(columns, rows), "application/x-ndjson"
+    else:
+        body, mimetype = stream_csv(columns, rows), "text/csv"
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}.{fmt}"}
+    )
+
+@app.route('/admin/analytics.<any(csv, jsonl):fmt>')
+@login_required
+@replica_reads
+def admin_analytics_export(fmt):
+    if not is_platform_admin(current_user):
+        flash("غير مصرح لك بالدخول")
+        return redirect(url_for('dashboard'))
+    granularity, since, group = analytics_args()
+    columns = ["bucket", "group", "requests", "active_users", "credits", "prompt_tokens", "completion_tokens"]
+    rows = (
+        [row[c] for c in columns]
+        for row in usage_rows(granularity, since, group)
     )
+    return export_response(columns, rows, f"usage-{granularity}-{group or 'all'}-{since:%Y%m%d}", fmt)
 
 # ---------------- ADMIN DASHBOARD ----------------
 @app.route('/admin')
 @login_required
+@replica_reads
 def admin_dashboard():
     if not is_admin_user(current_user):
         flash("غير مصرح لك بالدخول")
         return redirect(url_for('dashboard'))
 
-    total_users = User.query.count()
-    total_ai_requests = Explanation.query.count()
+    # User data is the school of this host; usage rollups span every school
+    tenant = current_tenant()
+    show_usage = is_platform_admin(current_user)
+    total_users = User.query.filter_by(tenant=tenant.slug).count()
+    total_ai_requests, usage_days, usage_by_year = None, [], []
+    if show_usage:
+        total_ai_requests = (
+            db.session.query(db.func.coalesce(db.func.sum(UsageRollup.requests), 0))
+            .filter(UsageRollup.granularity == "day")
+            .scalar()
+        )
+        today = rollup_buckets(datetime.utcnow())["day"]
+        by_day = {row["bucket"]: row for row in usage_rows("day", today - timedelta(days=13))}
+        usage_days = [
+            by_day.get(day, {"bucket": day, "requests": 0, "active_users": 0})
+            for day in (today - timedelta(days=i) for i in range(13, -1, -1))
+        ]
+        usage_by_year = usage_totals(today - timedelta(days=29), group="study_year")
     phone_query = request.args.get('phone', '').strip()
     name_query = request.args.get('name', '').strip()
     found_users = []
     if phone_query or name_query:
-        query = User.query
+        query = User.query.filter_by(tenant=tenant.slug)
         if phone_query:
             query = query.filter(User.phone.ilike(f"%{phone_query}%"))
         if name_query:
             query = query.filter(User.full_name.ilike(f"%{name_query}%"))
         found_users = query.order_by(User.joined_at.desc()).limit(50).all()
         
-        # Add AI request count and last order date for each user
+        # Add AI request count and last order date for each user (one grouped query)
+        usage = {
+            user_id: (count, last_at)
+            for user_id, count, last_at in db.session.query(
+                Explanation.user_id,
+                db.func.count(Explanation.id),
+                db.func.max(Explanation.created_at)
+            )
+            .filter(Explanation.user_id.in_([u.id for u in found_users]))
+            .group_by(Explanation.user_id)
+            .all()
+        }
         for u in found_users:
-            u.ai_request_count = Explanation.query.filter_by(user_id=u.id).count()
-            last_order = Explanation.query.filter_by(user_id=u.id).order_by(Explanation.created_at.desc()).first()
-            u.last_order_date = last_order.created_at.strftime('%Y-%m-%d %H:%M') if last_order else '—'
+            count, last_at = usage.get(u.id, (0, None))
+            u.ai_request_count = count
+            u.last_order_date = last_at.strftime('%Y-%m-%d %H:%M') if last_at else '—'
 
     # Fetch recent AI requests across all users
     recent_requests = (
         db.session.query(Explanation, User)
         .join(User, Explanation.user_id == User.id)
+        .filter(User.tenant == tenant.slug)
         .order_by(Explanation.created_at.desc())
         .limit(20)
         .all()
@@ -635,12 +1385,25 @@ def admin_dashboard():
         'admin_dashboard.html',
         total_users=total_users,
         total_ai_requests=total_ai_requests,
+        show_usage=show_usage,
         phone_query=phone_query,
         name_query=name_query,
         found_users=found_users,
-        recent_requests=recent_requests
+        recent_requests=recent_requests,
+        usage_days=usage_days,
+        usage_by_year=usage_by_year,
+        study_years=tenant.study_years,
+        import_job=load_import_job(request.args.get('import_job')),
+        import_job_id=request.args.get('import_job')
     )
 
+@app.route('/admin/compression-stats')
+@login_required
+def admin_compression_stats():
+    if not is_platform_admin(current_user):
+        return jsonify({"error": "غير مصرح لك بالدخول"}), 403
+    return jsonify(compressor.stats())
+
 @app.route('/admin/delete/<int:user_id>', methods=['POST'])
 @login_required
 def admin_delete_user(user_id):
@@ -648,46 +1411,527 @@ def admin_delete_user(user_id):
         flash("غير مصرح لك بالدخول")
         return redirect(url_for('dashboard'))
 
-    user = User.query.get_or_404(user_id)
+    user = User.query.filter_by(id=user_id, tenant=current_tenant().slug).first_or_404()
     if user.id == current_user.id:
         flash("لا يمكنك حذف حسابك من لوحة الإدارة")
         return redirect(url_for('admin_dashboard', phone=user.phone))
 
-    Explanation.query.filter_by(user_id=user.id).delete()
-    db.session.delete(user)
+    # Lock the account and free the phone now; rows are deleted in the background
+    user.phone = f"{DELETED_PHONE_PREFIX}{user.id}"
+    user.password = "!"
+    if not db.session.get(UserDeletion, user.id):
+        db.session.add(UserDeletion(user_id=user.id))
     db.session.commit()
+    invalidate_user(user_id)
+    remove_from_leaderboard(user_id, user.tenant, user.study_year)
+    start_deletion_worker()
     flash("تم حذف المستخدم بنجاح")
     return redirect(url_for('admin_dashboard'))
 
-# ---------------- AI ROOM ----------------
-@app.route('/ai-room', methods=['GET', 'POST'])
+# ---------------- BULK ADMIN ----------------
+# Exports stream rows straight from a server-side cursor; credit top-ups are
+# one UPDATE per chunk; imports run in a background thread that hashes
+# passwords on all cores and inserts each batch with a single executemany.
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+BULK_IMPORT_MAX_ROWS = int(os.getenv("BULK_IMPORT_MAX_ROWS", "100000"))
+BULK_MAX_TOPUP = 100000
+IMPORT_JOB_PREFIX = "bulk_import:"
+IMPORT_JOB_MAX_ERRORS = 200
+USER_EXPORT_COLUMNS = [
+    "id", "full_name", "phone", "study_year", "ai_credits", "points", "study_hours",
+    "is_verified", "joined_at", "ai_requests", "last_request_at"
+]
+
+def user_export_rows(tenant, study_year=None):
+    usage = (
+        db.select(
+            Explanation.user_id,
+            db.func.count(Explanation.id).label("requests"),
+            db.func.max(Explanation.created_at).label("last_at")
+        )
+        .group_by(Explanation.user_id)
+        .subquery()
+    )
+    query = (
+        db.select(
+            User.id, User.full_name, User.phone, User.study_year, User.ai_credits, User.points,
+            User.study_hours, User.is_verified, User.joined_at,
+            db.func.coalesce(usage.c.requests, 0), usage.c.last_at
+        )
+        .outerjoin(usage, usage.c.user_id == User.id)
+        .where(User.tenant == tenant, ~User.phone.startswith(DELETED_PHONE_PREFIX))
+        .order_by(User.id)
+        .execution_options(yield_per=BULK_BATCH_SIZE)
+    )
+    if study_year:
+        query = query.where(User.study_year == study_year)
+    yield from db.session.execute(query)
+
+@app.route('/admin/users.<any(csv, jsonl):fmt>')
 @login_required
-def ai_room():
-    subjects = CURRICULUM.get(current_user.study_year, [])
-    references_map = build_references_map(current_user.study_year)
+@replica_reads
+def admin_export_users(fmt):
+    if not is_admin_user(current_user):
+        flash("غير مصرح لك بالدخول")
+        return redirect(url_for('dashboard'))
+    study_year = request.args.get('study_year') or None
+    filename = f"users-{datetime.utcnow():%Y%m%d}"
+    tenant = current_tenant().slug
+    return export_response(USER_EXPORT_COLUMNS, user_export_rows(tenant, study_year), f"{filename}-{tenant}", fmt)
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+@app.route('/admin/bulk/credits', methods=['POST'])
+@login_required
+def admin_bulk_credits():
+    if not is_admin_user(current_user):
+        flash("غير مصرح لك بالدخول")
+        return redirect(url_for('dashboard'))
+
+    data = request.get_json(silent=True) or request.form.to_dict()
+    try:
+        amount = int(data.get('amount'))
+    except (TypeError, ValueError):
+        amount = 0
+    scope = data.get('scope', 'phones')
+    if not 0 < amount <= BULK_MAX_TOPUP:
+        message = "قيمة الرصيد غير صالحة"
+    elif scope not in ('phones', 'study_year', 'all'):
+        message = "نطاق غير معروف"
+    else:
+        message = None
+    if message:
+        if request.is_json:
+            return jsonify({"error": message}), 400
+        flash(message)
+        return redirect(url_for('admin_dashboard'))
+
+    tenant = current_tenant()
+    students = db.and_(
+        User.tenant == tenant.slug,
+        ~User.phone.startswith(DELETED_PHONE_PREFIX),
+        User.phone.notin_(list(ADMIN_PHONES | tenant.admin_phones))
+    )
+    top_up = db.update(User).values(ai_credits=User.ai_credits + amount).execution_options(synchronize_session=False)
+    updated = 0
+    if scope == 'phones':
+        phones = data.get('phones') or []
+        if isinstance(phones, str):
+            phones = phones.splitlines()
+        if request.files.get('file'):
+            phones += request.files['file'].read().decode('utf-8-sig').splitlines()
+        # One phone per line; for a CSV the first column
+        phones = list(dict.fromkeys(filter(None, (str(p).split(',')[0].strip() for p in phones))))
+        for chunk in _chunks(phones, BULK_BATCH_SIZE):
+            updated += db.session.execute(top_up.where(students, User.phone.in_(chunk))).rowcount
+    elif scope == 'study_year':
+        updated = db.session.execute(top_up.where(students, User.study_year == data.get('study_year'))).rowcount
+    else:
+        updated = db.session.execute(top_up.where(students)).rowcount
+    db.session.commit()
+    invalidate_all_users()
+    print(f">>> Bulk top-up: +{amount} credits for {updated} users ({tenant.slug}, {scope})")
+
+    if request.is_json:
+        return jsonify({"updated": updated, "amount": amount})
+    flash(f"تمت إضافة {amount} نقطة لـ {updated} مستخدم")
+    return redirect(url_for('admin_dashboard'))
+
+def save_import_job(job_id, job):
+    setting = db.session.get(AppSetting, IMPORT_JOB_PREFIX + job_id) or AppSetting(key=IMPORT_JOB_PREFIX + job_id)
+    setting.value = json.dumps(job, ensure_ascii=False)
+    db.session.add(setting)
+    db.session.commit()
+
+def load_import_job(job_id):
+    setting = db.session.get(AppSetting, IMPORT_JOB_PREFIX + (job_id or ""))
+    return json.loads(setting.value) if setting else None
+
+def _skip(job, row, error):
+    job["skipped"] += 1
+    if len(job["errors"]) < IMPORT_JOB_MAX_ERRORS:
+        job["errors"].append({"line": row["line"], "phone": row["phone"], "error": error})
+
+def run_import_job(job_id, job, rows, tenant):
+    started = time.perf_counter()
+    with app.app_context():
+        try:
+            with password_hasher(passwords.hash) as hash_many:
+                for batch in _chunks(rows, BULK_BATCH_SIZE):
+                    phones = [row["phone"] for row in batch]
+                    existing = {phone for (phone,) in db.session.query(User.phone).filter(User.phone.in_(phones))}
+                    fresh = []
+                    for row in batch:
+                        if row["phone"] in existing:
+                            _skip(job, row, "الرقم مسجل مسبقاً")
+                        else:
+                            fresh.append(row)
+                    if fresh:
+                        now = datetime.utcnow()
+                        # Imported accounts confirm their phone by OTP on first login
+                        values = [
+                            {
+                                "full_name": row["full_name"], "phone": row["phone"],
+                                "study_year": row["study_year"], "password": password,
+                                "ai_credits": row.get("ai_credits", tenant.default_credits),
+                                "tenant": tenant.slug,
+                                "points": 0, "study_hours": 0.0, "is_verified": False, "joined_at": now
+                            }
+                            for row, password in zip(fresh, hash_many([row["password"] for row in fresh]))
+                        ]
+                        try:
+                            db.session.execute(db.insert(User), values)
+                            db.session.commit()
+                        except IntegrityError:
+                            # A phone signed up while the batch was hashed; insert the rest
+                            db.session.rollback()
+                            taken = {phone for (phone,) in db.session.query(User.phone).filter(User.phone.in_(phones))}
+                            for row in fresh:
+                                if row["phone"] in taken:
+                                    _skip(job, row, "الرقم مسجل مسبقاً")
+                            values = [v for v in values if v["phone"] not in taken]
+                            if values:
+                                db.session.execute(db.insert(User), values)
+                                db.session.commit()
+                        job["created"] += len(values)
+                    job["processed"] += len(batch)
+                    save_import_job(job_id, job)
+            job["status"] = "done"
+        except Exception as e:
+            db.session.rollback()
+            print(f">>> Bulk import {job_id} failed: {e}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        job["seconds"] = round(time.perf_counter() - started, 1)
+        save_import_job(job_id, job)
+        print(f">>> Bulk import {job_id}: {job['created']} created, {job['skipped']} skipped in {job['seconds']}s")
+    reload_leaderboard(background=True, force=True)
+
+@app.route('/admin/bulk/import', methods=['POST'])
+@login_required
+def admin_bulk_import():
+    if not is_admin_user(current_user):
+        flash("غير مصرح لك بالدخول")
+        return redirect(url_for('dashboard'))
+
+    upload = request.files.get('file')
+    if not upload:
+        message, rows, errors = "اختر ملف CSV", [], []
+    else:
+        rows, errors = parse_user_csv(upload.stream, valid_years=set(current_tenant().curriculum))
+        message = None
+        if len(rows) + len(errors) > BULK_IMPORT_MAX_ROWS:
+            message = f"الملف أكبر من الحد المسموح ({BULK_IMPORT_MAX_ROWS} صف)"
+        elif not rows and errors and errors[0]["line"] == 1:
+            message = errors[0]["error"]
+    if message:
+        if request.is_json or request.accept_mimetypes.best == "application/json":
+            return jsonify({"error": message}), 400
+        flash(message)
+        return redirect(url_for('admin_dashboard'))
+
+    job_id = secrets.token_hex(8)
+    job = {
+        "status": "running", "total": len(rows) + len(errors), "processed": len(errors),
+        "created": 0, "skipped": len(errors), "errors": errors[:IMPORT_JOB_MAX_ERRORS],
+        "started_at": datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    save_import_job(job_id, job)
+    threading.Thread(target=run_import_job, args=(job_id, job, rows, current_tenant()), daemon=True).start()
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"job": job_id, "status_url": url_for('admin_bulk_import_status', job_id=job_id)}), 202
+    return redirect(url_for('admin_dashboard', import_job=job_id))
+
+@app.route('/admin/bulk/import/<job_id>')
+@login_required
+def admin_bulk_import_status(job_id):
+    if not is_admin_user(current_user):
+        return jsonify({"error": "غير مصرح لك بالدخول"}), 403
+    job = load_import_job(job_id)
+    if not job:
+        return jsonify({"error": "العملية غير موجودة"}), 404
+    return jsonify(job)
+
+# ---------------- SEMANTIC CACHE ----------------
+# Near-duplicate AI room queries reuse an earlier explanation for the same tenant,
+# study year and subject instead of calling OpenAI (see semantic_cache.py). Embeddings
+# live in QueryEmbedding; every worker loads them into its in-memory index and
+# picks up other workers' rows every SEMANTIC_CACHE_SYNC_SECONDS.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "1") == "1"
+SEMANTIC_CACHE_SYNC_SECONDS = float(os.getenv("SEMANTIC_CACHE_SYNC_SECONDS", "10"))
+SEMANTIC_CACHE_MAX_ROWS = int(os.getenv("SEMANTIC_CACHE_MAX_ROWS", "200000"))
+SEMANTIC_THRESHOLDS_KEY = "semantic_cache_thresholds"
+
+semantic_embedder = create_embedder() if SEMANTIC_CACHE_ENABLED else None
+semantic_index = SemanticIndex(semantic_embedder.dim) if semantic_embedder else None
+# Admin-tunable: a default cosine threshold (per embedder unless set) and optional per-subject overrides
+semantic_thresholds = {
+    "default": float(os.getenv("SEMANTIC_CACHE_THRESHOLD") or (semantic_embedder.default_threshold if semantic_embedder else 0.9)),
+    "subjects": {}
+}
+_semantic_state = {"last_id": 0, "synced_at": 0.0}
+_semantic_sync_lock = threading.Lock()
+
+def sync_semantic_cache(force=False):
+    """Loads embeddings saved since the last sync (by any worker) and the admin thresholds."""
+    if semantic_index is None:
+        return
+    if not force and time.monotonic() - _semantic_state["synced_at"] < SEMANTIC_CACHE_SYNC_SECONDS:
+        return
+    if not _semantic_sync_lock.acquire(blocking=False):
+        return
+    try:
+        query = db.session.query(
+            QueryEmbedding.id, QueryEmbedding.explanation_id, QueryEmbedding.tenant,
+            QueryEmbedding.study_year, QueryEmbedding.subject, QueryEmbedding.query_text, QueryEmbedding.vector
+        ).filter(QueryEmbedding.embedder == semantic_embedder.name)
+        if _semantic_state["last_id"]:
+            rows = query.filter(QueryEmbedding.id > _semantic_state["last_id"]).order_by(QueryEmbedding.id).all()
+        else:
+            # First load: the newest rows only, oldest first
+            rows = query.order_by(QueryEmbedding.id.desc()).limit(SEMANTIC_CACHE_MAX_ROWS).all()[::-1]
+        for row_id, explanation_id, tenant, study_year, subject, query_text, vector in rows:
+            key = semantic_key(tenant, study_year, subject, query_text)
+            semantic_index.add(key, explanation_id, np.frombuffer(vector, dtype=np.float16))
+            _semantic_state["last_id"] = max(_semantic_state["last_id"], row_id)
+
+        setting = db.session.get(AppSetting, SEMANTIC_THRESHOLDS_KEY)
+        if setting and setting.value:
+            semantic_thresholds.update(json.loads(setting.value))
+        _semantic_state["synced_at"] = time.monotonic()
+    finally:
+        _semantic_sync_lock.release()
+
+def semantic_key(tenant, study_year, subject, query):
+    # Queries are only compared with ones carrying the same numbers/ordinals (see semantic_cache.py)
+    return (tenant or DEFAULT_TENANT, study_year or "", subject or "", number_signature(query))
+
+def semantic_threshold(subject):
+    return float(semantic_thresholds["subjects"].get(subject, semantic_thresholds["default"]))
+
+def semantic_lookup(tenant, study_year, subject, query):
+    """Returns (explanation or None, query vector). The vector is reused to remember a miss."""
+    if semantic_index is None or not query:
+        SEMANTIC_CACHE_LOOKUPS.labels("disabled").inc()
+        return None, None
+    try:
+        sync_semantic_cache()
+        vector = semantic_embedder.embed([query])[0]
+        explanation_id, score = semantic_index.best(semantic_key(tenant, study_year, subject, query), vector)
+    except Exception as e:
+        print(f">>> Semantic cache lookup failed: {e}")
+        SEMANTIC_CACHE_LOOKUPS.labels("error").inc()
+        return None, None
+
+    SEMANTIC_CACHE_SIMILARITY.observe(max(score, 0.0))
+    if explanation_id is None or score < semantic_threshold(subject):
+        SEMANTIC_CACHE_LOOKUPS.labels("miss").inc()
+        return None, vector
+    # Archived or deleted explanations drop out of the hot table; treat as a miss
+    cached = db.session.get(Explanation, explanation_id)
+    if not cached or not cached.content:
+        SEMANTIC_CACHE_LOOKUPS.labels("miss").inc()
+        return None, vector
+    SEMANTIC_CACHE_LOOKUPS.labels("hit").inc()
+    print(f">>> Semantic cache hit ({score:.3f}): {query!r} -> explanation {explanation_id}")
+    return cached, vector
+
+def remember_query(explanation, tenant, study_year, query, vector):
+    if vector is None:
+        return
+    try:
+        db.session.add(QueryEmbedding(
+            explanation_id=explanation.id,
+            user_id=explanation.user_id,
+            tenant=tenant,
+            study_year=study_year or "",
+            subject=explanation.subject or "",
+            query_text=(query or "")[:500],
+            embedder=semantic_embedder.name,
+            vector=np.asarray(vector, dtype=np.float16).tobytes()
+        ))
+        db.session.commit()
+        sync_semantic_cache(force=True)
+    except Exception as e:
+        db.session.rollback()
+        print(f">>> Semantic cache store failed: {e}")
+
+def serve_cached_explanation(user, cached, subject, query, degraded=False):
+    """
+    Saves a copy of a cached explanation for this user and answers like a fresh one.
+    degraded=True (provider down, closest match only) is free and says so.
+    """
+    exp = Explanation(
+        title=f"{subject}: {query}",
+        subject=subject,
+        content=cached.content,
+        content_html=cached.content_html or render_markdown(cached.content),
+        quiz=cached.quiz,
+        user_id=user.id
+    )
+    db.session.add(exp)
+    if not degraded:
+        user.ai_credits -= AI_REQUEST_COST
+        user.points += 10
+        user.study_hours += 0.25
+    with ai_phase("db_commit"):
+        db.session.commit()
+    invalidate_user(user.id)
+    if not degraded:
+        record_points(user)
+        record_usage(user.id, user.study_year, subject, AI_REQUEST_COST)
+    AI_REQUESTS.labels("degraded" if degraded else "cached").inc()
+    payload = {
+        "explanation": exp.content,
+        "quiz": unpack_quiz(exp.quiz),
+        "id": exp.id,
+        "explanation_html": exp.content_html,
+        "cached": True
+    }
+    if degraded:
+        payload["degraded"] = True
+        payload["notice"] = "خدمة الشرح متوقفة مؤقتاً، هذا أقرب شرح محفوظ لسؤالك (مجاناً بدون خصم نقاط)."
+    return jsonify(payload)
+
+with app.app_context():
+    try:
+        sync_semantic_cache(force=True)
+        if semantic_index is not None:
+            print(f">>> Semantic cache loaded: {len(semantic_index)} queries ({semantic_embedder.name})")
+    except Exception as e:
+        db.session.rollback()
+        print(f">>> Semantic cache load failed: {e}")
+
+@app.route('/admin/semantic-cache', methods=['GET', 'POST'])
+@login_required
+def admin_semantic_cache():
+    if not is_platform_admin(current_user):
+        return jsonify({"error": "غير مصرح لك بالدخول"}), 403
 
     if request.method == 'POST':
-        if not current_user.is_in_trial and current_user.ai_credits <= 0:
-            return jsonify({"error": "انتهت فترة التجربة (شهرين) ورصيدك 0، اشترك تزيد نقاط"}), 403
+        payload = request.json or {}
+        try:
+            default = float(payload.get("default", semantic_thresholds["default"]))
+            subjects = {str(k): float(v) for k, v in (payload.get("subjects") or {}).items()}
+        except (TypeError, ValueError):
+            return jsonify({"error": "قيم غير صالحة"}), 400
+        if not all(0 < t <= 1 for t in [default, *subjects.values()]):
+            return jsonify({"error": "العتبة لازم تكون بين 0 و 1"}), 400
+
+        setting = db.session.get(AppSetting, SEMANTIC_THRESHOLDS_KEY) or AppSetting(key=SEMANTIC_THRESHOLDS_KEY)
+        setting.value = json.dumps({"default": default, "subjects": subjects}, ensure_ascii=False)
+        db.session.add(setting)
+        db.session.commit()
+        semantic_thresholds.update({"default": default, "subjects": subjects})
+
+    lookups = counter_totals("afhamha_semantic_cache_lookups", "outcome")
+    hits, misses = lookups.get("hit", 0), lookups.get("miss", 0)
+    return jsonify({
+        "enabled": semantic_index is not None,
+        "embedder": semantic_embedder.name if semantic_embedder else None,
+        "thresholds": semantic_thresholds,
+        "indexed_queries": len(semantic_index) if semantic_index is not None else 0,
+        "lookups": lookups,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None
+    })
+
+# ---------------- DEGRADED MODE ----------------
+# When OpenAI is unconfigured or down (see upstream.py), AI room requests are
+# answered without it: the closest stored explanation for the study year and
+# subject, else matching lesson passages and the subject's reference books,
+# else an immediate 503. Nothing waits on a provider that is known to be down.
+AI_DEGRADED_MIN_SIMILARITY = float(os.getenv("AI_DEGRADED_MIN_SIMILARITY", "0.6"))
+AI_RETRY_AFTER_SECONDS = 30
+UPSTREAM_ERRORS = (openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError)
+
+def probe_openai():
+    client.with_options(timeout=5, max_retries=0).models.retrieve("gpt-4o-mini")
+
+ai_health = UpstreamHealth(
+    probe=probe_openai,
+    failure_threshold=int(os.getenv("AI_FAILURE_THRESHOLD", "3")),
+    cooldown=float(os.getenv("AI_COOLDOWN_SECONDS", "30")),
+    probe_interval=float(os.getenv("AI_PROBE_SECONDS", "15"))
+)
 
-        if current_user.ai_credits <= 0:
-            return jsonify({"error": "رصيدك كمل. اشترك باش تزيد نقاط"}), 403
+def ai_available():
+    return client is not None and ai_health.available()
+
+def closest_explanation(tenant, study_year, subject, query, vector):
+    """Best stored explanation above AI_DEGRADED_MIN_SIMILARITY, whatever the cache threshold."""
+    if semantic_index is None or vector is None:
+        return None
+    explanation_id, score = semantic_index.best(semantic_key(tenant, study_year, subject, query), vector)
+    if explanation_id is None or score < AI_DEGRADED_MIN_SIMILARITY:
+        return None
+    exp = db.session.get(Explanation, explanation_id)
+    return exp if exp and exp.content else None
+
+def lesson_passages(study_year, subject, query, limit=3):
+    """Lessons of the subject ranked by words shared with the query."""
+    words = set(normalize_query(query))
+    if not words:
+        return []
+    scored = []
+    for lesson in Lesson.query.filter_by(study_year=study_year, subject=subject).all():
+        overlap = len(words & set(normalize_query(f"{lesson.lesson_name} {lesson.description or ''}")))
+        if overlap:
+            scored.append((overlap, lesson))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [lesson for _, lesson in scored[:limit]]
+
+def serve_degraded(user, subject, query, vector):
+    cached = closest_explanation(user.tenant, user.study_year, subject, query, vector)
+    if cached:
+        return serve_cached_explanation(user, cached, subject, query, degraded=True)
+
+    lessons = lesson_passages(user.study_year, subject, query)
+    references = build_references_map(user.study_year).get(subject, [])
+    if lessons or references:
+        AI_REQUESTS.labels("degraded").inc()
+        parts = ["**خدمة الشرح متوقفة مؤقتاً.** لين ترجع، هذا اللي يخص سؤالك من المنهج:"]
+        for lesson in lessons:
+            parts.append(f"### {lesson.lesson_name}\n{lesson.description or ''}")
+        if references:
+            parts.append("### مراجع المادة\n" + "\n".join(f"- [{r['label']}]({r['url']})" for r in references))
+        return jsonify({
+            "explanation_html": render_markdown("\n\n".join(parts)),
+            "quiz": [],
+            "id": None,
+            "degraded": True
+        })
 
-        if not client:
-            return jsonify({"error": "خدمات الذكاء الاصطناعي معطلة حالياً. يرجى التواصل مع الإدارة."}), 500
+    AI_REQUESTS.labels("unavailable").inc()
+    response = jsonify({"error": "خدمة الشرح متوقفة مؤقتاً، جرب بعد شوية"})
+    response.headers["Retry-After"] = str(AI_RETRY_AFTER_SECONDS)
+    return response, 503
 
-        data = request.json
-        subject = data.get("subject")
-        query = data.get("query")
+@app.route('/admin/ai-status')
+@login_required
+def admin_ai_status():
+    if not is_platform_admin(current_user):
+        return jsonify({"error": "غير مصرح لك بالدخول"}), 403
+    return jsonify({
+        "configured": client is not None,
+        **ai_health.status(),
+        "structured_outputs": AI_STRUCTURED_OUTPUTS,
+        "parse_outcomes": counter_totals("afhamha_ai_output_parse", "outcome")
+    })
 
-        # Check if this is an English subject
-        is_english = "english" in subject.lower() or "إنجليزي" in subject.lower()
+# ---------------- AI ROOM ----------------
+def build_ai_prompt(subject, query, study_year):
+    """Returns (system_message, prompt) for an AI room explanation request."""
+    # Check if this is an English subject
+    is_english = "english" in subject.lower() or "إنجليزي" in subject.lower()
 
-        # Enhanced Persona and Instructions
-        if is_english:
-            system_message = "أنت 'أستاذ ليبي عبقري' ومحبوب جداً، اسمك 'افهمها وفهمني'. تخصصك تبسيط اللغة الإنجليزية لطلاب المنهج الليبي. شخصيتك مشوقة، تستخدم أمثلة من واقع الحياة الليبية، وتحبب الطالب في اللغة بعيداً عن التعقيد."
-            prompt = f"""
-مرحباً يا بطل! نبيك تشرحلي موضوع ({query}) في مادة ({subject}) لصف ({current_user.study_year}) بالمنهج الليبي.
+    # Enhanced Persona and Instructions
+    if is_english:
+        system_message = "أنت 'أستاذ ليبي عبقري' ومحبوب جداً، اسمك 'افهمها وفهمني'. تخصصك تبسيط اللغة الإنجليزية لطلاب المنهج الليبي. شخصيتك مشوقة، تستخدم أمثلة من واقع الحياة الليبية، وتحبب الطالب في اللغة بعيداً عن التعقيد."
+        prompt = f"""
+مرحباً يا بطل! نبيك تشرحلي موضوع ({query}) في مادة ({subject}) لصف ({study_year}) بالمنهج الليبي.
 
 خطة الدرس (التعليمات):
 1. **المقدمة**: ابدأ بترحيب حار بلهجة ليبية بيضاء (مثلاً: ركز معاي يا وحش، اليوم موضوعنا ساهل...)، ووضح أهمية الموضوع في المنهج.
@@ -707,10 +1951,10 @@ def ai_room():
  ]
 }}
 """
-        else:
-            system_message = "أنت 'أستاذ ليبي خبير' في المنهج الدراسي، اسمك 'افهمها وفهمني'. أسلوبك يتميز بالبساطة، خفة الدم، والقدرة العالية على تبسيط أصعب المفاهيم العلمية بلهجة ليبية بيضاء محببة للطلاب."
-            prompt = f"""
-يا أستاذ، نبيك تشرحلي موضوع ({query}) في مادة ({subject}) لصف ({current_user.study_year}) حسب كتاب المنهج الليبي.
+    else:
+        system_message = "أنت 'أستاذ ليبي خبير' في المنهج الدراسي، اسمك 'افهمها وفهمني'. أسلوبك يتميز بالبساطة، خفة الدم، والقدرة العالية على تبسيط أصعب المفاهيم العلمية بلهجة ليبية بيضاء محببة للطلاب."
+        prompt = f"""
+يا أستاذ، نبيك تشرحلي موضوع ({query}) في مادة ({subject}) لصف ({study_year}) حسب كتاب المنهج الليبي.
 
 خطة الدرس (التعليمات):
 1. **البداية**: ترحيب بلهجة ليبية وكلمتين تشجيع للطالب (مثلاً: الدرس هذا كان معقدك، اليوم بيولي زي الشكلاطة).
@@ -729,36 +1973,122 @@ def ai_room():
 }}
 """
 
+    return system_message, prompt
+
+def credit_error(user):
+    """A 403 response when the user cannot pay for an AI request, else None."""
+    if user.ai_credits > 0:
+        return None
+    AI_REQUESTS.labels("no_credits").inc()
+    if not user.is_in_trial:
+        return jsonify({"error": "انتهت فترة التجربة (شهرين) ورصيدك 0، اشترك تزيد نقاط"}), 403
+    return jsonify({"error": "رصيدك كمل. اشترك باش تزيد نقاط"}), 403
+
+def response_format(schema):
+    return schema if AI_STRUCTURED_OUTPUTS else {"type": "json_object"}
+
+def read_model_output(response, kind, required):
+    """
+    Parses a chat completion through ai_output.parse(). Returns (data, outcome);
+    data is None when nothing usable came back.
+    """
+    choice = response.choices[0]
+    finish_reason = choice.finish_reason or "unknown"
+    data, outcome = ai_output.parse(choice.message.content, required)
+    AI_OUTPUT_PARSE.labels(kind, outcome, finish_reason).inc()
+    if outcome != "ok":
+        content = choice.message.content or getattr(choice.message, "refusal", None) or ""
+        print(f">>> AI {kind} reply {outcome} (finish_reason={finish_reason}, {len(content)} chars)")
+    return data, outcome
+
+@app.route('/ai-room', methods=['GET', 'POST'])
+@login_required
+def ai_room():
+    tenant = tenants.get(current_user.tenant)
+    subjects = tenant.subjects(current_user.study_year)
+    references_map = build_references_map(current_user.study_year)
+
+    if request.method == 'POST':
+        with ai_phase("credit_check"):
+            user = current_user_row()
+        error = credit_error(user)
+        if error:
+            return error
+
+        data = request.json
+        subject = data.get("subject")
+        query = data.get("query")
+
+        with ai_phase("semantic_cache"):
+            cached, query_vector = semantic_lookup(tenant.slug, current_user.study_year, subject, query)
+        if cached:
+            return serve_cached_explanation(user, cached, subject, query)
+
+        if not ai_available():
+            return serve_degraded(user, subject, query, query_vector)
+
+        with ai_phase("prompt_build"):
+            system_message, prompt = build_ai_prompt(subject, query, current_user.study_year)
+
         try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"}
-            )
+            with tenants.quota(tenant).slot(), ai_phase("openai"):
+                response = client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": system_message},
+                        {"role": "user", "content": prompt}
+                    ],
+                    response_format=response_format(ai_output.EXPLANATION_SCHEMA)
+                )
+            ai_health.record_success()
+            record_token_usage(getattr(response, "usage", None))
+
+            with ai_phase("json_parse"):
+                ai_data, outcome = read_model_output(response, "explanation", "explanation")
+            if ai_data is None:
+                AI_REQUESTS.labels("error").inc()
+                return jsonify({"error": "فشل توليد الشرح، جرب مرة ثانية"}), 500
 
-            ai_data = json.loads(response.choices[0].message.content)
-            
             # Save explanation to DB
             exp = Explanation(
                 title=f"{subject}: {query}",
                 subject=subject,
                 content=ai_data["explanation"],
+                content_html=render_markdown(ai_data["explanation"]),
+                quiz=pack_quiz(ai_data.get("quiz")),
                 user_id=current_user.id
             )
             db.session.add(exp)
 
             # Update user stats
-            current_user.ai_credits -= 5
-            current_user.points += 10
-            current_user.study_hours += 0.25
+            user.ai_credits -= AI_REQUEST_COST
+            user.points += 10
+            user.study_hours += 0.25
 
-            db.session.commit()
+            with ai_phase("db_commit"):
+                db.session.commit()
+            invalidate_user(user.id)
+            record_points(user)
+            record_usage(user.id, user.study_year, subject, AI_REQUEST_COST, getattr(response, "usage", None))
+            if outcome == "ok":
+                # A repaired (possibly cut short) explanation is not served to other students
+                remember_query(exp, tenant.slug, user.study_year, query, query_vector)
+            AI_REQUESTS.labels("ok").inc()
+            ai_data["quiz"] = unpack_quiz(exp.quiz)
+            ai_data["id"] = exp.id
+            ai_data["explanation_html"] = exp.content_html
             return jsonify(ai_data)
 
+        except TenantBusy as busy:
+            return tenant_busy_response(tenant, busy)
+        except UPSTREAM_ERRORS as e:
+            db.session.rollback()
+            AI_REQUESTS.labels("error").inc()
+            print(f"AI Error: {e}")
+            ai_health.record_failure(e)
+            return serve_degraded(user, subject, query, query_vector)
         except Exception as e:
+            AI_REQUESTS.labels("error").inc()
             print(f"AI Error: {e}")
             return jsonify({"error": "فشل توليد الشرح، جرب مرة ثانية"}), 500
 
@@ -769,8 +2099,17 @@ def ai_room():
     )
 
 # ---------------- MY EXPLANATIONS ----------------
+def ensure_rendered(explanations):
+    """Renders and stores HTML for explanations saved before pre-rendering existed."""
+    missing = [e for e in explanations if e.content_html is None]
+    for e in missing:
+        e.content_html = render_markdown(e.content)
+    if missing:
+        db.session.commit()
+
 @app.route('/my-explanations')
 @login_required
+@replica_reads
 def my_explanations():
     explanations = (
         Explanation.query
@@ -778,11 +2117,35 @@ def my_explanations():
         .order_by(Explanation.created_at.desc())
         .all()
     )
-    return render_template('my_explanations.html', explanations=explanations)
+    ensure_rendered(explanations)
+    # Archived items are listed from their metadata; the modal fetches the content on open
+    archived = (
+        ArchivedExplanation.query
+        .with_entities(
+            ArchivedExplanation.id, ArchivedExplanation.title,
+            ArchivedExplanation.preview, ArchivedExplanation.created_at
+        )
+        .filter_by(user_id=current_user.id)
+        .order_by(ArchivedExplanation.created_at.desc())
+        .all()
+    )
+    archived = [
+        {"id": a.id, "title": a.title, "preview": a.preview, "created_at": a.created_at, "archived": True}
+        for a in archived
+    ]
+    response = make_response(render_template(
+        'my_explanations.html',
+        explanations=explanations + archived
+    ))
+    return conditional_response(
+        response, request,
+        last_modified=explanations[0].created_at if explanations else None
+    )
 
 # ---------------- API HISTORY ----------------
 @app.route('/api/explanations')
 @login_required
+@replica_reads
 def api_explanations():
     explanations = (
         Explanation.query
@@ -791,22 +2154,751 @@ def api_explanations():
         .limit(10)
         .all()
     )
+    ensure_rendered(explanations)
 
-    return jsonify([
+    response = jsonify([
         {
             "id": e.id,
             "title": e.title,
             "content": e.content,
+            "content_html": e.content_html,
             "date": e.created_at.strftime('%Y-%m-%d %H:%M')
         }
         for e in explanations
     ])
+    return conditional_response(
+        response, request,
+        last_modified=explanations[0].created_at if explanations else None
+    )
+
+@app.route('/api/explanations/<int:explanation_id>')
+@login_required
+@replica_reads
+def api_explanation(explanation_id):
+    exp = load_explanation(explanation_id, current_user.id)
+    if not exp:
+        return jsonify({"error": "الشرح غير موجود"}), 404
+    return jsonify({
+        "id": exp.id,
+        "title": exp.title,
+        "content": exp.content,
+        "content_html": exp.content_html or render_markdown(exp.content),
+        "date": exp.created_at.strftime('%Y-%m-%d %H:%M')
+    })
+
+# ---------------- QUIZ ----------------
+def pack_quiz(quiz):
+    """
+    Packs the model's quiz list into a compact JSON string:
+    [[question, [options...], correct_index], ...]
+    Malformed items are dropped instead of failing the whole save.
+    """
+    packed = []
+    for q in quiz or []:
+        if not isinstance(q, dict):
+            continue
+        question = q.get("question")
+        options = q.get("options")
+        correct = q.get("correct")
+        if not question or not isinstance(options, list) or not isinstance(correct, int):
+            continue
+        if not 0 <= correct < len(options):
+            continue
+        packed.append([str(question), [str(o) for o in options], correct])
+    if not packed:
+        return None
+    return json.dumps(packed, ensure_ascii=False, separators=(",", ":"))
+
+def unpack_quiz(raw):
+    if not raw:
+        return []
+    try:
+        return [
+            {"question": q, "options": opts, "correct": c}
+            for q, opts, c in json.loads(raw)
+        ]
+    except (ValueError, TypeError):
+        return []
+
+def record_quiz_attempt(user, explanation, score, total):
+    """Stores the attempt and bumps the user's running mastery totals for the subject."""
+    user_id, explanation_id = user.id, explanation.id
+    subject = explanation.subject or ""
+    for _ in range(2):
+        db.session.add(QuizAttempt(
+            user_id=user_id,
+            explanation_id=explanation_id,
+            subject=subject,
+            score=score,
+            total=total
+        ))
+        now = datetime.utcnow()
+        updated = SubjectMastery.query.filter_by(user_id=user_id, subject=subject).update({
+            SubjectMastery.attempts: SubjectMastery.attempts + 1,
+            SubjectMastery.correct: SubjectMastery.correct + score,
+            SubjectMastery.answered: SubjectMastery.answered + total,
+            SubjectMastery.updated_at: now
+        }, synchronize_session=False)
+        if not updated:
+            db.session.add(SubjectMastery(user_id=user_id, subject=subject, attempts=1,
+                                          correct=score, answered=total, updated_at=now))
+        try:
+            db.session.commit()
+            break
+        except IntegrityError:
+            # A concurrent first attempt created the row; the retry updates it
+            db.session.rollback()
+    return SubjectMastery.query.filter_by(user_id=user_id, subject=subject).first()
+
+@app.route('/api/explanations/<int:explanation_id>/quiz', methods=['GET', 'POST'])
+@login_required
+def explanation_quiz(explanation_id):
+    # Grading writes a QuizAttempt, so an archived explanation is moved back first
+    exp = load_explanation(explanation_id, current_user.id, restore=request.method == 'POST')
+    if not exp:
+        return jsonify({"error": "الشرح غير موجود"}), 404
+
+    quiz = unpack_quiz(exp.quiz)
+
+    if request.method == 'GET':
+        # Answers stay on the server, grading happens on POST
+        return jsonify({
+            "id": exp.id,
+            "quiz": [{"question": q["question"], "options": q["options"]} for q in quiz]
+        })
+
+    if not quiz:
+        return jsonify({"error": "ما فيش أسئلة محفوظة لهذا الشرح"}), 404
+
+    # One entry per question: the chosen option's index, or null when left blank
+    answers = (request.get_json(silent=True) or {}).get("answers")
+    if not isinstance(answers, list) or len(answers) != len(quiz) or not all(
+        a is None or (isinstance(a, int) and not isinstance(a, bool)) for a in answers
+    ):
+        return jsonify({"error": "الإجابات غير صالحة"}), 400
+    correct = [q["correct"] for q in quiz]
+    score = sum(1 for a, c in zip(answers, correct) if a == c)
+
+    mastery = record_quiz_attempt(current_user, exp, score, len(correct))
+    return jsonify({
+        "score": score,
+        "total": len(correct),
+        "correct": correct,
+        "mastery": mastery.percent
+    })
+
+# ---------------- FOLLOW-UPS ----------------
+# Follow-up questions on an explanation answer briefly instead of regenerating
+# it. The prompt starts with the explanation itself (identical for every turn,
+# so it hits the provider's prompt cache) and carries only the recent turns that
+# fit CONVERSATION_CONTEXT_TOKENS plus a running memo (see conversation.py).
+FOLLOWUP_COST = int(os.getenv("FOLLOWUP_COST", "1"))
+FOLLOWUP_MAX_TOKENS = int(os.getenv("FOLLOWUP_MAX_TOKENS", "700"))
+CONVERSATION_CONTEXT_TOKENS = int(os.getenv("CONVERSATION_CONTEXT_TOKENS", "1500"))
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "30"))
+context_window = ContextWindow(CONVERSATION_CONTEXT_TOKENS)
+
+FOLLOWUP_RULES = """الطالب قرأ الشرح اللي تحت ويسأل أسئلة متابعة عليه.
+- جاوب على السؤال فقط وباختصار (فقرة أو قائمة قصيرة)، وما تعيدش الشرح كامل.
+- لو السؤال برا موضوع الشرح، رد بلطف ووجهه يفتح شرح جديد.
+رد عليا بصيغة JSON فقط كالتالي:
+{
+ "answer": "الإجابة بـ Markdown",
+ "memo": "ملخص في سطرين لكل اللي سأل عليه الطالب في المحادثة لحد الآن وإجاباتك"
+}"""
+
+def followup_prefix(exp, study_year):
+    """The stable leading messages of every follow-up prompt on `exp`."""
+    system_message, _ = build_ai_prompt(exp.subject or "", exp.title or "", study_year)
+    return [{
+        "role": "system",
+        "content": f"{system_message}\n\n{FOLLOWUP_RULES}\n\nالشرح ({exp.title}):\n{exp.content}"
+    }]
+
+def serialize_turn(turn):
+    return {
+        "id": turn.id,
+        "question": turn.question,
+        "answer_html": turn.answer_html,
+        "date": turn.created_at.strftime('%Y-%m-%d %H:%M')
+    }
+
+@app.route('/api/explanations/<int:explanation_id>/turns', methods=['GET', 'POST'])
+@login_required
+def explanation_turns(explanation_id):
+    # A new turn is written next to the explanation, so an archived one is moved back first
+    exp = load_explanation(explanation_id, current_user.id, restore=request.method == 'POST')
+    if not exp:
+        return jsonify({"error": "الشرح غير موجود"}), 404
+
+    turns = ExplanationTurn.query.filter_by(explanation_id=exp.id).order_by(ExplanationTurn.id).all()
+    if request.method == 'GET':
+        if db.inspect(exp).transient:
+            # Loaded from the archive; its turns are in the payload
+            archived = db.session.get(ArchivedExplanation, exp.id)
+            return jsonify([
+                {"id": None, "question": question, "answer_html": answer_html,
+                 "date": datetime.fromisoformat(created_at).strftime('%Y-%m-%d %H:%M') if created_at else ""}
+                for question, _, answer_html, _, _, created_at in _archived_payload(archived).get("turns", [])
+            ])
+        return jsonify([serialize_turn(t) for t in turns])
+
+    question = ((request.json or {}).get("question") or "").strip()
+    if not question:
+        return jsonify({"error": "اكتب سؤالك"}), 400
+    if len(question) > 500:
+        return jsonify({"error": "السؤال طويل، اختصره شوية"}), 400
+    if len(turns) >= CONVERSATION_MAX_TURNS:
+        return jsonify({"error": "المحادثة على هذا الشرح طويلة، افتح شرح جديد"}), 400
+
+    user = current_user_row()
+    error = credit_error(user)
+    if error:
+        return error
+    if not ai_available():
+        AI_REQUESTS.labels("unavailable").inc()
+        response = jsonify({"error": "خدمة الأسئلة متوقفة مؤقتاً، جرب بعد شوية"})
+        response.headers["Retry-After"] = str(AI_RETRY_AFTER_SECONDS)
+        return response, 503
+
+    messages = context_window.messages(followup_prefix(exp, user.study_year), turns, question)
+    tenant = tenants.get(user.tenant)
+    try:
+        with tenants.quota(tenant).slot(), ai_phase("openai_followup"):
+            response = client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                response_format=response_format(ai_output.FOLLOWUP_SCHEMA),
+                max_tokens=FOLLOWUP_MAX_TOKENS,
+                prompt_cache_key=f"explanation-{exp.id}"
+            )
+        ai_health.record_success()
+        usage = getattr(response, "usage", None)
+        record_token_usage(usage)
+        ai_data, _ = read_model_output(response, "followup", "answer")
+        if ai_data is None:
+            raise ValueError("no answer in reply")
+        answer = ai_data["answer"].strip()
+
+        turn = ExplanationTurn(
+            explanation_id=exp.id,
+            user_id=user.id,
+            question=question,
+            answer=answer,
+            answer_html=render_markdown(answer),
+            memo=(ai_data.get("memo") or "").strip() or None,
+            tokens=estimate_tokens(question) + (getattr(usage, "completion_tokens", 0) or estimate_tokens(answer))
+        )
+        db.session.add(turn)
+        user.ai_credits -= FOLLOWUP_COST
+        user.points += 2
+        user.study_hours += 0.05
+        db.session.commit()
+        invalidate_user(user.id)
+        record_points(user)
+        record_usage(user.id, user.study_year, exp.subject, FOLLOWUP_COST, usage)
+        AI_REQUESTS.labels("followup_ok").inc()
+        return jsonify(serialize_turn(turn))
+
+    except TenantBusy as busy:
+        return tenant_busy_response(tenant, busy)
+    except Exception as e:
+        db.session.rollback()
+        if isinstance(e, UPSTREAM_ERRORS):
+            ai_health.record_failure(e)
+        AI_REQUESTS.labels("followup_error").inc()
+        print(f"AI Follow-up Error: {e}")
+        return jsonify({"error": "فشل توليد الإجابة، جرب مرة ثانية"}), 500
+
+# ---------------- RETENTION ----------------
+# Explanations older than ARCHIVE_AFTER_MONTHS move to ArchivedExplanation in
+# batches (python retention.py archive), keeping the hot table and its indexes
+# small. Deleted users are purged in chunks by a background thread.
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "12"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+DELETED_PHONE_PREFIX = "deleted-"
+
+def archive_explanations(months=None, batch_size=None, max_batches=None):
+    """Moves explanations older than `months` (with quiz attempts and follow-ups) to the archive. Returns the count."""
+    months = ARCHIVE_AFTER_MONTHS if months is None else months
+    batch_size = batch_size or RETENTION_BATCH_SIZE
+    if months <= 0:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=30 * months)
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batch = (
+            Explanation.query
+            .filter(Explanation.created_at < cutoff)
+            .order_by(Explanation.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        ids = [e.id for e in batch]
+        attempts = {}
+        for a in QuizAttempt.query.filter(QuizAttempt.explanation_id.in_(ids)).all():
+            attempts.setdefault(a.explanation_id, []).append(
+                [a.user_id, a.subject, a.score, a.total, a.created_at.isoformat() if a.created_at else None]
+            )
+        turns = {}
+        for t in ExplanationTurn.query.filter(ExplanationTurn.explanation_id.in_(ids)).order_by(ExplanationTurn.id).all():
+            turns.setdefault(t.explanation_id, []).append(
+                [t.question, t.answer, t.answer_html, t.memo, t.tokens, t.created_at.isoformat() if t.created_at else None]
+            )
+
+        db.session.execute(db.insert(ArchivedExplanation), [
+            {
+                "id": e.id,
+                "user_id": e.user_id,
+                "title": e.title,
+                "subject": e.subject,
+                "preview": (e.content or "")[:300],
+                "created_at": e.created_at,
+                "archived_at": datetime.utcnow(),
+                "payload": zlib.compress(json.dumps({
+                    "content": e.content,
+                    "content_html": e.content_html,
+                    "quiz": e.quiz,
+                    "attempts": attempts.get(e.id, []),
+                    "turns": turns.get(e.id, []),
+                }, ensure_ascii=False).encode("utf-8")),
+            }
+            for e in batch
+        ])
+        QuizAttempt.query.filter(QuizAttempt.explanation_id.in_(ids)).delete(synchronize_session=False)
+        ExplanationTurn.query.filter(ExplanationTurn.explanation_id.in_(ids)).delete(synchronize_session=False)
+        Explanation.query.filter(Explanation.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.expunge_all()
+
+        moved += len(ids)
+        batches += 1
+        print(f">>> Archived {moved} explanations")
+        time.sleep(RETENTION_BATCH_PAUSE)
+    return moved
+
+def _archived_payload(archived):
+    return json.loads(zlib.decompress(archived.payload).decode("utf-8"))
+
+def load_explanation(explanation_id, user_id, restore=False):
+    """
+    Returns the user's explanation from the hot table, or from the archive.
+    Archived items come back as a detached Explanation unless restore=True,
+    which moves the row back into the hot table.
+    """
+    exp = Explanation.query.filter_by(id=explanation_id, user_id=user_id).first()
+    if exp:
+        return exp
+    archived = ArchivedExplanation.query.filter_by(id=explanation_id, user_id=user_id).first()
+    if not archived:
+        return None
+    if restore:
+        return restore_explanation(archived)
+    data = _archived_payload(archived)
+    return Explanation(
+        id=archived.id,
+        title=archived.title,
+        subject=archived.subject,
+        content=data["content"],
+        content_html=data["content_html"],
+        quiz=data["quiz"],
+        created_at=archived.created_at,
+        user_id=archived.user_id
+    )
+
+def restore_explanation(archived):
+    data = _archived_payload(archived)
+    exp = Explanation(
+        id=archived.id,
+        title=archived.title,
+        subject=archived.subject,
+        content=data["content"],
+        content_html=data["content_html"],
+        quiz=data["quiz"],
+        created_at=archived.created_at,
+        user_id=archived.user_id
+    )
+    db.session.add(exp)
+    for user_id, subject, score, total, created_at in data.get("attempts", []):
+        db.session.add(QuizAttempt(
+            user_id=user_id,
+            explanation_id=archived.id,
+            subject=subject,
+            score=score,
+            total=total,
+            created_at=datetime.fromisoformat(created_at) if created_at else None
+        ))
+    for question, answer, answer_html, memo, tokens, created_at in data.get("turns", []):
+        db.session.add(ExplanationTurn(
+            explanation_id=archived.id,
+            user_id=archived.user_id,
+            question=question,
+            answer=answer,
+            answer_html=answer_html,
+            memo=memo,
+            tokens=tokens,
+            created_at=datetime.fromisoformat(created_at) if created_at else None
+        ))
+    db.session.delete(archived)
+    db.session.commit()
+    return exp
+
+def _delete_in_chunks(model, *criteria, batch_size=None):
+    batch_size = batch_size or RETENTION_BATCH_SIZE
+    while True:
+        ids = [row[0] for row in db.session.query(model.id).filter(*criteria).limit(batch_size).all()]
+        if not ids:
+            return
+        db.session.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+def purge_user(user_id):
+    """Deletes a user's rows in short transactions, then the user itself."""
+    _delete_in_chunks(QuizAttempt, QuizAttempt.user_id == user_id)
+    _delete_in_chunks(ExplanationTurn, ExplanationTurn.user_id == user_id)
+    _delete_in_chunks(Explanation, Explanation.user_id == user_id)
+    _delete_in_chunks(ArchivedExplanation, ArchivedExplanation.user_id == user_id)
+    _delete_in_chunks(QueryEmbedding, QueryEmbedding.user_id == user_id)
+    SubjectMastery.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
+    UserDeletion.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    db.session.commit()
+    invalidate_user(user_id)
+    print(f">>> Purged user {user_id}")
+
+def process_deletions():
+    """Purges every queued user deletion. Returns the number of users purged."""
+    purged = 0
+    while True:
+        pending = UserDeletion.query.order_by(UserDeletion.requested_at).first()
+        if not pending:
+            return purged
+        purge_user(pending.user_id)
+        purged += 1
+
+_deletion_worker_lock = threading.Lock()
+
+def start_deletion_worker():
+    def run():
+        # One purge thread per worker process; later requests are picked up by its loop
+        if not _deletion_worker_lock.acquire(blocking=False):
+            return
+        try:
+            with app.app_context():
+                process_deletions()
+        except Exception as e:
+            print(f">>> User purge failed: {e}")
+        finally:
+            _deletion_worker_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+# ---------------- LEADERBOARD ----------------
+# Rank by points per study year and school-wide, within each tenant (see
+# leaderboard.py). Awards update
+# the boards directly; page views never sort or count the user table.
+# LEADERBOARD_BACKEND: memory (default, each worker reloads every
+# LEADERBOARD_RELOAD_SECONDS in the background) or redis (shared sorted sets,
+# rebuilt by one worker every LEADERBOARD_RELOAD_SECONDS).
+LEADERBOARD_BACKEND = os.getenv("LEADERBOARD_BACKEND", "redis" if SESSION_BACKEND == "redis" else "memory")
+LEADERBOARD_RELOAD_SECONDS = float(os.getenv("LEADERBOARD_RELOAD_SECONDS", "300"))
+LEADERBOARD_TOP_N = int(os.getenv("LEADERBOARD_TOP_N", "100"))
+LEADERBOARD_TOP_TTL = float(os.getenv("LEADERBOARD_TOP_TTL", "30"))
+LEADERBOARD_PAGE_SIZE = 20
+
+leaderboard = create_leaderboard(
+    LEADERBOARD_BACKEND,
+    url=os.getenv("LEADERBOARD_URL") or os.getenv("SESSION_STORE_URL"),
+    reload_seconds=LEADERBOARD_RELOAD_SECONDS
+)
+_leaderboard_state = {"loaded_at": 0.0, "reloading": False}
+_leaderboard_top_cache = {}
+_leaderboard_lock = threading.Lock()
+
+def leaderboard_rows():
+    """(user_id, tenant, study_year, points) of every ranked student; used only for (re)loads."""
+    return (
+        db.session.query(User.id, User.tenant, User.study_year, User.points)
+        .filter(
+            User.study_year.isnot(None),
+            User.phone.notin_(list(all_admin_phones())),
+            ~User.phone.startswith(DELETED_PHONE_PREFIX)
+        )
+        .yield_per(5000)
+    )
+
+def reload_leaderboard(background=False, force=False):
+    """force: rebuild shared (redis) boards even if another worker just did."""
+    with _leaderboard_lock:
+        if _leaderboard_state["reloading"]:
+            return
+        _leaderboard_state["reloading"] = True
+
+    def run():
+        try:
+            with app.app_context():
+                leaderboard.load(leaderboard_rows(), force=force)
+            _leaderboard_state["loaded_at"] = time.monotonic()
+        except Exception as e:
+            print(f">>> Leaderboard reload failed: {e}")
+        finally:
+            _leaderboard_state["reloading"] = False
+
+    if background:
+        threading.Thread(target=run, daemon=True).start()
+    else:
+        run()
+
+def refresh_leaderboard_if_stale():
+    if time.monotonic() - _leaderboard_state["loaded_at"] > LEADERBOARD_RELOAD_SECONDS:
+        reload_leaderboard(background=True)
+
+def record_points(user):
+    """Pushes a user's new point total to their boards. Never fails the request."""
+    if not user.study_year or is_admin_user(user):
+        return
+    try:
+        leaderboard.set(user.id, user.tenant, user.study_year, user.points)
+    except Exception as e:
+        print(f">>> Leaderboard update failed: {e}")
+
+def remove_from_leaderboard(user_id, tenant, study_year):
+    try:
+        leaderboard.remove(user_id, tenant, study_year)
+    except Exception as e:
+        print(f">>> Leaderboard update failed: {e}")
+
+def my_rank(user_id, tenant, study_year):
+    """{"global": {...}, "study_year": {...}} with rank and board size, or None when unranked."""
+    refresh_leaderboard_if_stale()
+    result = {}
+    for scope, board in (("global", GLOBAL_BOARD), ("study_year", study_year)):
+        if not board:
+            result[scope] = None
+            continue
+        try:
+            rank, size = leaderboard.rank(board_name(tenant, board), user_id)
+        except Exception as e:
+            print(f">>> Leaderboard read failed: {e}")
+            rank, size = None, 0
+        result[scope] = {"rank": rank, "of": size} if rank else None
+    return result
+
+def leaderboard_top(board):
+    """
+    Top LEADERBOARD_TOP_N of a board (full "<tenant>:<board>" name) with first
+    names, cached for LEADERBOARD_TOP_TTL seconds.
+    """
+    refresh_leaderboard_if_stale()
+    now = time.monotonic()
+    cached = _leaderboard_top_cache.get(board)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    top = leaderboard.top(board, LEADERBOARD_TOP_N)
+    names = dict(
+        db.session.query(User.id, User.full_name)
+        .filter(User.id.in_([user_id for user_id, _ in top]))
+        .all()
+    ) if top else {}
+    rows = []
+    rank, previous = 0, None
+    for position, (user_id, points) in enumerate(top, 1):
+        if points != previous:
+            rank, previous = position, points
+        # First name only: the board is visible to every student in the year
+        name = (names.get(user_id) or "").split()
+        rows.append({"rank": rank, "user_id": user_id, "name": name[0] if name else "طالب", "points": points})
+    _leaderboard_top_cache[board] = (rows, now + LEADERBOARD_TOP_TTL)
+    return rows
+
+def leaderboard_scope(scope):
+    """(scope, board) for the current user: their study year's board or the school-wide one."""
+    if scope == 'study_year' and current_user.study_year:
+        return 'study_year', current_user.study_year
+    return 'global', GLOBAL_BOARD
+
+def leaderboard_page(board, page):
+    rows = leaderboard_top(board_name(current_user.tenant, board))
+    pages = max(1, -(-len(rows) // LEADERBOARD_PAGE_SIZE))
+    page = min(max(page, 1), pages)
+    start = (page - 1) * LEADERBOARD_PAGE_SIZE
+    return [
+        {"rank": r["rank"], "name": r["name"], "points": r["points"], "is_me": r["user_id"] == current_user.id}
+        for r in rows[start:start + LEADERBOARD_PAGE_SIZE]
+    ], page, pages
+
+with app.app_context():
+    reload_leaderboard()
+
+@app.route('/leaderboard')
+@login_required
+def leaderboard_view():
+    scope, board = leaderboard_scope(request.args.get('scope', 'study_year'))
+    rows, page, pages = leaderboard_page(board, request.args.get('page', 1, type=int))
+    return render_template(
+        'leaderboard.html',
+        rows=rows,
+        scope=scope,
+        page=page,
+        pages=pages,
+        rank=my_rank(current_user.id, current_user.tenant, current_user.study_year)
+    )
+
+@app.route('/api/leaderboard')
+@login_required
+def api_leaderboard():
+    scope, board = leaderboard_scope(request.args.get('scope', 'study_year'))
+    rows, page, pages = leaderboard_page(board, request.args.get('page', 1, type=int))
+    return jsonify({
+        "scope": scope,
+        "board": board,
+        "page": page,
+        "pages": pages,
+        "rows": rows
+    })
+
+@app.route('/api/leaderboard/me')
+@login_required
+def api_leaderboard_me():
+    rank = my_rank(current_user.id, current_user.tenant, current_user.study_year)
+    rank["points"] = current_user.points
+    return jsonify(rank)
 
 @app.route('/logout')
 def logout():
     logout_user()
     return redirect(url_for('index'))
 
+# ---------------- WARM-UP ----------------
+# Each worker warms up while it imports the app, before it accepts connections
+# (see readiness.py): pool connections are opened, every template compiled,
+# static lookups and hot caches primed, and the OpenAI connection established.
+# Point the load balancer's health check at /readyz; /healthz is liveness only.
+WARMUP_ENABLED = os.getenv("WARMUP", "1") == "1"
+READYZ_CACHE_SECONDS = float(os.getenv("READYZ_CACHE_SECONDS", "2"))
+_started_at = time.time()
+
+def warm_pool(engine):
+    """Opens the pool's connections up front so the first requests find them idle."""
+    size = int(os.getenv("WARMUP_DB_CONNECTIONS", "0")) or getattr(engine.pool, "size", lambda: 1)()
+    conns = []
+    try:
+        for _ in range(size):
+            conn = engine.connect()
+            conns.append(conn)
+            conn.execute(db.text("SELECT 1"))
+    finally:
+        for conn in conns:
+            conn.close()
+    return {"connections": len(conns)}
+
+def warm_templates():
+    names = [name for name in app.jinja_env.list_templates() if name.endswith(".html")]
+    for name in names:
+        app.jinja_env.get_template(name)
+    return {"templates": len(names)}
+
+def warm_static_lookups():
+    years = set(STUDY_YEAR_REFERENCE_FOLDER)
+    for tenant in tenants.all():
+        years.update(tenant.study_years)
+    with app.test_request_context():
+        for year in years:
+            build_references_map(year)
+    render_markdown("# warm-up\n\n- markdown | and tables")
+    return {"study_years": len(years)}
+
+def warm_pages():
+    global _index_html
+    with app.test_request_context():
+        _index_html = render_template('index.html')
+
+def warm_caches():
+    for tenant in tenants.all():
+        leaderboard_top(board_name(tenant.slug, GLOBAL_BOARD))
+    if semantic_embedder is not None:
+        semantic_embedder.embed(["warm-up"])
+    return {"tenants": len(tenants.all())}
+
+def warm_upstream():
+    """One cheap call so the HTTPS connection to OpenAI is open and kept alive."""
+    if client is None:
+        return "not configured"
+    probe_openai()
+    ai_health.record_success()
+
+def warm_up():
+    steps = [
+        ("database", lambda: warm_pool(db.engine)),
+        ("templates", warm_templates),
+        ("static_lookups", warm_static_lookups),
+        ("pages", warm_pages),
+        ("caches", warm_caches),
+        ("upstream", warm_upstream),
+    ]
+    if replica.engine is not None:
+        steps.insert(1, ("replica", lambda: warm_pool(replica.engine)))
+    with app.app_context():
+        warmup.run(steps)
+        db.session.remove()
+
+def check_database():
+    with db.engine.connect() as conn:
+        conn.execute(db.text("SELECT 1"))
+
+def check_sessions():
+    session_backend.get("readyz")
+    return SESSION_BACKEND
+
+def check_leaderboard():
+    if LEADERBOARD_BACKEND == "redis":
+        leaderboard.client.ping()
+    return {"backend": LEADERBOARD_BACKEND, "loaded": _leaderboard_state["loaded_at"] > 0 or LEADERBOARD_BACKEND == "redis"}
+
+def check_upstream():
+    if client is None:
+        raise RuntimeError("OPENAI_API_KEY not configured")
+    if not ai_health.up:
+        raise RuntimeError(ai_health.last_error or "provider marked down")
+    return ai_health.status()
+
+warmup = Warmup()
+readiness = Readiness(warmup, {
+    "database": (check_database, True),
+    "sessions": (check_sessions, True),
+    "leaderboard": (check_leaderboard, False),
+    "upstream": (check_upstream, False),
+}, cache_seconds=READYZ_CACHE_SECONDS)
+
+if WARMUP_ENABLED:
+    warm_up()
+else:
+    warmup.finished_at = time.time()
+
+@app.route('/healthz')
+def healthz():
+    # Liveness: the process answers; no dependencies are touched
+    return jsonify({"status": "ok", "uptime": round(time.time() - _started_at, 1)})
+
+@app.route('/readyz')
+def readyz():
+    ready, report = readiness.check()
+    if replica.engine is not None:
+        report = {**report, "replica_healthy": replica.replica_healthy()}
+    # Error details only for callers holding METRICS_TOKEN (when one is set), like /metrics
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        report = {"ready": ready, "checks": {name: r["ok"] for name, r in report["checks"].items()}}
+    response = jsonify(report)
+    response.headers["Cache-Control"] = "no-store"
+    return response, 200 if ready else 503
+
 # ---------------- RUN ----------------
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 8000))
@@ -0,0 +1,107 @@
+"""
+Front-end asset bundles and server-side markdown rendering.
+
+Bundles are built once per worker from the sources in static/src: files are
+concatenated, lightly minified and fingerprinted with a content hash. The
+fingerprinted URL never changes meaning, so bundles are served with
+immutable caching. A gzip copy is kept next to each bundle so it is never
+recompressed per request.
+"""
+import gzip
+import hashlib
+import os
+import re
+
+import markdown as markdown_lib
+import nh3
+from flask import abort, request
+
+BUNDLES = {
+    "ai_room.js": ["js/common.js", "js/ai_room.js"],
+    "my_explanations.js": ["js/common.js", "js/my_explanations.js"],
+    "ai_room.css": ["css/common.css", "css/ai_room.css"],
+    "my_explanations.css": ["css/common.css", "css/my_explanations.css"],
+}
+
+MIMETYPES = {
+    ".js": "application/javascript",
+    ".css": "text/css",
+}
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_block_comment = re.compile(r"^\s*/\*.*?\*/\s*$")
+_line_comment = re.compile(r"^\s*//")
+
+
+def minify(source):
+    """
+    Conservative minification: drops blank lines, whole-line comments and
+    indentation. It never touches code inside a line, so it cannot change
+    what the script does.
+    """
+    lines = []
+    for line in source.splitlines():
+        if not line.strip() or _block_comment.match(line) or _line_comment.match(line):
+            continue
+        lines.append(line.strip())
+    return "\n".join(lines) + "\n"
+
+
+class AssetBundler:
+    def __init__(self, app=None, url_prefix="/assets"):
+        self.url_prefix = url_prefix
+        self.bundles = {}
+        self.files = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.source_dir = os.path.join(app.static_folder, "src")
+        self.build()
+        app.add_url_rule(f"{self.url_prefix}/<path:filename>", "asset", self.serve)
+        app.jinja_env.globals["asset_url"] = self.url_for
+
+    def build(self):
+        self.bundles.clear()
+        self.files.clear()
+        for name, sources in BUNDLES.items():
+            parts = []
+            for source in sources:
+                with open(os.path.join(self.source_dir, source), encoding="utf-8") as f:
+                    parts.append(minify(f.read()))
+            body = "".join(parts).encode("utf-8")
+            digest = hashlib.md5(body).hexdigest()[:10]
+            base, ext = os.path.splitext(name)
+            filename = f"{base}.{digest}{ext}"
+            self.bundles[name] = filename
+            self.files[filename] = (body, gzip.compress(body, compresslevel=9), MIMETYPES[ext])
+
+    def url_for(self, name):
+        return f"{self.url_prefix}/{self.bundles[name]}"
+
+    def serve(self, filename):
+        from flask import current_app
+
+        entry = self.files.get(filename)
+        if not entry:
+            abort(404)
+        body, gzipped, mimetype = entry
+
+        if "gzip" in request.headers.get("Accept-Encoding", "").lower():
+            response = current_app.response_class(gzipped, mimetype=mimetype)
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response = current_app.response_class(body, mimetype=mimetype)
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+
+# ---------------- MARKDOWN ----------------
+def render_markdown(text):
+    """Renders explanation markdown to sanitized HTML (scripts, handlers and unsafe links are stripped)."""
+    html = markdown_lib.markdown(text or "", extensions=["tables", "fenced_code", "sane_lists"])
+    return nh3.clean(html)
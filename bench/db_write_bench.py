@@ -0,0 +1,141 @@
+"""
+Concurrent write throughput: default SQLAlchemy engine vs the tuned profile
+from db_engine.py.
+
+Each writer thread repeats what a successful ai_room() request commits
+(insert an explanation, update the user's counters) while reader threads
+run the history query. Reports commits/s, read/s and lock errors.
+
+    python bench/db_write_bench.py                       # SQLite in a temp dir
+    python bench/db_write_bench.py --url postgresql://... # Postgres
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import (
+    Column, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, Text,
+    create_engine, func, insert, select, update
+)
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_engine import configure_engine, engine_options  # noqa: E402
+
+metadata = MetaData()
+users = Table(
+    "bench_user", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("ai_credits", Integer),
+    Column("points", Integer),
+    Column("study_hours", Float),
+)
+explanations = Table(
+    "bench_explanation", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("bench_user.id"), index=True),
+    Column("title", String(255)),
+    Column("content", Text),
+    Column("created_at", DateTime, server_default=func.now()),
+)
+
+CONTENT = "شرح تجريبي " * 400
+
+
+def make_engine(url, tuned):
+    if tuned:
+        engine = create_engine(url, **engine_options(url))
+        configure_engine(engine)
+    else:
+        engine = create_engine(url)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(users), [{"ai_credits": 10 ** 6, "points": 0, "study_hours": 0.0} for _ in range(100)])
+    return engine
+
+
+def run(engine, writers, readers, duration):
+    counts = {"commits": 0, "reads": 0, "lock_errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def writer(n):
+        user_id = n % 100 + 1
+        while time.monotonic() < deadline:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(explanations).values(user_id=user_id, title="bench", content=CONTENT))
+                    conn.execute(
+                        update(users).where(users.c.id == user_id).values(
+                            ai_credits=users.c.ai_credits - 5,
+                            points=users.c.points + 10,
+                            study_hours=users.c.study_hours + 0.25,
+                        )
+                    )
+                key = "commits"
+            except OperationalError:
+                key = "lock_errors"
+            with lock:
+                counts[key] += 1
+
+    def reader(n):
+        user_id = n % 100 + 1
+        while time.monotonic() < deadline:
+            try:
+                with engine.connect() as conn:
+                    conn.execute(
+                        select(explanations.c.id, explanations.c.title)
+                        .where(explanations.c.user_id == user_id)
+                        .order_by(explanations.c.created_at.desc())
+                        .limit(10)
+                    ).all()
+                key = "reads"
+            except OperationalError:
+                key = "lock_errors"
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "commits_per_s": round(counts["commits"] / elapsed, 1),
+        "reads_per_s": round(counts["reads"] / elapsed, 1),
+        "lock_errors": counts["lock_errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="database URL (default: a temporary SQLite file)")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    tmpdir = None
+    for tuned in (False, True):
+        url = args.url
+        if not url:
+            tmpdir = tmpdir or tempfile.mkdtemp()
+            url = f"sqlite:///{os.path.join(tmpdir, 'default.db' if not tuned else 'tuned.db')}"
+        engine = make_engine(url, tuned)
+        result = run(engine, args.writers, args.readers, args.duration)
+        metadata.drop_all(engine)
+        engine.dispose()
+        label = "tuned  " if tuned else "default"
+        print(f"{engine.dialect.name} {label}: {result['commits_per_s']} commits/s, "
+              f"{result['reads_per_s']} reads/s, {result['lock_errors']} lock errors")
+
+
+if __name__ == "__main__":
+    main()
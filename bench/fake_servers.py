@@ -0,0 +1,252 @@
+"""
+Local stand-ins for OpenAI chat completions (plus the model lookup the app
+uses as its health probe and warm-up call) and the Resala OTP API, so the
+app can be load tested without paid calls or real SMS.
+
+Point the app at them with:
+    OPENAI_API_KEY=fake OPENAI_BASE_URL=http://127.0.0.1:9100/v1
+    RESALA_BASE_URL=http://127.0.0.1:9200
+
+Run standalone:
+    python bench/fake_servers.py --openai-latency 2.5 --error-rate 0.02
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_PIN = "1234"
+
+
+class FakeConfig:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 stream_chunks=20, explanation_size=4000):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.stream_chunks = stream_chunks
+        self.explanation_size = explanation_size
+
+    def delay(self):
+        wait = self.latency + random.uniform(-self.jitter, self.jitter)
+        if wait > 0:
+            time.sleep(wait)
+
+    def roll(self):
+        """Returns 'rate_limit', 'error' or None for a request."""
+        r = random.random()
+        if r < self.rate_limit_rate:
+            return "rate_limit"
+        if r < self.rate_limit_rate + self.error_rate:
+            return "error"
+        return None
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b"{}"
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return {}
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# ---------------- OPENAI ----------------
+def fake_completion_content(prompt, size):
+    match = re.search(r"موضوع \((.*?)\)", prompt or "")
+    topic = match.group(1) if match else "الدرس"
+    paragraph = f"## {topic}\n\nهذا شرح تجريبي باش نقيسو الأداء. **نقطة مهمة** عن {topic}.\n\n- مثال أول\n- مثال ثاني\n\n"
+    explanation = (paragraph * (size // len(paragraph) + 1))[:size]
+    quiz = [
+        {"question": f"سؤال {i + 1} عن {topic}؟", "options": ["أ", "ب", "ج", "د"], "correct": i % 4}
+        for i in range(3)
+    ]
+    return json.dumps({"explanation": explanation, "quiz": quiz}, ensure_ascii=False)
+
+
+def fake_followup_content(question):
+    answer = f"إجابة تجريبية مختصرة على: {question[:200]}\n\n- نقطة أولى\n- نقطة ثانية"
+    return json.dumps({"answer": answer, "memo": f"الطالب سأل عن: {question[:100]}"}, ensure_ascii=False)
+
+
+def is_followup(payload):
+    """Follow-ups ask for the "followup" schema, or (without structured outputs) a reply with a memo."""
+    schema = (payload.get("response_format") or {}).get("json_schema") or {}
+    if schema:
+        return schema.get("name") == "followup"
+    return any('"memo"' in str(m.get("content", "")) for m in payload.get("messages") or [])
+
+
+class FakeOpenAIHandler(_JSONHandler):
+    config = FakeConfig()
+
+    def do_GET(self):
+        # GET /v1/models/<id>: cheap and never failed, like the real one, so
+        # the breaker's background probe can close it again between errors
+        match = re.search(r"/models/([^/?]+)/?$", self.path)
+        if not match:
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        self.send_json(200, {"id": match.group(1), "object": "model", "created": 0, "owned_by": "fake"})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+
+        payload = self.read_json()
+        outcome = self.config.roll()
+        if outcome == "rate_limit":
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                           headers={"retry-after": "1"})
+            return
+        self.config.delay()
+        if outcome == "error":
+            self.send_json(500, {"error": {"message": "Fake upstream failure", "type": "server_error"}})
+            return
+
+        messages = payload.get("messages") or []
+        prompt = messages[-1].get("content", "") if messages else ""
+        if is_followup(payload):
+            content = fake_followup_content(prompt)
+        else:
+            content = fake_completion_content(prompt, self.config.explanation_size)
+        usage = {
+            "prompt_tokens": len(json.dumps(messages, ensure_ascii=False)) // 4,
+            "completion_tokens": len(content) // 4,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = payload.get("model", "gpt-4o-mini")
+
+        if payload.get("stream"):
+            self.stream(completion_id, model, content, usage)
+            return
+
+        self.send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def stream(self, completion_id, model, content, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        chunks = max(1, self.config.stream_chunks)
+        step = max(1, len(content) // chunks)
+        pieces = [content[i:i + step] for i in range(0, len(content), step)]
+
+        def event(delta, finish_reason=None, extra=None):
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if extra:
+                data.update(extra)
+            self.wfile.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        event({"role": "assistant", "content": ""})
+        for piece in pieces:
+            event({"content": piece})
+        event({}, finish_reason="stop", extra={"usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+# ---------------- RESALA ----------------
+class FakeResalaHandler(_JSONHandler):
+    config = FakeConfig()
+
+    def do_POST(self):
+        if not self.path.startswith("/api/v1/pins"):
+            self.send_json(404, {"message": "not found"})
+            return
+        self.read_json()
+        outcome = self.config.roll()
+        if outcome == "rate_limit":
+            self.send_json(429, {"message": "Too many requests"})
+            return
+        self.config.delay()
+        if outcome == "error":
+            self.send_json(500, {"message": "Fake SMS failure"})
+            return
+        self.send_json(201, {"pin": FAKE_PIN})
+
+
+def start_server(handler, config, host="127.0.0.1", port=0):
+    """Starts a fake server in a daemon thread and returns it (server.server_port has the port)."""
+    handler_class = type(handler.__name__, (handler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--openai-port", type=int, default=9100)
+    parser.add_argument("--resala-port", type=int, default=9200)
+    parser.add_argument("--openai-latency", type=float, default=2.0)
+    parser.add_argument("--resala-latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--stream-chunks", type=int, default=20)
+    parser.add_argument("--explanation-size", type=int, default=4000)
+    args = parser.parse_args()
+
+    openai_server = start_server(FakeOpenAIHandler, FakeConfig(
+        args.openai_latency, args.jitter, args.error_rate, args.rate_limit_rate,
+        args.stream_chunks, args.explanation_size
+    ), args.host, args.openai_port)
+    resala_server = start_server(FakeResalaHandler, FakeConfig(
+        args.resala_latency, args.jitter, args.error_rate, args.rate_limit_rate
+    ), args.host, args.resala_port)
+
+    print(f"Fake OpenAI: http://{args.host}:{openai_server.server_port}/v1")
+    print(f"Fake Resala: http://{args.host}:{resala_server.server_port} (pin {FAKE_PIN})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Drives scripted student journeys against the app and reports throughput and
+p50/p95/p99 latency per route. Results are saved as JSON under
+bench/results/ tagged with the git branch and commit, so runs can be compared.
+
+Full local run (fake OpenAI/Resala, a fresh SQLite DB, gunicorn):
+    python bench/loadtest.py --start-app --seed-users 1000 --seed-explanations 10000 \
+        --users 50 --duration 60
+
+Against an already running app (that already points at the fake servers):
+    python bench/loadtest.py --base-url http://127.0.0.1:8000 --users 20
+
+Compare two saved runs:
+    python bench/loadtest.py --compare bench/results/a.json bench/results/b.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+sys.path.insert(0, BENCH_DIR)
+
+from fake_servers import FAKE_PIN, FakeConfig, FakeOpenAIHandler, FakeResalaHandler, start_server  # noqa: E402
+from seed import BENCH_PASSWORD, bench_phone  # noqa: E402
+
+STUDY_YEAR = "أولى إعدادي"
+SUBJECTS = ["رياضيات", "العلوم", "لغة عربية", "تاريخ"]
+QUERIES = ["الكسور العشرية", "الخلية الحيوانية", "الفعل المضارع", "الحضارة الفينيقية"]
+FOLLOWUPS = ["كيف نقارن بين كسرين عشريين؟", "شن الفرق بينها وبين الخلية النباتية؟",
+             "عطيني مثال في جملة", "وين كانت أهم مدنهم؟"]
+
+
+# ---------------- RECORDING ----------------
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def request(self, client, name, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples.setdefault(name, []).append(elapsed)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+    def report(self, wall_time):
+        routes = {}
+        for name, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            routes[name] = {
+                "requests": len(ordered),
+                "errors": self.errors.get(name, 0),
+                "rps": round(len(ordered) / wall_time, 2),
+                "p50_ms": round(percentile(ordered, 50) * 1000, 1),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 1),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 1),
+            }
+        total = sum(r["requests"] for r in routes.values())
+        return {"wall_time_s": round(wall_time, 2), "total_rps": round(total / wall_time, 2), "routes": routes}
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+# ---------------- JOURNEYS ----------------
+def new_student_journey(base_url, recorder):
+    """signup -> OTP -> dashboard -> ai-room -> ask -> follow-up -> my-explanations"""
+    phone = "098" + str(uuid.uuid4().int)[:7]
+    with httpx.Client(base_url=base_url, timeout=120, follow_redirects=False) as client:
+        recorder.request(client, "GET /signup", "GET", "/signup")
+        recorder.request(client, "POST /signup", "POST", "/signup", data={
+            "full_name": "طالب جديد", "phone": phone, "study_year": STUDY_YEAR, "password": BENCH_PASSWORD,
+        })
+        recorder.request(client, "POST /verify-otp", "POST", "/verify-otp", data={"otp": FAKE_PIN})
+        student_session(client, recorder)
+
+
+def returning_student_journey(base_url, recorder, seeded_users):
+    """login -> dashboard -> ai-room -> ask -> follow-up -> my-explanations"""
+    phone = bench_phone(random.randrange(seeded_users))
+    with httpx.Client(base_url=base_url, timeout=120, follow_redirects=False) as client:
+        recorder.request(client, "POST /login", "POST", "/login", data={"phone": phone, "password": BENCH_PASSWORD})
+        student_session(client, recorder)
+
+
+def student_session(client, recorder):
+    recorder.request(client, "GET /dashboard", "GET", "/dashboard")
+    recorder.request(client, "GET /ai-room", "GET", "/ai-room")
+    recorder.request(client, "GET /api/explanations", "GET", "/api/explanations")
+    i = random.randrange(len(SUBJECTS))
+    response = recorder.request(client, "POST /ai-room", "POST", "/ai-room", json={"subject": SUBJECTS[i], "query": QUERIES[i]})
+    explanation_id = response.json().get("id") if response is not None and response.status_code == 200 else None
+    if explanation_id:
+        recorder.request(client, "POST /api/explanations/<id>/turns", "POST", f"/api/explanations/{explanation_id}/turns",
+                         json={"question": FOLLOWUPS[i]})
+    recorder.request(client, "GET /my-explanations", "GET", "/my-explanations")
+
+
+def run_load(base_url, users, duration, seeded_users, new_ratio):
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        while time.monotonic() < deadline:
+            if not seeded_users or random.random() < new_ratio:
+                new_student_journey(base_url, recorder)
+            else:
+                returning_student_journey(base_url, recorder, seeded_users)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder.report(time.perf_counter() - started)
+
+
+# ---------------- ENVIRONMENT ----------------
+def start_app(args):
+    """Starts the fake upstreams, seeds a fresh DB and launches gunicorn. Returns (process, base_url)."""
+    openai_server = start_server(FakeOpenAIHandler, FakeConfig(
+        args.openai_latency, args.jitter, args.error_rate, args.rate_limit_rate
+    ))
+    resala_server = start_server(FakeResalaHandler, FakeConfig(args.resala_latency, args.jitter))
+
+    db_path = os.path.join(BENCH_DIR, "bench.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{db_path}",
+        OPENAI_API_KEY="fake",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{openai_server.server_port}/v1",
+        RESALA_BASE_URL=f"http://127.0.0.1:{resala_server.server_port}",
+        OTP_MAX_SENDS="1000",
+        LOGIN_MAX_ATTEMPTS="1000",
+        # The journeys repeat a few fixed queries; with the cache on, later runs
+        # would measure cache hits instead of the OpenAI path of the baseline
+        SEMANTIC_CACHE="0",
+    )
+    if args.seed_users:
+        subprocess.run(
+            [sys.executable, os.path.join(BENCH_DIR, "seed.py"),
+             "--users", str(args.seed_users), "--explanations", str(args.seed_explanations)],
+            env=env, cwd=ROOT, check=True,
+        )
+
+    port = args.port
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "--threads", str(args.threads),
+         "-b", f"127.0.0.1:{port}", "app:app"],
+        env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(base_url + "/", timeout=1)
+            break
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    return process, base_url
+
+
+def git_info():
+    def run(*cmd):
+        try:
+            return subprocess.check_output(cmd, cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return "unknown"
+    return run("git", "rev-parse", "--abbrev-ref", "HEAD"), run("git", "rev-parse", "--short", "HEAD")
+
+
+def save_result(result):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    branch, commit = git_info()
+    result.update({"branch": branch, "commit": commit, "at": datetime.utcnow().isoformat(timespec="seconds")})
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(RESULTS_DIR, f"{branch.replace('/', '_')}-{commit}-{stamp}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def print_report(result):
+    print(f"\n{'route':<34}{'reqs':>7}{'errs':>6}{'rps':>8}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}")
+    for name, r in result["routes"].items():
+        print(f"{name:<34}{r['requests']:>7}{r['errors']:>6}{r['rps']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}")
+    print(f"\ntotal: {result['total_rps']} req/s over {result['wall_time_s']}s")
+
+
+def compare(path_a, path_b):
+    with open(path_a, encoding="utf-8") as f:
+        a = json.load(f)
+    with open(path_b, encoding="utf-8") as f:
+        b = json.load(f)
+    print(f"A: {a.get('branch')}@{a.get('commit')}   B: {b.get('branch')}@{b.get('commit')}")
+    print(f"\n{'route':<34}{'rps A':>9}{'rps B':>9}{'p95 A':>9}{'p95 B':>9}{'p95 Δ%':>9}")
+    for name in sorted(set(a["routes"]) | set(b["routes"])):
+        ra, rb = a["routes"].get(name, {}), b["routes"].get(name, {})
+        p95a, p95b = ra.get("p95_ms", 0), rb.get("p95_ms", 0)
+        delta = f"{100 * (p95b - p95a) / p95a:+.1f}" if p95a else "-"
+        print(f"{name:<34}{ra.get('rps', 0):>9}{rb.get('rps', 0):>9}{p95a:>9}{p95b:>9}{delta:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual students")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--new-ratio", type=float, default=0.2, help="share of journeys that sign up")
+    parser.add_argument("--seeded-users", type=int, default=0, help="seeded accounts available for login")
+    parser.add_argument("--start-app", action="store_true")
+    parser.add_argument("--port", type=int, default=8777)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seed-users", type=int, default=0)
+    parser.add_argument("--seed-explanations", type=int, default=0)
+    parser.add_argument("--openai-latency", type=float, default=1.0)
+    parser.add_argument("--resala-latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", nargs=2, metavar=("A", "B"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    process = None
+    base_url = args.base_url
+    seeded_users = args.seeded_users
+    if args.start_app:
+        process, base_url = start_app(args)
+        seeded_users = args.seed_users
+    try:
+        result = run_load(base_url, args.users, args.duration, seeded_users, args.new_ratio)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    result["config"] = {k: v for k, v in vars(args).items() if k != "compare"}
+    print_report(result)
+    if not args.no_save:
+        print(f"saved: {save_result(result)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Password verification throughput per hash method, i.e. the ceiling on
+logins/sec that hashing alone puts on a worker.
+
+For each method it times check_password_hash on 1 thread and on
+--threads threads through PasswordHasher (passwords.py), and reports
+verifications/sec overall and per core. A throttled attempt (login
+counter over LOGIN_MAX_ATTEMPTS) skips hashing entirely; its cost is
+shown for comparison.
+
+    python bench/password_bench.py
+    python bench/password_bench.py --methods scrypt:16384:8:1 pbkdf2:sha256:600000 --threads 8
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from passwords import DEFAULT_METHOD, PasswordHasher  # noqa: E402
+from session_store import MemorySessionBackend  # noqa: E402
+
+DEFAULT_METHODS = [DEFAULT_METHOD, "scrypt:16384:8:1", "pbkdf2:sha256:600000", "pbkdf2:sha256:100000"]
+
+
+def run(hasher, stored, threads, duration):
+    count = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        done = 0
+        while time.monotonic() < deadline:
+            hasher.verify(stored, "correct horse")
+            done += 1
+        with lock:
+            count[0] += done
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return count[0] / (time.perf_counter() - started)
+
+
+def throttled_cost(n=100000):
+    backend = MemorySessionBackend()
+    started = time.perf_counter()
+    for i in range(n):
+        backend.incr("login:0911111111", 600)
+    return (time.perf_counter() - started) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--methods", nargs="+", default=DEFAULT_METHODS)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--duration", type=float, default=3)
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    print(f"{cores} cores, {args.threads} threads, {args.duration}s per run")
+    for method in args.methods:
+        hasher = PasswordHasher(method, workers=args.threads, queue=args.threads)
+        stored = hasher.hash("correct horse")
+        single = run(hasher, stored, 1, args.duration)
+        parallel = run(hasher, stored, args.threads, args.duration)
+        print(f"{method:24} {1000 / single:7.1f} ms/verify  "
+              f"1 thread: {single:7.1f}/s  {args.threads} threads: {parallel:7.1f}/s  "
+              f"per core: {parallel / min(args.threads, cores):7.1f}/s")
+    print(f"{'throttled attempt':24} {throttled_cost() * 1e6:7.2f} us (no hashing)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Seeds the database pointed to by DATABASE_URL with benchmark users and
+explanations, in batches, so routes can be measured against realistic
+table sizes (1k to 1M rows).
+
+    DATABASE_URL=sqlite:////tmp/bench.db python bench/seed.py --users 10000 --explanations 100000
+
+Seeded users have phones starting with 099 and the password BENCH_PASSWORD.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_PASSWORD = "bench-password"
+BENCH_PHONE_PREFIX = "099"
+
+
+def bench_phone(i):
+    return f"{BENCH_PHONE_PREFIX}{i:07d}"
+
+
+def seed(users, explanations, batch_size=5000):
+    from werkzeug.security import generate_password_hash
+    from app import app, db, User, Explanation, CURRICULUM, render_markdown
+
+    years = list(CURRICULUM.keys())
+    # One hash for everyone: hashing per row would dominate seeding time
+    password = generate_password_hash(BENCH_PASSWORD)
+    now = datetime.utcnow()
+
+    with app.app_context():
+        existing = db.session.query(db.func.count(User.id)).filter(
+            User.phone.like(f"{BENCH_PHONE_PREFIX}%")
+        ).scalar()
+
+        started = time.perf_counter()
+        for offset in range(existing, users, batch_size):
+            rows = []
+            for i in range(offset, min(users, offset + batch_size)):
+                rows.append({
+                    "full_name": f"طالب تجريبي {i}",
+                    "phone": bench_phone(i),
+                    "password": password,
+                    "study_year": years[i % len(years)],
+                    "ai_credits": 250,
+                    "points": random.randint(0, 2000),
+                    "study_hours": round(random.uniform(0, 40), 2),
+                    "is_verified": True,
+                    "joined_at": now - timedelta(days=random.randint(0, 120)),
+                })
+            db.session.execute(db.insert(User), rows)
+            db.session.commit()
+            print(f"users: {min(users, offset + batch_size)}/{users}")
+
+        study_years = dict(
+            db.session.query(User.id, User.study_year)
+            .filter(User.phone.like(f"{BENCH_PHONE_PREFIX}%")).all()
+        )
+        user_ids = list(study_years)
+        content = "## شرح تجريبي\n\nهذا نص تجريبي **للقياس** فقط.\n\n- نقطة\n- نقطة ثانية\n" * 20
+        content_html = render_markdown(content)
+
+        for offset in range(0, explanations, batch_size):
+            rows = []
+            for _ in range(offset, min(explanations, offset + batch_size)):
+                user_id = random.choice(user_ids)
+                subject = random.choice(CURRICULUM.get(study_years[user_id]) or ["رياضيات"])
+                rows.append({
+                    "title": f"{subject}: موضوع تجريبي",
+                    "subject": subject,
+                    "content": content,
+                    "content_html": content_html,
+                    "user_id": user_id,
+                    "created_at": now - timedelta(minutes=random.randint(0, 60 * 24 * 120)),
+                })
+            db.session.execute(db.insert(Explanation), rows)
+            db.session.commit()
+            print(f"explanations: {min(explanations, offset + batch_size)}/{explanations}")
+
+        print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--explanations", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+    seed(args.users, args.explanations, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
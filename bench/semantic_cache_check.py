@@ -0,0 +1,70 @@
+"""
+Semantic cache accuracy check: paraphrases that must reuse an explanation
+and near misses that must not (same words, different topic).
+
+A pair matches when both queries have the same number_signature and their
+cosine reaches the threshold, exactly as semantic_lookup decides. Run it
+after changing the embedder, its normalization or the threshold; it exits
+non-zero when any pair is decided wrongly.
+
+    python bench/semantic_cache_check.py
+    python bench/semantic_cache_check.py --embedder sentence-transformers --threshold 0.88
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from semantic_cache import create_embedder, number_signature  # noqa: E402
+
+PARAPHRASES = [
+    ("شرح قانون نيوتن الثاني", "قانون نيوتن 2 شرح"),
+    ("شرح قانون نيوتن الثاني", "اشرحلي قانون نيوتن الثاني"),
+    ("الخلية الحيوانية", "شرح الخلية الحيوانية بالتفصيل"),
+    ("المضاعف المشترك الأصغر", "المضاعف المشترك الاصغر"),
+    ("الحرب العالمية الأولى", "الحرب العالمية 1"),
+    ("ما هي الكسور العشرية", "الكسور العشرية"),
+    ("الجملة الاسمية", "الجمله الأسمية"),
+]
+
+NEAR_MISSES = [
+    ("حل المعادلات من الدرجة الأولى في متغير واحد", "حل المعادلات من الدرجة الثانية في متغير واحد"),
+    ("الحرب العالمية الأولى", "الحرب العالمية الثانية"),
+    ("قانون نيوتن الأول", "قانون نيوتن الثالث"),
+    ("جدول الضرب 7", "جدول الضرب 8"),
+    ("الدرس 3 من الوحدة الثانية", "الدرس 4 من الوحدة الثانية"),
+    ("جمع الكسور العشرية", "ضرب الكسور العشرية"),
+    ("الخلية الحيوانية", "الخلية النباتية"),
+    ("الفعل المضارع", "الفعل الماضي"),
+]
+
+
+def decide(embedder, threshold, a, b):
+    """Returns (cosine, matched)."""
+    va, vb = embedder.embed([a, b])
+    score = float(va @ vb)
+    return score, number_signature(a) == number_signature(b) and score >= threshold
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embedder", default=None, help="hashed or sentence-transformers (default: SEMANTIC_CACHE_EMBEDDER)")
+    parser.add_argument("--threshold", type=float, default=None, help="default: the embedder's own default")
+    args = parser.parse_args()
+
+    embedder = create_embedder(args.embedder)
+    threshold = args.threshold or embedder.default_threshold
+    print(f"{embedder.name}, threshold {threshold}")
+    wrong = 0
+    for expected, pairs in ((True, PARAPHRASES), (False, NEAR_MISSES)):
+        for a, b in pairs:
+            score, matched = decide(embedder, threshold, a, b)
+            ok = matched == expected
+            wrong += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {score:6.3f} {'hit ' if matched else 'miss'}  {a} | {b}")
+    print(f"{wrong} wrong of {len(PARAPHRASES) + len(NEAR_MISSES)}")
+    sys.exit(1 if wrong else 0)
+
+
+if __name__ == "__main__":
+    main()
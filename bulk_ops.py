@@ -0,0 +1,126 @@
+"""
+Helpers for admin bulk operations.
+
+- stream_csv / stream_jsonl turn any row iterator into a generator of
+  ~64 KB chunks, so exports run in constant memory whatever the row count.
+- parse_user_csv validates an import file up front (no database access).
+- password_hasher hashes passwords on all cores; it is the only CPU-heavy
+  step of an import.
+"""
+import csv
+import io
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from werkzeug.security import generate_password_hash
+
+CHUNK_BYTES = 64 * 1024
+IMPORT_COLUMNS = ("full_name", "phone", "study_year", "password")
+PHONE_RE = re.compile(r"^0\d{9}$")
+
+
+# ---------------- EXPORT ----------------
+def _cell(value):
+    if value is None:
+        return ""
+    if hasattr(value, "strftime"):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+def stream_csv(columns, rows):
+    """rows: iterable of tuples/lists in `columns` order."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so spreadsheet apps open the Arabic labels as UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_cell(v) for v in row])
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_jsonl(columns, rows):
+    parts, size = [], 0
+    for row in rows:
+        line = json.dumps(
+            {c: (v.isoformat() if hasattr(v, "isoformat") else v) for c, v in zip(columns, row)},
+            ensure_ascii=False
+        ) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield "".join(parts)
+            parts, size = [], 0
+    yield "".join(parts)
+
+
+# ---------------- IMPORT ----------------
+def parse_user_csv(stream, valid_years=None):
+    """
+    Reads full_name, phone, study_year, password[, ai_credits] rows.
+    Returns (rows, errors); errors are {"line", "phone", "error"} dicts.
+    Duplicate phones inside the file are reported; phones already in the
+    database are checked by the caller.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    reader = csv.DictReader(text)
+    missing = [c for c in IMPORT_COLUMNS if c not in (reader.fieldnames or [])]
+    if missing:
+        return [], [{"line": 1, "phone": "", "error": f"أعمدة ناقصة: {', '.join(missing)}"}]
+
+    rows, errors, seen = [], [], set()
+    for line, record in enumerate(reader, start=2):
+        phone = (record.get("phone") or "").strip()
+        full_name = (record.get("full_name") or "").strip()
+        study_year = (record.get("study_year") or "").strip()
+        password = record.get("password") or ""
+        credits = (record.get("ai_credits") or "").strip()
+
+        error = None
+        if not PHONE_RE.match(phone):
+            error = "رقم الهاتف غير صالح"
+        elif phone in seen:
+            error = "الرقم مكرر في الملف"
+        elif not full_name:
+            error = "الاسم مطلوب"
+        elif valid_years is not None and study_year not in valid_years:
+            error = "السنة الدراسية غير معروفة"
+        elif len(password) < 6:
+            error = "كلمة المرور أقصر من 6 أحرف"
+        elif credits and not credits.isdigit():
+            error = "رصيد غير صالح"
+        if error:
+            errors.append({"line": line, "phone": phone, "error": error})
+            continue
+
+        seen.add(phone)
+        row = {"line": line, "full_name": full_name[:100], "phone": phone, "study_year": study_year, "password": password}
+        if credits:
+            row["ai_credits"] = int(credits)
+        rows.append(row)
+    return rows, errors
+
+
+@contextmanager
+def password_hasher(hash_one=generate_password_hash, workers=None):
+    """
+    Yields hash_many(passwords) -> hashes in the same order.
+
+    werkzeug hashes with hashlib.scrypt / pbkdf2_hmac, which release the GIL,
+    so threads use every core without forking a threaded gunicorn worker
+    (or re-importing app.py in spawned processes).
+    """
+    workers = workers or int(os.getenv("BULK_HASH_WORKERS", "0")) or os.cpu_count() or 1
+    if workers == 1:
+        yield lambda passwords: [hash_one(p) for p in passwords]
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash") as pool:
+        yield lambda passwords: list(pool.map(hash_one, passwords))
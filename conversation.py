@@ -0,0 +1,71 @@
+"""
+Context window for follow-up questions on an explanation.
+
+Every follow-up prompt is laid out so that its beginning never changes for
+a given explanation, which lets the provider's prompt cache serve it:
+
+    system  persona + follow-up rules + the explanation     stable prefix
+    system  memo of the turns that no longer fit            only after overflow
+    user/assistant pairs, oldest first                      newest turns within the budget
+    user    the new question
+
+The model returns a short running memo with each answer. The memo stored on
+the newest turn that falls out of the window stands in for every turn before
+it, so the prompt stays bounded however long the conversation gets. Turns
+without a memo (e.g. a parse failure) are truncated into one instead.
+"""
+
+
+def estimate_tokens(text):
+    # ~3 characters per token for mixed Arabic/English with current tokenizers
+    return len(text or "") // 3 + 1
+
+
+def turn_tokens(turn):
+    return turn.tokens or estimate_tokens(turn.question) + estimate_tokens(turn.answer)
+
+
+class ContextWindow:
+    def __init__(self, budget, memo_chars=800, truncate_chars=200):
+        self.budget = budget
+        self.memo_chars = memo_chars
+        self.truncate_chars = truncate_chars
+
+    def select(self, turns):
+        """
+        turns: oldest first, objects with question/answer/memo/tokens.
+        Returns (memo or None, recent turns oldest first).
+        """
+        recent, used = [], 0
+        for turn in reversed(turns):
+            cost = turn_tokens(turn)
+            if used + cost > self.budget:
+                break
+            recent.append(turn)
+            used += cost
+        recent.reverse()
+        older = turns[:len(turns) - len(recent)]
+        if not older:
+            return None, recent
+
+        newest_dropped = older[-1]
+        if newest_dropped.memo:
+            return newest_dropped.memo[:self.memo_chars], recent
+        # No memo to lean on: keep the tail of a truncated transcript
+        lines = [
+            f"- {t.question[:self.truncate_chars]} ← {(t.answer or '')[:self.truncate_chars]}"
+            for t in older
+        ]
+        return "\n".join(lines)[-self.memo_chars:], recent
+
+    def messages(self, prefix, turns, question):
+        """prefix: the stable leading messages. Returns the full message list."""
+        memo, recent = self.select(turns)
+        messages = list(prefix)
+        if memo:
+            messages.append({"role": "system", "content": f"ملخص الأسئلة السابقة في هذه المحادثة:\n{memo}"})
+        for turn in recent:
+            messages.append({"role": "user", "content": turn.question})
+            messages.append({"role": "assistant", "content": turn.answer})
+        messages.append({"role": "user", "content": question})
+        return messages
@@ -0,0 +1,65 @@
+"""
+SQLAlchemy engine profiles for Postgres and SQLite.
+
+Postgres: a pool sized to the worker's thread count, pre-ping, recycling
+and a server-side statement timeout. DB_PGBOUNCER=1 switches to a mode
+that works behind PgBouncer in transaction pooling (no client-side pool,
+no startup options).
+
+SQLite: WAL journal, synchronous=NORMAL, a busy timeout and mmap, set on
+every new connection, so readers and the ai_room() writer stop blocking
+each other.
+"""
+import os
+
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool
+
+
+def _int_env(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def engine_options(database_url):
+    """Keyword arguments for create_engine / SQLALCHEMY_ENGINE_OPTIONS."""
+    if database_url.startswith("sqlite"):
+        return {
+            "connect_args": {
+                # Seconds the driver waits on a locked database before raising
+                "timeout": _int_env("SQLITE_BUSY_TIMEOUT_MS", 5000) / 1000,
+                "check_same_thread": False,
+            },
+        }
+
+    if database_url.startswith("postgresql"):
+        if os.getenv("DB_PGBOUNCER") == "1":
+            # PgBouncer does the pooling and rejects the `options` startup parameter
+            return {"poolclass": NullPool, "pool_pre_ping": False}
+
+        threads = _int_env("GUNICORN_THREADS", 1)
+        timeout_ms = _int_env("DB_STATEMENT_TIMEOUT_MS", 15000)
+        return {
+            "pool_size": _int_env("DB_POOL_SIZE", threads + 1),
+            "max_overflow": _int_env("DB_MAX_OVERFLOW", threads),
+            "pool_timeout": _int_env("DB_POOL_TIMEOUT", 10),
+            "pool_recycle": _int_env("DB_POOL_RECYCLE", 1800),
+            "pool_pre_ping": True,
+            "connect_args": {"options": f"-c statement_timeout={timeout_ms}"},
+        }
+
+    return {"pool_pre_ping": True}
+
+
+def configure_engine(engine):
+    """Per-connection settings that cannot be passed through connect_args."""
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={_int_env('SQLITE_BUSY_TIMEOUT_MS', 5000)}")
+        cursor.execute(f"PRAGMA mmap_size={_int_env('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)}")
+        cursor.close()
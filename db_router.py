@@ -0,0 +1,151 @@
+"""
+Read-replica routing.
+
+Views decorated with @replica_reads send their SELECTs to the engine built
+from REPLICA_DATABASE_URL; flushes, DML and everything outside those views
+stay on the primary. A request is kept on the primary when:
+
+- the same browser committed a write in the last REPLICA_STICKY_SECONDS
+  (read-your-writes, tracked with a short-lived cookie), or
+- the replica is unreachable or lags more than REPLICA_MAX_LAG_SECONDS
+  (checked at most every REPLICA_LAG_CHECK_INTERVAL seconds per worker).
+
+Without REPLICA_DATABASE_URL everything runs on the primary, as before.
+"""
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+
+from db_engine import configure_engine, engine_options
+from metrics import DB_READ_ROUTING
+
+STICKY_COOKIE = "db_primary_until"
+
+# Seconds of replay lag; 0 when the replica has replayed everything it received
+PG_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class RoutingSession(Session):
+    """db.session that reads from the replica inside @replica_reads views."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and getattr(clause, "is_select", False):
+            engine = _request_replica()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _request_replica():
+    if not has_request_context() or not g.get("db_read_replica"):
+        return None
+    return current_app.extensions["replica_router"].engine
+
+
+class ReplicaRouter:
+    def __init__(self, app=None):
+        self.url = os.getenv("REPLICA_DATABASE_URL", "").strip()
+        if self.url.startswith("postgres://"):
+            self.url = self.url.replace("postgres://", "postgresql://", 1)
+        self.sticky_seconds = int(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+        self.max_lag = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "2"))
+        self.check_interval = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", "5"))
+        self.engine = None
+        self._healthy = False
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions["replica_router"] = self
+        if not self.url:
+            return
+        self.engine = create_engine(self.url, **engine_options(self.url))
+        configure_engine(self.engine)
+        print(f">>> Read replica enabled: {self.engine.url.render_as_string(hide_password=True)}")
+
+        event.listen(RoutingSession, "after_flush", self._mark_write)
+        event.listen(RoutingSession, "after_commit", self._after_commit)
+        app.after_request(self._set_sticky_cookie)
+
+    # ---------------- READ-YOUR-WRITES ----------------
+    def _mark_write(self, session, flush_context):
+        session.info["wrote"] = True
+
+    def _after_commit(self, session):
+        if session.info.pop("wrote", False) and has_request_context():
+            g.db_wrote = True
+
+    def _set_sticky_cookie(self, response):
+        if g.get("db_wrote"):
+            response.set_cookie(
+                STICKY_COOKIE, str(int(time.time()) + self.sticky_seconds),
+                max_age=self.sticky_seconds, httponly=True, samesite="Lax"
+            )
+        return response
+
+    def _sticky(self):
+        try:
+            return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    # ---------------- LAG ----------------
+    def replica_healthy(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._healthy
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return self._healthy
+            try:
+                with self.engine.connect() as conn:
+                    if self.engine.dialect.name == "postgresql":
+                        lag = float(conn.execute(PG_LAG_SQL).scalar() or 0)
+                    else:
+                        # Not a streaming replica (e.g. a second local SQLite file)
+                        conn.execute(text("SELECT 1"))
+                        lag = 0.0
+                healthy = lag <= self.max_lag
+                if not healthy:
+                    print(f">>> Replica lagging {lag:.1f}s, reading from primary")
+            except Exception as e:
+                print(f">>> Replica check failed, reading from primary: {e}")
+                healthy = False
+            self._healthy = healthy
+            self._checked_at = time.monotonic()
+            return healthy
+
+    def choose(self):
+        """Returns True if this request's reads may go to the replica."""
+        if self.engine is None:
+            return False
+        if self._sticky():
+            DB_READ_ROUTING.labels("primary_sticky").inc()
+            return False
+        if not self.replica_healthy():
+            DB_READ_ROUTING.labels("primary_lagging").inc()
+            return False
+        DB_READ_ROUTING.labels("replica").inc()
+        return True
+
+
+def replica_reads(view):
+    """Marks a view whose queries can be served by the read replica."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_replica = current_app.extensions["replica_router"].choose()
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,17 @@
+import os
+import shutil
+
+# Threads per worker; the Postgres pool is sized from the same variable (db_engine.py)
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+
+# Workers share Prometheus samples through this directory so /metrics
+# reports totals across all of them (see metrics.py).
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/afhamha_metrics")
+_metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+shutil.rmtree(_metrics_dir, ignore_errors=True)
+os.makedirs(_metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
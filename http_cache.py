@@ -0,0 +1,119 @@
+"""
+Response compression and HTTP caching helpers.
+
+Compressor gzips (or brotli-compresses, when the optional `brotli` package is
+installed) text responses above a size threshold and keeps per-route byte
+counts so the savings can be checked. conditional_response() adds
+ETag/Last-Modified validators and answers revalidations with 304.
+"""
+import gzip
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "image/svg+xml",
+)
+
+
+class Compressor:
+    def __init__(self, app=None, min_size=1024, gzip_level=6, brotli_quality=5):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._stats = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def _pick_encoding(self, accept_encoding):
+        if brotli is not None and "br" in accept_encoding:
+            return "br"
+        if "gzip" in accept_encoding:
+            return "gzip"
+        return None
+
+    def _compressible(self, response):
+        if response.direct_passthrough or response.is_streamed:
+            return False
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return False
+        if "Content-Encoding" in response.headers:
+            return False
+        mimetype = response.mimetype or ""
+        return mimetype.startswith(COMPRESSIBLE_TYPES)
+
+    def after_request(self, response):
+        from flask import request
+
+        if not self._compressible(response):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = self._pick_encoding(request.headers.get("Accept-Encoding", "").lower())
+        body = response.get_data()
+        if not encoding or len(body) < self.min_size:
+            self._record(request.endpoint, len(body), len(body))
+            return response
+
+        if encoding == "br":
+            compressed = brotli.compress(body, quality=self.brotli_quality)
+        else:
+            compressed = gzip.compress(body, compresslevel=self.gzip_level)
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        response.headers["Content-Length"] = str(len(compressed))
+
+        # The encoded body differs byte-wise from the one the validator was built on
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+
+        self._record(request.endpoint, len(body), len(compressed))
+        return response
+
+    def _record(self, endpoint, raw, sent):
+        key = endpoint or "unknown"
+        with self._lock:
+            stats = self._stats.setdefault(key, {"responses": 0, "raw_bytes": 0, "sent_bytes": 0})
+            stats["responses"] += 1
+            stats["raw_bytes"] += raw
+            stats["sent_bytes"] += sent
+
+    def stats(self):
+        """Per-route byte counts for this worker, with the fraction saved."""
+        with self._lock:
+            snapshot = {k: dict(v) for k, v in self._stats.items()}
+        for stats in snapshot.values():
+            raw = stats["raw_bytes"]
+            stats["saved_ratio"] = round(1 - stats["sent_bytes"] / raw, 3) if raw else 0.0
+        return snapshot
+
+
+def conditional_response(response, request, private=True, max_age=0, last_modified=None):
+    """
+    Adds cache headers and an ETag, and turns the response into a 304 when the
+    client's copy is still current. Per-user pages must stay private.
+    """
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    if max_age:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.add_etag()
+    return response.make_conditional(request)
@@ -0,0 +1,224 @@
+"""
+Points leaderboards per tenant (school): one per study year plus a
+school-wide one. Board names are "<tenant>:<study year>" and "<tenant>:global".
+
+Rank is competition ranking (1 + number of students with strictly more points).
+Both backends update and rank in O(log n):
+
+- MemoryLeaderboard: a Fenwick tree over point values per board, per process.
+  Other workers' awards arrive with the periodic reload (LEADERBOARD_RELOAD_SECONDS).
+- RedisLeaderboard: sorted sets shared by all workers (ZADD / ZCOUNT / ZREVRANGE).
+  One worker per reload interval rebuilds them from the database, so changes
+  made outside record_points (bulk imports, purges) reach the shared boards.
+"""
+import heapq
+import threading
+import uuid
+
+GLOBAL_BOARD = "global"
+
+
+def board_name(tenant, board):
+    return f"{tenant}:{board}"
+
+
+def boards_for(tenant, study_year):
+    boards = [GLOBAL_BOARD, study_year] if study_year else [GLOBAL_BOARD]
+    return [board_name(tenant, board) for board in boards]
+
+
+# ---------------- MEMORY ----------------
+class _FenwickBoard:
+    def __init__(self, size=1024):
+        self.scores = {}
+        self.tree = [0] * (size + 1)
+
+    def _resize(self, max_score):
+        size = len(self.tree) - 1
+        while size <= max_score:
+            size *= 2
+        self.tree = [0] * (size + 1)
+        for score in self.scores.values():
+            self._add(score, 1)
+
+    def _add(self, score, delta):
+        i = score + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _count_upto(self, score):
+        """Students with points <= score."""
+        i = min(score + 1, len(self.tree) - 1)
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def set(self, user_id, score):
+        score = max(0, int(score))
+        old = self.scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self._add(old, -1)
+        self.scores[user_id] = score
+        if score + 1 >= len(self.tree):
+            self._resize(score)
+        else:
+            self._add(score, 1)
+
+    def remove(self, user_id):
+        old = self.scores.pop(user_id, None)
+        if old is not None:
+            self._add(old, -1)
+
+    def rank(self, user_id):
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return 1 + len(self.scores) - self._count_upto(score)
+
+    def top(self, n):
+        return heapq.nlargest(n, self.scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+class MemoryLeaderboard:
+    def __init__(self):
+        self._boards = {}
+        self._pending = None
+        self._lock = threading.Lock()
+
+    def load(self, rows, force=False):
+        """Replaces every board from (user_id, tenant, study_year, points) rows."""
+        with self._lock:
+            # Changes made while the rows are read are replayed onto the new boards
+            self._pending = []
+        boards = {}
+        for user_id, tenant, study_year, points in rows:
+            for name in boards_for(tenant, study_year):
+                boards.setdefault(name, _FenwickBoard()).set(user_id, points or 0)
+        with self._lock:
+            for apply in self._pending:
+                apply(boards)
+            self._boards = boards
+            self._pending = None
+
+    def set(self, user_id, tenant, study_year, points):
+        def apply(boards):
+            for name in boards_for(tenant, study_year):
+                boards.setdefault(name, _FenwickBoard()).set(user_id, points or 0)
+        with self._lock:
+            apply(self._boards)
+            if self._pending is not None:
+                self._pending.append(apply)
+
+    def remove(self, user_id, tenant, study_year):
+        def apply(boards):
+            for name in boards_for(tenant, study_year):
+                if name in boards:
+                    boards[name].remove(user_id)
+        with self._lock:
+            apply(self._boards)
+            if self._pending is not None:
+                self._pending.append(apply)
+
+    def rank(self, board, user_id):
+        """(rank, board size), rank None when the user is not on the board."""
+        with self._lock:
+            b = self._boards.get(board)
+            if not b:
+                return None, 0
+            return b.rank(user_id), len(b.scores)
+
+    def top(self, board, n):
+        with self._lock:
+            b = self._boards.get(board)
+            return b.top(n) if b else []
+
+
+# ---------------- REDIS ----------------
+class RedisLeaderboard:
+    def __init__(self, url, prefix="afhamha:leaderboard:", reload_seconds=300.0):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("LEADERBOARD_BACKEND=redis requires the 'redis' package")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.reload_seconds = reload_seconds
+
+    def _key(self, board):
+        return self.prefix + board
+
+    def load(self, rows, force=False, batch_size=5000):
+        """
+        Rebuilds the sorted sets unless another worker did within reload_seconds
+        (force skips that check). Boards are built under temporary keys and
+        RENAMEd into place, so readers never see a half-filled board. An award
+        landing while the rows are read may be overwritten by the value read
+        before it, until the next rebuild.
+        """
+        flag = self.prefix + "rebuilt"
+        ttl = max(1, int(self.reload_seconds))
+        if force:
+            self.client.set(flag, "1", ex=ttl)
+        elif not self.client.set(flag, "1", nx=True, ex=ttl):
+            return
+        staging = f"{self.prefix}rebuild:{uuid.uuid4().hex}:"
+        boards = set()
+        pipe = self.client.pipeline(transaction=False)
+        for i, (user_id, tenant, study_year, points) in enumerate(rows, 1):
+            for name in boards_for(tenant, study_year):
+                boards.add(name)
+                pipe.zadd(staging + name, {user_id: points or 0})
+            if i % batch_size == 0:
+                pipe.execute()
+        pipe.execute()
+
+        registry = self.prefix + "boards"
+        gone = {b.decode("utf-8") for b in self.client.smembers(registry)} - boards
+        pipe = self.client.pipeline(transaction=True)
+        for name in boards:
+            pipe.rename(staging + name, self._key(name))
+        for name in gone:
+            pipe.delete(self._key(name))
+        pipe.delete(registry)
+        if boards:
+            pipe.sadd(registry, *boards)
+        pipe.execute()
+
+    def set(self, user_id, tenant, study_year, points):
+        pipe = self.client.pipeline(transaction=False)
+        for name in boards_for(tenant, study_year):
+            pipe.zadd(self._key(name), {user_id: points or 0})
+        pipe.execute()
+
+    def remove(self, user_id, tenant, study_year):
+        pipe = self.client.pipeline(transaction=False)
+        for name in boards_for(tenant, study_year):
+            pipe.zrem(self._key(name), user_id)
+        pipe.execute()
+
+    def rank(self, board, user_id):
+        key = self._key(board)
+        score = self.client.zscore(key, user_id)
+        size = self.client.zcard(key)
+        if score is None:
+            return None, size
+        return 1 + self.client.zcount(key, f"({score}", "+inf"), size
+
+    def top(self, board, n):
+        return [
+            (int(member), int(score))
+            for member, score in self.client.zrevrange(self._key(board), 0, n - 1, withscores=True)
+        ]
+
+
+def create_leaderboard(kind, url=None, reload_seconds=300.0):
+    if kind == "memory":
+        return MemoryLeaderboard()
+    if kind == "redis":
+        return RedisLeaderboard(url or "redis://localhost:6379/0", reload_seconds=reload_seconds)
+    raise ValueError(f"Unknown leaderboard backend: {kind}")
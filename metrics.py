@@ -0,0 +1,179 @@
+"""
+Prometheus instrumentation.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py does this) so
+every worker writes its samples to a shared directory and /metrics reports
+the sum across workers. Without it the metrics cover the current process only.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+
+REQUEST_DURATION = Histogram(
+    "afhamha_request_duration_seconds",
+    "Request duration by route",
+    ["route", "method", "status"],
+)
+REQUEST_DB_QUERIES = Histogram(
+    "afhamha_request_db_queries",
+    "Database queries issued per request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+AI_PHASE_DURATION = Histogram(
+    "afhamha_ai_phase_duration_seconds",
+    "Time spent in each phase of an AI room request",
+    ["phase"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60),
+)
+AI_REQUESTS = Counter(
+    "afhamha_ai_requests_total",
+    "AI room requests by outcome",
+    ["outcome"],
+)
+OPENAI_TOKENS = Counter(
+    "afhamha_openai_tokens_total",
+    "Tokens reported by the OpenAI API",
+    ["kind"],
+)
+SLOW_QUERIES = Counter(
+    "afhamha_slow_queries_total",
+    "Queries slower than SLOW_QUERY_MS in profiled requests",
+)
+N_PLUS_ONE_DETECTED = Counter(
+    "afhamha_n_plus_one_total",
+    "Profiled requests that repeated one statement N_PLUS_ONE_THRESHOLD+ times",
+    ["route"],
+)
+OTP_DURATION = Histogram(
+    "afhamha_otp_send_duration_seconds",
+    "Resala OTP send latency",
+    ["outcome"],
+)
+LOGIN_ATTEMPTS = Counter(
+    "afhamha_login_attempts_total",
+    "Password logins by outcome",
+    ["outcome"],
+)
+SEMANTIC_CACHE_LOOKUPS = Counter(
+    "afhamha_semantic_cache_lookups_total",
+    "AI room semantic cache lookups by outcome",
+    ["outcome"],
+)
+SEMANTIC_CACHE_SIMILARITY = Histogram(
+    "afhamha_semantic_cache_best_similarity",
+    "Best cosine similarity found per semantic cache lookup",
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.99, 1.0),
+)
+AI_OUTPUT_PARSE = Counter(
+    "afhamha_ai_output_parse_total",
+    "Model replies by parse outcome (ok, repaired, failed) and finish reason",
+    ["kind", "outcome", "finish_reason"],
+)
+TENANT_AI_THROTTLED = Counter(
+    "afhamha_tenant_ai_throttled_total",
+    "AI requests refused by a tenant's OpenAI quota",
+    ["tenant", "reason"],
+)
+DB_READ_ROUTING = Counter(
+    "afhamha_db_read_routing_total",
+    "Read-only requests by the database they were routed to",
+    ["target"],
+)
+
+
+@contextmanager
+def ai_phase(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        AI_PHASE_DURATION.labels(phase).observe(time.perf_counter() - start)
+
+
+def record_token_usage(usage):
+    if usage is None:
+        return
+    OPENAI_TOKENS.labels("prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    OPENAI_TOKENS.labels("completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+    # Prompt tokens served from the provider's prompt cache (billed at a discount)
+    details = getattr(usage, "prompt_tokens_details", None)
+    OPENAI_TOKENS.labels("cached").inc(getattr(details, "cached_tokens", 0) or 0)
+
+
+def timed_otp(send, phone):
+    """Calls send(phone) and records latency with an ok/failed outcome."""
+    start = time.perf_counter()
+    pin = send(phone)
+    OTP_DURATION.labels("ok" if pin else "failed").observe(time.perf_counter() - start)
+    return pin
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def count_queries(engine):
+    """Counts statements on engine towards the current request's query total."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        try:
+            g.db_queries = g.get("db_queries", 0) + 1
+        except RuntimeError:
+            # Outside an app context (startup migrations, background jobs)
+            pass
+
+
+def _registry():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def counter_totals(metric, label):
+    """{label value: count} for a labelled counter, summed across workers."""
+    totals = {}
+    for family in _registry().collect():
+        if family.name != metric:
+            continue
+        for sample in family.samples:
+            if sample.name == metric + "_total":
+                key = sample.labels.get(label)
+                totals[key] = totals.get(key, 0) + sample.value
+    return totals
+
+
+def init_metrics(app, engine):
+    count_queries(engine)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.get("request_started")
+        if started is not None:
+            route = _route()
+            REQUEST_DURATION.labels(route, request.method, str(response.status_code)).observe(
+                time.perf_counter() - started
+            )
+            REQUEST_DB_QUERIES.labels(route).observe(g.get("db_queries", 0))
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        token = os.getenv("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            return Response("unauthorized\n", status=401, mimetype="text/plain")
+
+        return Response(generate_latest(_registry()), mimetype=CONTENT_TYPE_LATEST)
@@ -43,8 +43,18 @@ try:
                 'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS points INTEGER DEFAULT 0;',
                 'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS study_hours FLOAT DEFAULT 0.0;',
                 'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS is_verified BOOLEAN DEFAULT FALSE;',
+                "ALTER TABLE \"user\" ADD COLUMN IF NOT EXISTS tenant VARCHAR(50) NOT NULL DEFAULT 'default';",
+                # query_embedding only exists once the app has started with the semantic cache models
+                "DO $$ BEGIN IF to_regclass('query_embedding') IS NOT NULL THEN "
+                "ALTER TABLE query_embedding ADD COLUMN IF NOT EXISTS tenant VARCHAR(50) NOT NULL DEFAULT 'default'; "
+                "END IF; END $$;",
+                'CREATE INDEX IF NOT EXISTS ix_user_tenant_study_year ON "user" (tenant, study_year);',
                 'ALTER TABLE explanation ADD COLUMN IF NOT EXISTS subject VARCHAR(100);',
-                'ALTER TABLE explanation ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;'
+                'ALTER TABLE explanation ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;',
+                'ALTER TABLE explanation ADD COLUMN IF NOT EXISTS quiz TEXT;',
+                'ALTER TABLE explanation ADD COLUMN IF NOT EXISTS content_html TEXT;',
+                'CREATE INDEX IF NOT EXISTS ix_explanation_created_at ON explanation (created_at);',
+                'CREATE INDEX IF NOT EXISTS ix_explanation_user_id ON explanation (user_id);'
             ]
             for q in queries:
                 try:
@@ -53,6 +63,7 @@ try:
                     print(f"✓ Executed: {q[:40]}...")
                     migrations_run += 1
                 except Exception as ex:
+                    conn.rollback()
                     print(f"⚠ Skipping query (might already exist): {ex}")
         else:
             # SQLite fallback
@@ -60,6 +71,26 @@ try:
                 conn.execute(text('ALTER TABLE "user" ADD COLUMN is_verified BOOLEAN DEFAULT FALSE;'))
                 conn.commit()
                 migrations_run += 1
+            if not column_exists(conn, 'explanation', 'quiz'):
+                conn.execute(text('ALTER TABLE explanation ADD COLUMN quiz TEXT;'))
+                conn.commit()
+                migrations_run += 1
+            if not column_exists(conn, 'explanation', 'content_html'):
+                conn.execute(text('ALTER TABLE explanation ADD COLUMN content_html TEXT;'))
+                conn.commit()
+                migrations_run += 1
+            if not column_exists(conn, 'user', 'tenant'):
+                conn.execute(text("ALTER TABLE \"user\" ADD COLUMN tenant VARCHAR(50) NOT NULL DEFAULT 'default';"))
+                conn.commit()
+                migrations_run += 1
+            if column_exists(conn, 'query_embedding', 'id') and not column_exists(conn, 'query_embedding', 'tenant'):
+                conn.execute(text("ALTER TABLE query_embedding ADD COLUMN tenant VARCHAR(50) NOT NULL DEFAULT 'default';"))
+                conn.commit()
+                migrations_run += 1
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_explanation_created_at ON explanation (created_at);'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_explanation_user_id ON explanation (user_id);'))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_user_tenant_study_year ON "user" (tenant, study_year);'))
+            conn.commit()
 
         # Create lesson table if it doesn't exist
         try:
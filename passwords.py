@@ -0,0 +1,54 @@
+"""
+Password hashing with a configurable cost.
+
+PASSWORD_HASH_METHOD takes any werkzeug method string, e.g.
+
+    scrypt:32768:8:1        werkzeug's default
+    scrypt:16384:8:1        half the CPU and memory per hash
+    pbkdf2:sha256:600000
+
+Hashes made with other parameters keep verifying; needs_rehash() tells the
+login views to upgrade them while the plain password is at hand.
+
+Verification runs on PASSWORD_HASH_WORKERS threads (hashlib's scrypt and
+pbkdf2_hmac release the GIL, so each uses its own core) with at most
+PASSWORD_HASH_QUEUE more callers waiting. Beyond that verify() raises
+PasswordCheckBusy at once instead of piling more CPU work onto the worker.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = "scrypt:32768:8:1"
+
+
+class PasswordCheckBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, method=None, workers=None, queue=None):
+        self.method = method or os.getenv("PASSWORD_HASH_METHOD", DEFAULT_METHOD)
+        # Stored hashes start with the expanded method ("scrypt" -> "scrypt:32768:8:1")
+        self.prefix = generate_password_hash("", self.method).split("$", 1)[0]
+        self.workers = workers or int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or os.cpu_count() or 1
+        if queue is None:
+            queue = int(os.getenv("PASSWORD_HASH_QUEUE", str(self.workers * 4)))
+        self._slots = threading.BoundedSemaphore(self.workers + queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+
+    def hash(self, password):
+        return generate_password_hash(password, self.method)
+
+    def needs_rehash(self, stored):
+        return stored.split("$", 1)[0] != self.prefix
+
+    def verify(self, stored, password):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordCheckBusy()
+        try:
+            return self._pool.submit(check_password_hash, stored, password).result()
+        finally:
+            self._slots.release()
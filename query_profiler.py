@@ -0,0 +1,119 @@
+"""
+Per-request SQL profiler.
+
+Hooks SQLAlchemy cursor events to count and time the queries of a request,
+flags statements repeated often enough to look like an N+1 pattern, and
+logs slow queries together with their EXPLAIN plan.
+
+QUERY_PROFILER=off | on | sample (default sample: only QUERY_PROFILER_SAMPLE_RATE
+of requests are profiled, cheap enough to leave on in production).
+"""
+import os
+import random
+import time
+from collections import Counter
+
+from flask import g, request
+from sqlalchemy import event
+
+from metrics import N_PLUS_ONE_DETECTED, SLOW_QUERIES
+
+
+class QueryProfiler:
+    def __init__(self, app=None, engine=None):
+        self.mode = os.getenv("QUERY_PROFILER", "sample").strip().lower()
+        self.sample_rate = float(os.getenv("QUERY_PROFILER_SAMPLE_RATE", "0.01"))
+        self.slow_ms = float(os.getenv("SLOW_QUERY_MS", "200"))
+        self.repeat_threshold = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+        self.explain = os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1"
+        if app is not None:
+            self.init_app(app, engine)
+
+    def init_app(self, app, engine):
+        if self.mode == "off":
+            return
+        self.header = app.debug or os.getenv("QUERY_PROFILER_HEADER") == "1"
+        self.dialect = engine.dialect.name
+        self.watch(engine)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def watch(self, engine):
+        """Profiles statements on another engine too (e.g. the read replica)."""
+        if self.mode == "off":
+            return
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    # ---------------- REQUEST ----------------
+    def _start(self):
+        if self.mode == "on" or self.header or random.random() < self.sample_rate:
+            g.query_profile = {"count": 0, "time": 0.0, "statements": Counter()}
+
+    def _finish(self, response):
+        profile = g.get("query_profile")
+        if not profile:
+            return response
+
+        route = request.url_rule.rule if request.url_rule else request.path
+        repeated = {s: n for s, n in profile["statements"].items() if n >= self.repeat_threshold}
+        for statement, count in repeated.items():
+            N_PLUS_ONE_DETECTED.labels(route).inc()
+            print(f">>> N+1 SUSPECT: {route} ran the same statement {count}x: {_short(statement)}")
+
+        if self.header:
+            response.headers["X-DB-Queries"] = (
+                f"count={profile['count']}; time_ms={profile['time'] * 1000:.1f}; repeated={len(repeated)}"
+            )
+        return response
+
+    # ---------------- CURSOR EVENTS ----------------
+    def _profile(self):
+        try:
+            return g.get("query_profile")
+        except RuntimeError:
+            # Outside an app context (startup, background threads)
+            return None
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if self._profile() is not None:
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        profile = self._profile()
+        if profile is None:
+            return
+        started = conn.info.get("query_started")
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+
+        profile["count"] += 1
+        profile["time"] += elapsed
+        profile["statements"][statement] += 1
+
+        if elapsed * 1000 >= self.slow_ms:
+            SLOW_QUERIES.inc()
+            print(f">>> SLOW QUERY ({elapsed * 1000:.0f}ms): {_short(statement)}")
+            if self.explain and not executemany and statement.lstrip().upper().startswith("SELECT"):
+                plan = self._explain(conn, statement, parameters)
+                if plan:
+                    print(">>> PLAN:\n" + plan)
+
+    def _explain(self, conn, statement, parameters):
+        prefix = "EXPLAIN QUERY PLAN " if self.dialect == "sqlite" else "EXPLAIN "
+        try:
+            # Raw DBAPI cursor, so this does not re-enter the engine events
+            cursor = conn.connection.cursor()
+            try:
+                cursor.execute(prefix + statement, parameters)
+                return "\n".join("    " + " | ".join(str(col) for col in row) for row in cursor.fetchall())
+            finally:
+                cursor.close()
+        except Exception as e:
+            return f"    (EXPLAIN failed: {e})"
+
+
+def _short(statement, limit=300):
+    flat = " ".join(statement.split())
+    return flat if len(flat) <= limit else flat[:limit] + "..."
@@ -0,0 +1,86 @@
+"""
+Worker warm-up and the checks behind /healthz and /readyz.
+
+Warmup runs named steps once, while the worker imports the app and before
+it accepts connections, so the first requests after a deploy do not pay
+for opening pool connections, compiling templates or the provider's TLS
+handshake. Each step's outcome and duration are kept for /readyz. A failed
+step is logged, never raised: the worker still starts, and the live checks
+decide whether it is ready.
+
+Checks are (callable, required) pairs. A callable returns optional details
+or raises. The worker is ready once warm-up has finished and every
+required check passes. Optional checks (e.g. the AI provider, which has
+its own degraded mode) are reported but never take a worker out of
+rotation.
+"""
+import threading
+import time
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    try:
+        detail = fn()
+    except Exception as e:
+        return {"ok": False, "ms": round((time.perf_counter() - started) * 1000, 1),
+                "error": f"{type(e).__name__}: {e}"[:300]}
+    result = {"ok": True, "ms": round((time.perf_counter() - started) * 1000, 1)}
+    if detail is not None:
+        result["detail"] = detail
+    return result
+
+
+class Warmup:
+    def __init__(self):
+        self.steps = {}
+        self.started_at = None
+        self.finished_at = None
+
+    def run(self, steps):
+        """steps: [(name, callable)] run in order."""
+        self.started_at = time.time()
+        started = time.perf_counter()
+        for name, step in steps:
+            result = self.steps[name] = _timed(step)
+            if not result["ok"]:
+                print(f">>> Warm-up step {name} failed: {result['error']}")
+        self.finished_at = time.time()
+        failed = [name for name, result in self.steps.items() if not result["ok"]]
+        print(f">>> Warm-up finished in {time.perf_counter() - started:.2f}s"
+              + (f" ({', '.join(failed)} failed)" if failed else ""))
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    def status(self):
+        return {"done": self.done, "started_at": self.started_at,
+                "finished_at": self.finished_at, "steps": self.steps}
+
+
+class Readiness:
+    def __init__(self, warmup, checks, cache_seconds=2.0):
+        self.warmup = warmup
+        self.checks = checks  # {name: (callable, required)}
+        self.cache_seconds = cache_seconds
+        self._cached = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Returns (ready, report). Results are reused for cache_seconds so frequent probes stay cheap."""
+        now = time.monotonic()
+        cached = self._cached
+        if cached and cached[0] > now:
+            return cached[1], cached[2]
+        with self._lock:
+            cached = self._cached
+            if cached and cached[0] > time.monotonic():
+                return cached[1], cached[2]
+            results = {}
+            for name, (fn, required) in self.checks.items():
+                results[name] = {**_timed(fn), "required": required}
+            ready = self.warmup.done and all(r["ok"] for r in results.values() if r["required"])
+            report = {"ready": ready, "checks": results, "warmup": self.warmup.status()}
+            self._cached = (time.monotonic() + self.cache_seconds, ready, report)
+            return ready, report
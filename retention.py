@@ -0,0 +1,31 @@
+"""
+Retention jobs. Schedule `archive` daily (cron / a platform job); `purge`
+finishes user deletions that a restarted worker left unfinished.
+
+    python retention.py archive [--months 12] [--batch-size 500]
+    python retention.py purge
+"""
+import argparse
+
+from app import app, archive_explanations, process_deletions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("job", choices=["archive", "purge"])
+    parser.add_argument("--months", type=int, help="archive explanations older than this (default ARCHIVE_AFTER_MONTHS)")
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--max-batches", type=int)
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.job == "archive":
+            moved = archive_explanations(args.months, args.batch_size, args.max_batches)
+            print(f">>> Archive done: {moved} explanations moved")
+        else:
+            purged = process_deletions()
+            print(f">>> Purge done: {purged} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Semantic cache for AI room queries.
+
+Queries are embedded and kept per (study_year, subject) as L2-normalized
+float16 matrices in memory; a lookup is one matrix-vector product and an
+argmax, so paraphrases ("شرح قانون نيوتن الثاني" / "قانون نيوتن 2 شرح") can
+reuse an explanation that was already generated.
+
+Numbers and ordinals decide the topic while barely moving the vector
+("الدرجة الأولى" / "الدرجة الثانية" score above 0.9), so a query is only
+compared with queries carrying the same ones (number_signature).
+
+SEMANTIC_CACHE_EMBEDDER:
+  hashed                 character n-grams hashed into a fixed vector (default, offline; threshold 0.95)
+  sentence-transformers  a local multilingual model (optional dependency; threshold 0.9)
+"""
+import hashlib
+import os
+import re
+import threading
+
+import numpy as np
+
+# ---------------- NORMALIZATION ----------------
+_DIACRITICS = re.compile(r"[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_NON_WORD = re.compile(r"[^\w]+")
+_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩", "0123456789")
+_LETTERS = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ة": "ه", "ؤ": "و", "ئ": "ي"})
+
+# Ordinals written as words or digits should match ("الثاني" == "2")
+ORDINALS = {
+    "الاول": "1", "الاولي": "1", "اول": "1",
+    "الثاني": "2", "الثانيه": "2", "ثاني": "2",
+    "الثالث": "3", "الثالثه": "3", "ثالث": "3",
+    "الرابع": "4", "الرابعه": "4", "رابع": "4",
+    "الخامس": "5", "الخامسه": "5", "خامس": "5",
+    "السادس": "6", "السادسه": "6",
+    "السابع": "7", "السابعه": "7",
+    "الثامن": "8", "الثامنه": "8",
+    "التاسع": "9", "التاسعه": "9",
+    "العاشر": "10", "العاشره": "10",
+}
+# Request phrasing that carries no topic
+FILLER_WORDS = {
+    "شرح", "اشرح", "اشرحلي", "اشرحي", "وضح", "وضحلي", "فسر", "ما", "ماهو", "ماهي", "هو", "هي",
+    "عن", "لي", "ممكن", "بالتفصيل", "بالتفصل", "درس", "موضوع", "please", "explain",
+}
+
+
+def normalize_query(text):
+    text = _DIACRITICS.sub("", (text or "").lower()).translate(_DIGITS).translate(_LETTERS)
+    words = []
+    for word in _NON_WORD.sub(" ", text).split():
+        word = ORDINALS.get(word, word)
+        if word not in FILLER_WORDS:
+            words.append(word)
+    return words
+
+
+def number_signature(text):
+    """The query's numbers and ordinals (as digits), sorted; only queries with equal signatures match."""
+    return " ".join(sorted({word for word in normalize_query(text) if any(ch.isdigit() for ch in word)}))
+
+
+# ---------------- EMBEDDERS ----------------
+class HashedNgramEmbedder:
+    """Words and character trigrams hashed (with a sign bit) into `dim` buckets."""
+
+    default_threshold = 0.95
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"hashed-{dim}"
+
+    def _features(self, words):
+        for word in words:
+            yield word, 2.0
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 1.0
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(normalize_query(text)):
+                h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[row, h % self.dim] += weight if h >> 63 else -weight
+        return _normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    default_threshold = 0.9
+
+    def __init__(self, model_name):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("SEMANTIC_CACHE_EMBEDDER=sentence-transformers requires the 'sentence-transformers' package")
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st-{model_name.rsplit('/', 1)[-1]}"[:50]
+
+    def embed(self, texts):
+        prepared = [" ".join(normalize_query(t)) or t for t in texts]
+        return _normalize(np.asarray(self.model.encode(prepared), dtype=np.float32))
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def create_embedder(kind=None):
+    kind = (kind or os.getenv("SEMANTIC_CACHE_EMBEDDER", "hashed")).strip().lower()
+    if kind == "hashed":
+        return HashedNgramEmbedder(int(os.getenv("SEMANTIC_CACHE_DIM", "256")))
+    if kind == "sentence-transformers":
+        return SentenceTransformerEmbedder(
+            os.getenv("SEMANTIC_CACHE_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+        )
+    raise ValueError(f"Unknown SEMANTIC_CACHE_EMBEDDER: {kind}")
+
+
+# ---------------- INDEX ----------------
+class SemanticIndex:
+    """
+    Per-key float16 matrices with amortized growth. Rows are never changed once
+    written, so lookups score a snapshot outside the lock.
+    """
+
+    block_rows = 4096
+
+    def __init__(self, dim):
+        self.dim = dim
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, item_id, vector):
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = [np.empty((16, self.dim), np.float16), np.empty(16, np.int64), 0]
+            matrix, ids, n = group
+            if n == len(ids):
+                matrix = np.concatenate([matrix, np.empty_like(matrix)])
+                ids = np.concatenate([ids, np.empty_like(ids)])
+            matrix[n] = vector
+            ids[n] = item_id
+            group[:] = [matrix, ids, n + 1]
+
+    def best(self, key, vector):
+        """Returns (item_id, cosine) of the closest row for key, or (None, 0.0)."""
+        with self._lock:
+            group = self._groups.get(key)
+            if not group or not group[2]:
+                return None, 0.0
+            matrix, ids, n = group
+        vector = np.asarray(vector, dtype=np.float32)
+        best_score, best_row = -1.0, 0
+        # float16 storage, float32 BLAS math, in bounded blocks
+        for start in range(0, n, self.block_rows):
+            scores = matrix[start:min(n, start + self.block_rows)].astype(np.float32) @ vector
+            i = int(np.argmax(scores))
+            if scores[i] > best_score:
+                best_score, best_row = float(scores[i]), start + i
+        return int(ids[best_row]), best_score
+
+    def sizes(self):
+        with self._lock:
+            return {key: group[2] for key, group in self._groups.items()}
+
+    def __len__(self):
+        return sum(self.sizes().values())
@@ -0,0 +1,281 @@
+"""
+Server-side session storage.
+
+The browser only keeps a short opaque session id; the session data itself
+(pending signup, OTP state, Flask-Login keys) lives in a backend:
+
+- SQLSessionBackend: any SQLAlchemy engine (the app database, or a local SQLite file)
+- RedisSessionBackend: Redis or any Redis-compatible server
+- MemorySessionBackend: per-process dict, for local development only
+
+Every backend also offers a small counter (`incr`, `reset`) used for central rate limiting.
+"""
+import random
+import secrets
+import threading
+import time
+from datetime import timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, delete, select, update
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import CallbackDict
+
+serializer = TaggedJSONSerializer()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+# ---------------- BACKENDS ----------------
+class MemorySessionBackend:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if not item:
+                return None
+            value, expires = item
+            if expires < time.time():
+                self._data.pop(key, None)
+                return None
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, ttl):
+        with self._lock:
+            now = time.time()
+            value, expires = self._data.get(key, (0, 0))
+            if expires < now:
+                value, expires = 0, now + ttl
+            value += 1
+            self._data[key] = (value, expires)
+            return value
+
+    def reset(self, key):
+        self.delete(key)
+
+    def cleanup(self):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (_, exp) in self._data.items() if exp < now]:
+                del self._data[key]
+
+
+class SQLSessionBackend:
+    """
+    Stores sessions and counters in two small tables on the given engine.
+    Expired rows are removed lazily on read and by an occasional sweep on write.
+    """
+
+    def __init__(self, engine, cleanup_chance=0.01):
+        self.engine = engine
+        self.cleanup_chance = cleanup_chance
+        metadata = MetaData()
+        self.sessions = Table(
+            "server_session", metadata,
+            Column("id", String(64), primary_key=True),
+            Column("data", Text, nullable=False),
+            Column("expires_at", Float, nullable=False, index=True),
+        )
+        self.counters = Table(
+            "rate_counter", metadata,
+            Column("key", String(128), primary_key=True),
+            Column("value", Integer, nullable=False, default=0),
+            Column("expires_at", Float, nullable=False, index=True),
+        )
+        metadata.create_all(engine)
+
+    def get(self, key):
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(self.sessions.c.data, self.sessions.c.expires_at)
+                .where(self.sessions.c.id == key)
+            ).first()
+        if not row or row.expires_at < time.time():
+            return None
+        return row.data
+
+    def set(self, key, value, ttl):
+        expires = time.time() + ttl
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                update(self.sessions)
+                .where(self.sessions.c.id == key)
+                .values(data=value, expires_at=expires)
+            )
+            if result.rowcount == 0:
+                conn.execute(self.sessions.insert().values(id=key, data=value, expires_at=expires))
+        if random.random() < self.cleanup_chance:
+            self.cleanup()
+
+    def delete(self, key):
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.sessions).where(self.sessions.c.id == key))
+
+    def incr(self, key, ttl):
+        now = time.time()
+        c = self.counters.c
+        with self.engine.begin() as conn:
+            # Restart the window if it expired, otherwise bump the counter
+            conn.execute(
+                update(self.counters)
+                .where(c.key == key, c.expires_at < now)
+                .values(value=0, expires_at=now + ttl)
+            )
+            result = conn.execute(
+                update(self.counters)
+                .where(c.key == key)
+                .values(value=c.value + 1)
+            )
+            if result.rowcount:
+                return conn.execute(select(c.value).where(c.key == key)).scalar()
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(self.counters.insert().values(key=key, value=1, expires_at=now + ttl))
+            return 1
+        except IntegrityError:
+            # Another worker created the row first
+            return self.incr(key, ttl)
+
+    def reset(self, key):
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.counters).where(self.counters.c.key == key))
+
+    def cleanup(self):
+        now = time.time()
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.sessions).where(self.sessions.c.expires_at < now))
+            conn.execute(delete(self.counters).where(self.counters.c.expires_at < now))
+
+
+class RedisSessionBackend:
+    """Works with Redis or any server speaking its protocol. Redis expires keys itself."""
+
+    def __init__(self, url, prefix="afhamha:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SESSION_BACKEND=redis requires the 'redis' package")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=int(ttl))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key, ttl):
+        value = self.client.incr(self.prefix + key)
+        if value == 1:
+            self.client.expire(self.prefix + key, int(ttl))
+        return value
+
+    def reset(self, key):
+        self.delete(key)
+
+    def cleanup(self):
+        pass
+
+
+# ---------------- FLASK INTERFACE ----------------
+class ServerSessionInterface(SessionInterface):
+    key_prefix = "session:"
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _ttl(self, app):
+        lifetime = app.permanent_session_lifetime
+        if isinstance(lifetime, timedelta):
+            return lifetime.total_seconds()
+        return float(lifetime)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            raw = self.backend.get(self.key_prefix + sid)
+            if raw is not None:
+                try:
+                    return ServerSession(serializer.loads(raw), sid=sid)
+                except (ValueError, TypeError):
+                    pass
+        return ServerSession(sid=secrets.token_urlsafe(16), new=True)
+
+    def regenerate(self, session):
+        """
+        Moves the session's data to a fresh id and drops the old one. Call on
+        login, so an id planted before authentication is useless afterwards.
+        """
+        if not session.new:
+            self.backend.delete(self.key_prefix + session.sid)
+        session.sid = secrets.token_urlsafe(16)
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self.backend.delete(self.key_prefix + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            self.backend.set(self.key_prefix + session.sid, serializer.dumps(dict(session)), self._ttl(app))
+        elif not self.should_set_cookie(app, session):
+            return
+
+        response.vary.add("Cookie")
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def create_backend(kind, engine=None, url=None):
+    """
+    kind: "db" (app database), "sqlite" (local file at `url`), "redis" or "memory".
+    """
+    if kind == "db":
+        return SQLSessionBackend(engine)
+    if kind == "sqlite":
+        from sqlalchemy import create_engine
+        return SQLSessionBackend(create_engine(url or "sqlite:///sessions.db"))
+    if kind == "redis":
+        return RedisSessionBackend(url or "redis://localhost:6379/0")
+    if kind == "memory":
+        return MemorySessionBackend()
+    raise ValueError(f"Unknown session backend: {kind}")
@@ -0,0 +1,374 @@
+let currentExplanationId = null;
+let conversationId = null;
+let quizLength = 0;
+
+function updateSubjectDisplay() {
+  const select = document.getElementById("subject");
+  const display = document.getElementById("currentSubjectDisplay");
+  display.innerText = "شرح: " + select.value;
+  renderReferences();
+}
+
+function renderReferences() {
+  const select = document.getElementById("subject");
+  const list = document.getElementById("referencesList");
+  const refs = referencesMap[select.value] || [];
+  if (!refs.length) {
+    list.innerHTML = "<p class='text-[10px] text-slate-400 font-bold italic'>لا توجد مراجع متاحة لهذه المادة حالياً.</p>";
+    return;
+  }
+  list.innerHTML = refs.map(r => `
+    <a href="${r.url}" download class="flex items-center justify-between gap-3 px-3 py-2 rounded-xl bg-white border border-slate-200 hover:border-primary/30 hover:bg-primary/5 transition">
+      <span class="text-xs font-bold text-slate-700">${r.label}</span>
+      <span class="text-[10px] text-primary font-black">تحميل</span>
+    </a>
+  `).join("");
+}
+
+function setLoading(state) {
+  const overlay = document.getElementById("loadingOverlay");
+  const btn = document.getElementById("askBtn");
+
+  if (state) {
+    showOverlay(overlay);
+    btn.disabled = true;
+    btn.classList.add("opacity-50");
+  } else {
+    hideOverlay(overlay);
+    btn.disabled = false;
+    btn.classList.remove("opacity-50");
+  }
+}
+
+/* ================= LOAD HISTORY ================= */
+function loadHistory() {
+  fetch("/api/explanations")
+    .then(r => r.json())
+    .then(data => {
+      const box = document.getElementById("history");
+      box.innerHTML = "";
+      if (!data.length) {
+        box.innerHTML = "<p class='text-slate-400 text-xs text-center font-bold font-italic py-10 opacity-60'>ما فيش شروحات بعد</p>";
+        return;
+      }
+      data.forEach(item => {
+        const div = document.createElement("div");
+        div.onclick = () => showHistoryItem(item);
+        div.className = "cursor-pointer bg-slate-50 hover:bg-primary/5 hover:border-primary/20 border border-transparent rounded-2xl p-4 transition-all group";
+        div.innerHTML = `
+        <div class="flex items-center gap-3">
+          <span class="text-xl group-hover:scale-110 transition-transform">📚</span>
+          <div class="flex-1 overflow-hidden">
+             <strong class="text-sm text-slate-800 block truncate group-hover:text-primary transition-colors">${item.title}</strong>
+             <p class="text-[10px] text-slate-400 font-bold italic mt-0.5">${item.date}</p>
+          </div>
+          <button 
+            onclick="event.stopPropagation(); confirmDelete(${item.id})"
+            class="opacity-0 group-hover:opacity-100 p-2 text-slate-300 hover:text-red-500 hover:bg-red-50 rounded-lg transition-all"
+            title="حذف">
+            <svg xmlns="http://www.w3.org/2000/svg" class="h-4 w-4" fill="none" viewBox="0 0 24 24" stroke="currentColor">
+              <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M19 7l-.867 12.142A2 2 0 0116.138 21H7.862a2 2 0 01-1.995-1.858L5 7m5 4v6m4-6v6m1-10V4a1 1 0 00-1-1h-4a1 1 0 00-1 1v3M4 7h16" />
+            </svg>
+          </button>
+        </div>`;
+        box.appendChild(div);
+      });
+    });
+}
+
+function showHistoryItem(item) {
+  addMessage("🤖", item.content_html, "bot");
+  startConversation(item.id);
+  fetch(`/api/explanations/${item.id}/turns`)
+    .then(r => r.json())
+    .then(turns => {
+      if (!Array.isArray(turns)) return;
+      turns.forEach(t => {
+        addMessage("👤", escapeHtml(t.question), "user");
+        addMessage("🤖", t.answer_html, "bot");
+      });
+    });
+  fetch(`/api/explanations/${item.id}/quiz`)
+    .then(r => r.json())
+    .then(data => {
+      if (data.quiz && data.quiz.length) {
+        renderQuiz(item.id, data.quiz);
+        return;
+      }
+      currentExplanationId = null;
+      document.getElementById("quiz").innerHTML = `
+      <div class="flex flex-col items-center justify-center h-full text-center p-6 grayscale opacity-40">
+        <div class="text-5xl mb-4">🔎</div>
+        <p class="text-sm font-bold text-slate-500 italic">هذا شرح قديم، الأسئلة مش محفوظة حالياً.</p>
+      </div>`;
+      document.getElementById("quizFooter").classList.add("hidden");
+    });
+}
+
+// Quiz text is model output, possibly cached from another student's prompt: escape it
+function renderQuiz(explanationId, quiz) {
+  let quizHtml = "";
+  currentExplanationId = explanationId;
+  quizLength = quiz.length;
+
+  quiz.forEach((q, i) => {
+    quizHtml += `
+  <div class="group bg-slate-50 rounded-[2rem] p-6 border border-slate-100/50 hover:bg-white hover:border-accent/20 transition-all duration-300">
+    <div class="flex gap-3 mb-4">
+      <span class="w-6 h-6 bg-accent/10 text-accent rounded-full flex items-center justify-center text-[10px] font-black">${i + 1}</span>
+      <strong class="text-sm text-slate-800 leading-snug font-black">${escapeHtml(q.question)}</strong>
+    </div>
+    <div class="space-y-2 mr-9">`;
+
+    q.options.forEach((op, idx) => {
+      const id = `q${i}_${idx}`;
+      quizHtml += `
+    <label for="${id}" class="flex items-center gap-3 p-3 rounded-xl border border-slate-200/50 hover:bg-white hover:border-primary/30 cursor-pointer transition-all group/option active:scale-[0.98]">
+      <input type="radio" id="${id}" name="q${i}" value="${idx}" class="w-4 h-4 text-primary focus:ring-primary border-slate-300">
+      <span class="text-xs font-bold text-slate-600 group-hover/option:text-slate-900 transition-colors">${escapeHtml(op)}</span>
+    </label>`;
+    });
+    quizHtml += `</div></div>`;
+  });
+
+  if (quiz.length) {
+    document.getElementById("quizFooter").classList.remove("hidden");
+  } else {
+    document.getElementById("quizFooter").classList.add("hidden");
+    quizHtml = `
+  <div class="flex flex-col items-center justify-center h-full text-center p-6 grayscale opacity-40">
+    <div class="text-5xl mb-4">🤷‍♂️</div>
+    <p class="text-sm font-bold text-slate-500 italic">ما قدرتش نجهز أسئلة للموضوع هذا، جرب موضوع ثاني.</p>
+  </div>`;
+  }
+
+  const quizBox = document.getElementById("quiz");
+  quizBox.style.opacity = "0";
+  setTimeout(() => {
+    quizBox.innerHTML = quizHtml;
+    quizBox.style.opacity = "1";
+  }, 300);
+}
+
+// Bot messages arrive as HTML already rendered and sanitized by the server
+function addMessage(sender, htmlContent, type) {
+  const chatMessages = document.getElementById("chatMessages");
+  const div = document.createElement("div");
+  div.className = `flex gap-4 animate-in slide-in-from-bottom-4 duration-500 opacity-0 fill-mode-forwards`;
+  div.style.opacity = "1"; // In case animate-in doesn't work perfectly
+
+  const icon = type === "bot" ? "🤖" : "👤";
+  const bgClass = type === "bot" ? "bg-white rounded-[2rem] rounded-tr-none shadow-sm border border-slate-100" : "bg-primary text-white rounded-[2rem] rounded-tl-none mr-auto ml-0 shadow-lg shadow-primary/10";
+  const textClass = type === "bot" ? "text-slate-700" : "text-white";
+
+    div.innerHTML = `
+  ${type === "bot" ? `<div class="w-8 h-8 bg-primary rounded-lg flex-shrink-0 flex items-center justify-center text-white text-sm">${icon}</div>` : ""}
+  <div class="${bgClass} p-5 max-w-[85%]">
+    <div class="prose prose-sm ${textClass} max-w-none leading-relaxed prose-p:mb-4 last:prose-p:mb-0">
+      ${htmlContent}
+    </div>
+  </div>
+  ${type === "user" ? `<div class="w-8 h-8 bg-slate-900 rounded-lg flex-shrink-0 flex items-center justify-center text-white text-sm">${icon}</div>` : ""}
+`;
+
+  chatMessages.appendChild(div);
+  chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
+/* ================= FOLLOW-UPS ================= */
+function escapeHtml(text) {
+  const div = document.createElement("div");
+  div.innerText = text;
+  return div.innerHTML;
+}
+
+// Follow-up questions go to the explanation shown last
+function startConversation(id) {
+  conversationId = id;
+  document.getElementById("followupToggle").classList.remove("hidden");
+  document.getElementById("followupMode").checked = true;
+}
+
+function askFollowup(question) {
+  addMessage("👤", escapeHtml(question), "user");
+  document.getElementById("question").value = "";
+  setLoading(true);
+
+  fetch(`/api/explanations/${conversationId}/turns`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ question })
+  })
+    .then(r => r.json())
+    .then(data => {
+      if (data.error) {
+        addMessage("🤖", "عفواً: " + data.error, "bot");
+        return;
+      }
+      addMessage("🤖", data.answer_html, "bot");
+    })
+    .catch(() => {
+      addMessage("🤖", "صار خطأ في الاتصال بالذكاء الاصطناعي. جرب مرة ثانية.", "bot");
+    })
+    .finally(() => {
+      setLoading(false);
+    });
+}
+
+/* ================= ASK AI ================= */
+function askAI() {
+  const query = document.getElementById("question").value.trim();
+  const subject = document.getElementById("subject").value;
+
+  if (!query) return;
+  if (conversationId && document.getElementById("followupMode").checked) {
+    askFollowup(query);
+    return;
+  }
+
+  addMessage("👤", query, "user");
+  document.getElementById("question").value = "";
+  setLoading(true);
+
+  fetch("/ai-room", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ subject, query })
+  })
+    .then(r => r.json())
+    .then(data => {
+      if (data.error) {
+        addMessage("🤖", "عفواً: " + data.error, "bot");
+        return;
+      }
+
+      if (data.notice) {
+        addMessage("🤖", escapeHtml(data.notice), "bot");
+      }
+      addMessage("🤖", data.explanation_html, "bot");
+      if (!data.id) {
+        // Provider down and no stored explanation: lesson passages only
+        return;
+      }
+      loadHistory();
+      startConversation(data.id);
+
+      renderQuiz(data.id, data.quiz || []);
+    })
+    .catch(err => {
+      addMessage("🤖", "صار خطأ في الاتصال بالذكاء الاصطناعي. جرب مرة ثانية.", "bot");
+    })
+    .finally(() => {
+      setLoading(false);
+    });
+}
+
+/* ================= CHECK ================= */
+function checkAnswers() {
+  if (!currentExplanationId) return;
+
+  const answers = [];
+  for (let i = 0; i < quizLength; i++) {
+    const sel = document.querySelector(`input[name="q${i}"]:checked`);
+    answers.push(sel ? parseInt(sel.value) : null);
+  }
+
+  fetch(`/api/explanations/${currentExplanationId}/quiz`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ answers })
+  })
+    .then(r => r.json())
+    .then(data => {
+      if (data.error) {
+        alert(data.error);
+        return;
+      }
+      showResult(data.score, data.total, data.correct);
+    })
+    .catch(err => {
+      alert("خطأ في الاتصال");
+    });
+}
+
+function showResult(score, total, correctAnswers) {
+  correctAnswers.forEach((c, i) => {
+    // Highlight correct/incorrect
+    const allOptions = document.querySelectorAll(`input[name="q${i}"]`);
+    allOptions.forEach((inp, idx) => {
+      const parent = inp.closest("label");
+      if (idx === c) {
+        parent.classList.add("bg-green-50", "border-green-200");
+        parent.classList.remove("border-slate-200/50");
+      } else if (inp.checked && idx !== c) {
+        parent.classList.add("bg-red-50", "border-red-200");
+        parent.classList.remove("border-slate-200/50");
+      }
+    });
+  });
+
+  const icon = document.getElementById("modalIcon");
+  const title = document.getElementById("modalTitle");
+  const msg = document.getElementById("modalMessage");
+
+  if (score === total) {
+    icon.innerText = "🎉";
+    title.innerText = "ممتاز جداً!";
+    msg.innerText = `علاّمة فعلاً! جاوبت على كل الأسئلة (${score}/${total}) صح. استمر في التألق! 🚀`;
+  } else if (score >= total / 2) {
+    icon.innerText = "👍";
+    title.innerText = "كويس هلبة!";
+    msg.innerText = `جاوبت على ${score} من ${total} صح. راجع الأخطاء باش تثبت المعلومة في راسك.`;
+  } else {
+    icon.innerText = "💪";
+    title.innerText = "حاول مرة ثانية!";
+    msg.innerText = `جبت ${score} من ${total}. ما تستسلمش، عاود اقرأ الشرح وحاول مرة ثانية حتلقى روحك أحسن!`;
+  }
+
+  showOverlay(document.getElementById("resultModal"));
+}
+
+function closeModal() {
+  hideOverlay(document.getElementById("resultModal"));
+}
+
+/* ================= DELETE ================= */
+function confirmDelete(id) {
+  const modal = document.getElementById("confirmDeleteModal");
+  showOverlay(modal);
+  document.getElementById("confirmDeleteBtn").onclick = () => deleteExplanation(id);
+}
+
+function closeDeleteModal() {
+  const modal = document.getElementById("confirmDeleteModal");
+  hideOverlay(modal);
+}
+
+function deleteExplanation(id) {
+  const btn = document.getElementById("confirmDeleteBtn");
+  btn.disabled = true;
+  btn.innerText = "جاري الحذف...";
+
+  fetch(`/api/delete-explanation/${id}`, { method: 'POST' })
+    .then(r => r.json())
+    .then(data => {
+      if (data.success) {
+        loadHistory();
+        closeDeleteModal();
+      } else {
+        alert(data.error || "فشل الحذف");
+        closeDeleteModal();
+      }
+    })
+    .catch(err => {
+      alert("خطأ في الاتصال");
+      closeDeleteModal();
+    })
+    .finally(() => {
+      btn.disabled = false;
+      btn.innerText = "إي، احذف";
+    });
+}
+
+loadHistory();
+updateSubjectDisplay();
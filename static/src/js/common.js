@@ -0,0 +1,10 @@
+/* ================= SHARED HELPERS ================= */
+function showOverlay(el) {
+  el.classList.remove("hidden");
+  el.classList.add("flex");
+}
+
+function hideOverlay(el) {
+  el.classList.add("hidden");
+  el.classList.remove("flex");
+}
@@ -0,0 +1,99 @@
+function openModal(id) {
+  const source = document.getElementById(`explanation-${id}`);
+  document.getElementById("modalTitle").innerText = source.dataset.title;
+  document.getElementById("modalDate").innerText = source.dataset.date;
+
+  // Pre-rendered, sanitized HTML from the server
+  const contentBox = document.querySelector(".markdown-content");
+  contentBox.innerHTML = source.innerHTML;
+
+  const modal = document.getElementById("viewModal");
+  showOverlay(modal);
+
+  // Archived explanations are fetched from cold storage on first open
+  if (source.dataset.archived && !source.innerHTML.trim()) {
+    contentBox.innerText = "جاري التحميل...";
+    fetch(`/api/explanations/${id}`)
+      .then(r => r.json())
+      .then(data => {
+        if (data.error) {
+          contentBox.innerText = data.error;
+          return;
+        }
+        source.innerHTML = data.content_html;
+        contentBox.innerHTML = data.content_html;
+      })
+      .catch(() => {
+        contentBox.innerText = "خطأ في الاتصال";
+      });
+  }
+}
+
+function closeModal() {
+  const modal = document.getElementById("viewModal");
+  hideOverlay(modal);
+}
+
+// Close on escape
+document.addEventListener('keydown', (e) => {
+  if (e.key === 'Escape') {
+    closeModal();
+    closeDeleteModal();
+  }
+});
+
+/* ================= DELETE LOGIC ================= */
+let explanationIdToDelete = null;
+
+function confirmDelete(id) {
+  explanationIdToDelete = id;
+  const modal = document.getElementById("confirmDeleteModal");
+  showOverlay(modal);
+
+  document.getElementById("confirmDeleteBtn").onclick = () => deleteExplanation(id);
+}
+
+function closeDeleteModal() {
+  const modal = document.getElementById("confirmDeleteModal");
+  hideOverlay(modal);
+  explanationIdToDelete = null;
+}
+
+function deleteExplanation(id) {
+  const btn = document.getElementById("confirmDeleteBtn");
+  btn.disabled = true;
+  btn.innerText = "جاري الحذف...";
+  btn.classList.add("opacity-50");
+
+  fetch(`/api/delete-explanation/${id}`, {
+    method: 'POST'
+  })
+    .then(r => r.json())
+    .then(data => {
+      if (data.success) {
+        // Find the card and animate removal
+        const cards = document.querySelectorAll('.grid > div');
+        cards.forEach(card => {
+          // This is a bit hacky since we don't have IDs on elements, 
+          // but we can check the onclick attribute or just reload
+          if (card.getAttribute('onclick').includes(`confirmDelete(${id})`)) {
+            // Actually, the card onclick is openModal, let's fix that
+          }
+        });
+        // Simplest way: reload the page or use a more specific selector
+        window.location.reload();
+      } else {
+        alert(data.error || "فشل الحذف");
+        closeDeleteModal();
+      }
+    })
+    .catch(err => {
+      alert("خطأ في الاتصال");
+      closeDeleteModal();
+    })
+    .finally(() => {
+      btn.disabled = false;
+      btn.innerText = "إي، احذف";
+      btn.classList.remove("opacity-50");
+    });
+}
@@ -0,0 +1,183 @@
+"""
+Schools (tenants) served by one deployment.
+
+Every request belongs to the tenant whose hosts include the request's host
+name; any other host belongs to the default tenant, which uses the app's
+built-in settings. A tenant row's config (JSON) overrides any of:
+
+    curriculum            {study year: [subjects]}, replaces CURRICULUM
+    admin_phones          the school's admins (see its own users only)
+    default_credits       AI credits of a new account
+    trial_days            free trial length
+    ai_concurrency        OpenAI calls in flight at once, per worker
+    ai_rate_per_minute    OpenAI calls per minute across workers (0 = no limit)
+
+TenantRegistry keeps every tenant in memory and reloads them every
+TENANT_RELOAD_SECONDS, so resolving a request costs a dict lookup.
+
+Each tenant also gets a TenantQuota. Calls over either limit raise
+TenantBusy at once, so a school's exam rush queues against its own limits
+and not against other schools' requests.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_TENANT = "default"
+SETTINGS = ("curriculum", "admin_phones", "default_credits", "trial_days",
+            "ai_concurrency", "ai_rate_per_minute")
+
+
+class TenantBusy(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TenantConfig:
+    def __init__(self, slug, name, hosts=(), curriculum=None, admin_phones=(), default_credits=250,
+                 trial_days=60, ai_concurrency=8, ai_rate_per_minute=0):
+        self.slug = slug
+        self.name = name
+        self.hosts = tuple(h.strip().lower() for h in hosts if h.strip())
+        self.curriculum = dict(curriculum or {})
+        self.admin_phones = frozenset(p.strip() for p in admin_phones if p.strip())
+        self.default_credits = int(default_credits)
+        self.trial_days = int(trial_days)
+        self.ai_concurrency = int(ai_concurrency)
+        self.ai_rate_per_minute = int(ai_rate_per_minute)
+
+    @classmethod
+    def from_settings(cls, slug, name, hosts, settings, base):
+        """A tenant whose unset settings fall back to `base` (the default tenant)."""
+        values = {key: settings.get(key, getattr(base, key)) for key in SETTINGS}
+        return cls(slug, name or slug, hosts, **values)
+
+    @property
+    def study_years(self):
+        return list(self.curriculum)
+
+    def subjects(self, study_year):
+        return self.curriculum.get(study_year, [])
+
+    def to_dict(self):
+        return {"slug": self.slug, "name": self.name, "hosts": list(self.hosts),
+                **{key: getattr(self, key) for key in SETTINGS if key != "admin_phones"},
+                "admin_phones": sorted(self.admin_phones)}
+
+
+class TenantQuota:
+    def __init__(self, tenant, counter):
+        self.slug = tenant.slug
+        self.concurrency = tenant.ai_concurrency
+        self.rate_per_minute = tenant.ai_rate_per_minute
+        self._counter = counter  # incr(key, ttl) -> count, shared by all workers
+        self._slots = threading.BoundedSemaphore(self.concurrency) if self.concurrency > 0 else None
+
+    def matches(self, tenant):
+        return (self.concurrency, self.rate_per_minute) == (tenant.ai_concurrency, tenant.ai_rate_per_minute)
+
+    @contextmanager
+    def slot(self):
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            raise TenantBusy("concurrency", 5)
+        try:
+            if self.rate_per_minute > 0:
+                now = time.time()
+                window = int(now // 60)
+                if self._counter(f"ai-rate:{self.slug}:{window}", 60) > self.rate_per_minute:
+                    raise TenantBusy("rate", 60 - int(now % 60))
+            yield
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+
+class TenantRegistry:
+    def __init__(self, default, loader, counter, reload_seconds=300.0):
+        self.base = default
+        self.reload_seconds = reload_seconds
+        self._loader = loader  # (base) -> [TenantConfig]
+        self._counter = counter
+        self._by_slug = {default.slug: default}
+        self._by_host = {}
+        self._quotas = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def reload(self):
+        try:
+            tenants = self._loader(self.base)
+        except Exception as e:
+            # Keep serving the last good config; retry after the next interval
+            print(f">>> Tenant reload failed: {e}")
+            self._loaded_at = time.monotonic()
+            return
+        by_slug = {self.base.slug: self.base}
+        by_host = {}
+        for tenant in tenants:
+            by_slug[tenant.slug] = tenant
+            for host in tenant.hosts:
+                by_host[host] = tenant
+        self._by_slug, self._by_host = by_slug, by_host
+        self._loaded_at = time.monotonic()
+
+    def _fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reload_seconds:
+            with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reload_seconds:
+                    self.reload()
+
+    def resolve(self, host):
+        self._fresh()
+        host = (host or "").split(":", 1)[0].strip().lower()
+        return self._by_host.get(host) or self._by_slug[DEFAULT_TENANT]
+
+    def get(self, slug):
+        self._fresh()
+        return self._by_slug.get(slug or DEFAULT_TENANT) or self._by_slug[DEFAULT_TENANT]
+
+    def all(self):
+        self._fresh()
+        return list(self._by_slug.values())
+
+    def quota(self, tenant):
+        quota = self._quotas.get(tenant.slug)
+        if quota is None or not quota.matches(tenant):
+            with self._lock:
+                quota = self._quotas.get(tenant.slug)
+                if quota is None or not quota.matches(tenant):
+                    # Calls in flight release the semaphore they took
+                    quota = self._quotas[tenant.slug] = TenantQuota(tenant, self._counter)
+        return quota
+
+
+def clean_settings(settings):
+    """Validated copy of a tenant's config JSON; raises ValueError with a message for the admin."""
+    if not isinstance(settings, dict):
+        raise ValueError("الإعدادات لازم تكون JSON object")
+    unknown = set(settings) - set(SETTINGS)
+    if unknown:
+        raise ValueError(f"إعدادات غير معروفة: {', '.join(sorted(unknown))}")
+    cleaned = {}
+    if "curriculum" in settings:
+        curriculum = settings["curriculum"]
+        if not isinstance(curriculum, dict) or not all(
+            isinstance(year, str) and isinstance(subjects, list) and all(isinstance(s, str) for s in subjects)
+            for year, subjects in curriculum.items()
+        ):
+            raise ValueError("المنهج لازم يكون {السنة: [المواد]}")
+        cleaned["curriculum"] = curriculum
+    if "admin_phones" in settings:
+        phones = settings["admin_phones"]
+        if not isinstance(phones, list) or not all(isinstance(p, str) for p in phones):
+            raise ValueError("أرقام المشرفين لازم تكون قائمة")
+        cleaned["admin_phones"] = [p.strip() for p in phones if p.strip()]
+    for key in ("default_credits", "trial_days", "ai_concurrency", "ai_rate_per_minute"):
+        if key in settings:
+            value = settings[key]
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                raise ValueError(f"{key} لازم يكون رقم صحيح موجب")
+            cleaned[key] = value
+    return cleaned
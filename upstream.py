@@ -0,0 +1,94 @@
+"""
+Health of the model provider, cached per worker.
+
+UpstreamHealth is a small circuit breaker. Real calls report success or
+failure; after AI_FAILURE_THRESHOLD upstream failures in a row the provider
+is marked down and available() answers False at once, so requests are served
+from stored content (or fail fast) instead of each waiting on a timeout.
+
+While down, a background probe (a cheap API call) runs every
+AI_PROBE_SECONDS; a successful probe, or a single trial request let through
+after AI_COOLDOWN_SECONDS, marks the provider up again.
+"""
+import threading
+import time
+
+
+class UpstreamHealth:
+    def __init__(self, probe=None, failure_threshold=3, cooldown=30.0, probe_interval=15.0):
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self.up = True
+        self.failures = 0
+        self.down_since = None
+        self.last_error = None
+        self.checked_at = None
+        self._trial_at = 0.0
+        self._lock = threading.Lock()
+        self._prober = None
+
+    def available(self):
+        """True if a request may call the provider now."""
+        if self.up:
+            return True
+        with self._lock:
+            # Half-open: one trial request per cooldown period
+            now = time.monotonic()
+            if now - self._trial_at >= self.cooldown:
+                self._trial_at = now
+                return True
+        return False
+
+    def record_success(self):
+        with self._lock:
+            if not self.up:
+                print(">>> AI provider is back up")
+            self.up = True
+            self.failures = 0
+            self.down_since = None
+            self.checked_at = time.time()
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"[:300]
+            self.checked_at = time.time()
+            if self.up and self.failures >= self.failure_threshold:
+                self.up = False
+                self.down_since = time.time()
+                self._trial_at = time.monotonic()
+                print(f">>> AI provider marked down after {self.failures} failures: {self.last_error}")
+        if not self.up:
+            self._start_prober()
+
+    def _start_prober(self):
+        if self.probe is None:
+            return
+        with self._lock:
+            if self._prober and self._prober.is_alive():
+                return
+            self._prober = threading.Thread(target=self._probe_loop, daemon=True)
+            self._prober.start()
+
+    def _probe_loop(self):
+        while not self.up:
+            time.sleep(self.probe_interval)
+            try:
+                self.probe()
+            except Exception as e:
+                with self._lock:
+                    self.last_error = f"{type(e).__name__}: {e}"[:300]
+                    self.checked_at = time.time()
+                continue
+            self.record_success()
+
+    def status(self):
+        return {
+            "up": self.up,
+            "consecutive_failures": self.failures,
+            "down_since": self.down_since,
+            "last_error": self.last_error,
+            "checked_at": self.checked_at,
+        }